@@ -0,0 +1,242 @@
+import argparse
+import concurrent.futures
+import csv
+import functools
+import json
+import multiprocessing
+import os
+import resource
+import time
+
+from conversion_cache import ConversionCache
+from profiling import peak_rss
+
+
+def read_manifest(path):
+    """Read conversion jobs from a JSON list or a CSV file.
+
+    Every job needs ``checkpoint``, ``config``, ``channels``, ``classes``
+    and ``output``; ``in_channels``, ``fat``, ``quantize`` and
+    ``shard_size`` are optional. Relative paths are taken relative to the
+    manifest.
+    """
+    with open(path, "r") as f:
+        if path.endswith(".csv"):
+            jobs = [dict(row) for row in csv.DictReader(f)]
+        else:
+            jobs = json.load(f)
+
+    root = os.path.dirname(os.path.abspath(path))
+    for job in jobs:
+        for key in ("checkpoint", "config", "output"):
+            job[key] = os.path.join(root, job[key])
+        # empty CSV cells are missing values
+        for key in ("in_channels", "shard_size", "fat", "quantize"):
+            if job.get(key) == "":
+                job[key] = None
+        for key in ("channels", "classes", "in_channels", "shard_size"):
+            if job.get(key) is not None:
+                job[key] = int(job[key])
+    return jobs
+
+
+def _init_worker(threads, max_memory):
+    import torch
+
+    torch.set_num_threads(threads)
+    if max_memory:
+        resource.setrlimit(resource.RLIMIT_AS, (max_memory, max_memory))
+
+
+def _job_options(job):
+    """Everything besides checkpoint and config that shapes the output"""
+    return {
+        key: job.get(key)
+        for key in (
+            "channels",
+            "classes",
+            "in_channels",
+            "fat",
+            "quantize",
+            "shard_size",
+        )
+    }
+
+
+def convert_job(job, cache=None):
+    """Load, optimize and export one checkpoint, timing every stage.
+
+    With a ConversionCache, unchanged conversions are copied from the
+    cache instead.
+    """
+    result = {"checkpoint": job["checkpoint"], "output": job["output"]}
+    if cache is None:
+        return _convert_job(job, result)
+
+    start = time.perf_counter()
+    key = cache.key(job["checkpoint"], job["config"], _job_options(job))
+    if cache.fetch(key, job["output"]):
+        result.update(cached=True, total_s=time.perf_counter() - start)
+        return result
+    result = _convert_job(job, result)
+    if "error" not in result:
+        cache.store(key, job["output"])
+    result["cached"] = False
+    return result
+
+
+def _convert_job(job, result):
+    # imported here so that only the workers pay for torch
+    from convert import load_meshnet
+    from meshnet2tfjs import DEFAULT_SHARD_SIZE, meshnet2tfjs
+    from optimize import optimize_for_inference
+
+    try:
+        start = time.perf_counter()
+        model = load_meshnet(
+            job["checkpoint"],
+            job["config"],
+            job["channels"],
+            job["classes"],
+            job.get("in_channels") or 1,
+            job.get("fat"),
+        )
+        loaded = time.perf_counter()
+        model = optimize_for_inference(model)
+        fused = time.perf_counter()
+        meshnet2tfjs(
+            model,
+            job["output"],
+            job.get("shard_size") or DEFAULT_SHARD_SIZE,
+            job.get("quantize"),
+        )
+        exported = time.perf_counter()
+    except Exception as e:
+        result["error"] = f"{e.__class__.__name__}: {e}"
+        return result
+
+    result.update(
+        load_s=loaded - start,
+        fuse_s=fused - loaded,
+        export_s=exported - fused,
+        total_s=exported - start,
+        worker_peak_rss=peak_rss(),
+    )
+    return result
+
+
+def convert_all(
+    jobs,
+    workers=None,
+    threads=1,
+    max_memory=None,
+    tasks_per_child=None,
+    cache=None,
+):
+    """Convert every job in a spawned process pool.
+
+    Args:
+        jobs (list): Jobs as returned by read_manifest.
+        workers (int): Pool size, defaults to the CPU count.
+        threads (int): torch threads per worker.
+        max_memory (int): Address-space limit per worker in bytes.
+        tasks_per_child (int): Restart workers after this many jobs.
+        cache (ConversionCache): Reuse unchanged conversions.
+
+    Returns:
+        list: One result dict per job, in manifest order.
+    """
+    kwargs = {}
+    if tasks_per_child:
+        kwargs["max_tasks_per_child"] = tasks_per_child
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(threads, max_memory),
+        **kwargs,
+    ) as pool:
+        job_fn = functools.partial(convert_job, cache=cache)
+        return list(pool.map(job_fn, jobs))
+
+
+def print_report(results):
+    print(
+        f"{'output':<40} {'load s':>8} {'fuse s':>8} {'export s':>9} "
+        f"{'total s':>8} {'peak MiB':>9}"
+    )
+    for r in results:
+        name = os.path.relpath(r["output"])
+        if "error" in r:
+            print(f"{name:<40} FAILED {r['error']}")
+            continue
+        if r.get("cached"):
+            print(f"{name:<40} {'cached':>37} {r['total_s']:>8.2f}")
+            continue
+        print(
+            f"{name:<40} {r['load_s']:>8.2f} {r['fuse_s']:>8.2f} "
+            f"{r['export_s']:>9.2f} {r['total_s']:>8.2f} "
+            f"{r['worker_peak_rss'] / 2**20:>9.1f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert a manifest of MeshNet checkpoints to tfjs"
+    )
+    parser.add_argument("manifest", help="JSON or CSV list of jobs")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument(
+        "--threads", type=int, default=1, help="torch threads per worker"
+    )
+    parser.add_argument(
+        "--max-memory-gb",
+        type=float,
+        default=None,
+        help="address-space limit per worker",
+    )
+    parser.add_argument(
+        "--tasks-per-child",
+        type=int,
+        default=None,
+        help="restart a worker after this many conversions",
+    )
+    parser.add_argument("--cache-dir", help="reuse unchanged conversions")
+    parser.add_argument(
+        "--cache-size-gb",
+        type=float,
+        default=2,
+        help="evict least recently used conversions beyond this size",
+    )
+    parser.add_argument("--report", help="write per-model timings as JSON")
+    args = parser.parse_args()
+
+    max_memory = None
+    if args.max_memory_gb:
+        max_memory = int(args.max_memory_gb * 2**30)
+    cache = None
+    if args.cache_dir:
+        max_bytes = int(args.cache_size_gb * 2**30)
+        cache = ConversionCache(args.cache_dir, max_bytes)
+    jobs = read_manifest(args.manifest)
+    start = time.perf_counter()
+    results = convert_all(
+        jobs,
+        args.workers,
+        args.threads,
+        max_memory,
+        args.tasks_per_child,
+        cache,
+    )
+    print_report(results)
+    print(f"{len(jobs)} models in {time.perf_counter() - start:.2f} s")
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(results, f, indent=4)
+    if any("error" in r for r in results):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import statistics
+import time
+
+import torch
+
+# config json, hidden channels and classes of the built-in model configs
+MODELS = {
+    "MeshNet_38_or_64": ("MeshNet_38_or_64.json", 21, 3),
+    "MeshNet_68": ("MeshNet_68.json", 71, 3),
+    "modelAE": ("modelAE.json", 5, 3),
+}
+
+
+def load_model(spec):
+    """A fused eval-mode model from a MODELS name, a ``config.json:
+    channels:classes`` triple or a tfjs model.json path"""
+    if spec.endswith("model.json"):
+        from js2pytorch import tfjs_to_pytorch
+
+        return tfjs_to_pytorch(spec).eval()
+
+    from meshnet import enMesh_checkpoint
+    from optimize import optimize_for_inference
+
+    if spec in MODELS:
+        config_file, channels, n_classes = MODELS[spec]
+    else:
+        config_file, channels, n_classes = spec.split(":")
+    here = os.path.dirname(os.path.abspath(__file__))
+    model = enMesh_checkpoint(
+        1, int(n_classes), int(channels), os.path.join(here, config_file)
+    ).eval()
+    return optimize_for_inference(model)
+
+
+def phantom(cube, seed=0):
+    """Brain-like input: noisy ellipsoid on a zero background"""
+    generator = torch.Generator().manual_seed(seed)
+    axis = torch.linspace(-1, 1, cube)
+    z, y, x = torch.meshgrid(axis, axis, axis, indexing="ij")
+    inside = (x**2 + 1.5 * y**2 + 2 * z**2) < 0.8
+    noise = torch.rand((cube, cube, cube), generator=generator)
+    return (inside * (0.5 + 0.5 * noise))[None, None]
+
+
+def _layers(model):
+    return getattr(model, "model", model)
+
+
+def _timed(run, model):
+    """Mark ``model`` as the module ``run`` calls, so its layers can be
+    timed with forward hooks"""
+    run.module = model
+    return run
+
+
+def _forward(model):
+    def run(x):
+        with torch.inference_mode():
+            return model(x)
+
+    return run
+
+
+def _eager(model, options):
+    return _timed(_forward(model), model)
+
+
+def _sliced(model, options):
+    from lowmem import sliced_forward
+
+    def run(x):
+        with torch.inference_mode():
+            return sliced_forward(_layers(model), x, options["out_slice"])
+
+    # the sliced output conv runs outside its module and is not timed
+    return _timed(run, model)
+
+
+def _tiled(model, options):
+    from tiling import tiled_inference
+
+    budget = options["tile_budget_mb"] * 2**20
+
+    def run(x):
+        return tiled_inference(model, x, memory_budget=budget)
+
+    return _timed(run, model)
+
+
+def _plan(model, options):
+    from plan import ExecutionPlan
+
+    return ExecutionPlan.from_model(model)
+
+
+def _cropped(model, options):
+    from cropping import cropped_inference
+
+    def run(x):
+        return cropped_inference(model, x, options["crop_padding"])
+
+    return _timed(run, model)
+
+
+def _frozen(model, options):
+    # TorchScript and compiled graphs run no module hooks, so neither
+    # mode has per-layer times
+    from freeze import freeze
+
+    return _forward(freeze(model))
+
+
+def _compiled(model, options):
+    from freeze import compile_model
+
+    return _forward(compile_model(model, options["compile_cache"]))
+
+
+def _bfloat16(model, options):
+    from precision import reduced_precision
+
+    return _eager(reduced_precision(model, torch.bfloat16), options)
+
+
+def _float16(model, options):
+    from precision import reduced_precision
+
+    return _eager(reduced_precision(model, torch.float16), options)
+
+
+# inference mode name -> setup(model, options) returning run(x); a
+# ``run.module`` is the nn.Module whose layers run_point times
+MODES = {
+    "eager": _eager,
+    "sliced": _sliced,
+    "tiled": _tiled,
+    "plan": _plan,
+    "cropped": _cropped,
+    "frozen": _frozen,
+    "compiled": _compiled,
+    "bfloat16": _bfloat16,
+    "float16": _float16,
+}
+
+
+def _time_layers(model, run, x):
+    """Seconds spent in every leaf module during one run"""
+    times, starts, handles = {}, {}, []
+    leaves = [
+        (f"{i}:{m.__class__.__name__}", m)
+        for i, m in enumerate(_layers(model).modules())
+        if len(m._modules) == 0
+    ]
+    for name, module in leaves:
+
+        def pre(module, args, name=name):
+            starts[name] = time.perf_counter()
+
+        def post(module, args, output, name=name):
+            times[name] = times.get(name, 0.0) + (
+                time.perf_counter() - starts[name]
+            )
+
+        handles.append(module.register_forward_pre_hook(pre))
+        handles.append(module.register_forward_hook(post))
+    try:
+        run(x)
+    finally:
+        for handle in handles:
+            handle.remove()
+    return times
+
+
+def run_point(spec, cube, threads, mode, options, repeats=1, warmup=0):
+    """One benchmark point; meant to run in its own process.
+
+    Per-layer seconds (``layers``) are recorded for every mode that runs
+    its layers as Python modules; plan, frozen and compiled do not.
+    """
+    torch.set_num_threads(threads)
+    torch.manual_seed(0)
+    model = load_model(spec)
+    run = MODES[mode](model, options)
+    x = phantom(cube)
+    for _ in range(warmup):
+        run(x)
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run(x)
+        seconds.append(time.perf_counter() - start)
+    result = {
+        "seconds": statistics.median(seconds),
+        "voxels_per_s": cube**3 / statistics.median(seconds),
+    }
+    module = getattr(run, "module", None)
+    if module is not None:
+        result["layers"] = _time_layers(module, run, x)
+    return result
+
+
+def sweep(specs, cubes, threads, modes, options, repeats=1, warmup=0):
+    """Run every point of the sweep in a fresh process"""
+    from profiling import run_isolated
+
+    results = []
+    for spec, cube, n, mode in itertools.product(specs, cubes, threads, modes):
+        point = {"model": spec, "cube": cube, "threads": n, "mode": mode}
+        try:
+            result, peak = run_isolated(
+                run_point, spec, cube, n, mode, options, repeats, warmup
+            )
+            point.update(result, peak_rss=peak)
+        except Exception as e:
+            point["error"] = f"{e.__class__.__name__}: {e}"
+        print(_format(point), flush=True)
+        results.append(point)
+    return results
+
+
+def _format(point):
+    name = f"{point['model']} {point['cube']}^3 x{point['threads']} "
+    name += point["mode"]
+    if "error" in point:
+        return f"{name:<44} FAILED {point['error']}"
+    return (
+        f"{name:<44} {point['seconds']:>9.3f} s "
+        f"{point['voxels_per_s'] / 1e6:>8.2f} Mvox/s "
+        f"{point['peak_rss'] / 2**20:>9.1f} MiB"
+    )
+
+
+def _key(point):
+    return point["model"], point["cube"], point["threads"], point["mode"]
+
+
+def compare(results, previous, threshold=0.1):
+    """Points that got slower or bigger by more than ``threshold``"""
+    before = {_key(p): p for p in previous if "error" not in p}
+    regressions = []
+    for point in results:
+        old = before.get(_key(point))
+        if old is None or "error" in point:
+            continue
+        for metric in ("seconds", "peak_rss"):
+            if old[metric] and point[metric] > old[metric] * (1 + threshold):
+                regressions.append(
+                    (_key(point), metric, old[metric], point[metric])
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark MeshNet configs across sizes and threads"
+    )
+    parser.add_argument(
+        "--models",
+        nargs="+",
+        default=list(MODELS),
+        help="MODELS names, config.json:channels:classes or model.json",
+    )
+    parser.add_argument(
+        "--cubes", type=int, nargs="+", default=[38, 64, 128, 256]
+    )
+    parser.add_argument(
+        "--threads", type=int, nargs="+", default=[os.cpu_count()]
+    )
+    parser.add_argument(
+        "--modes", nargs="+", default=["eager"], choices=list(MODES)
+    )
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--warmup", type=int, default=0)
+    parser.add_argument("--out-slice", type=int, default=1)
+    parser.add_argument("--tile-budget-mb", type=int, default=1024)
+    parser.add_argument("--crop-padding", type=int, default=18)
+    parser.add_argument(
+        "--compile-cache",
+        default=None,
+        help="persistent inductor cache for the 'compiled' mode",
+    )
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--compare", help="previous benchmark JSON")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="relative slowdown or growth reported as a regression",
+    )
+    args = parser.parse_args()
+
+    options = {
+        "out_slice": args.out_slice,
+        "tile_budget_mb": args.tile_budget_mb,
+        "crop_padding": args.crop_padding,
+        "compile_cache": args.compile_cache,
+    }
+    results = sweep(
+        args.models,
+        args.cubes,
+        args.threads,
+        args.modes,
+        options,
+        args.repeats,
+        args.warmup,
+    )
+    with open(args.output, "w") as f:
+        json.dump(
+            {
+                "torch": torch.__version__,
+                "platform": platform.platform(),
+                "processor": platform.processor(),
+                "cpu_count": os.cpu_count(),
+                "options": options,
+                "results": results,
+            },
+            f,
+            indent=4,
+        )
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            previous = json.load(f)["results"]
+        regressions = compare(results, previous, args.threshold)
+        for key, metric, old, new in regressions:
+            print(f"REGRESSION {key} {metric}: {old:.4g} -> {new:.4g}")
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+import argparse
+import itertools
+import time
+
+import numpy as np
+
+# largest number of non-zero offset components per connectivity
+CONNECTIVITY = {6: 1, 18: 2, 26: 3}
+
+
+def half_neighbourhood(conn):
+    """Offsets of the neighbours a raster scan (first axis fastest) visits
+    before a voxel; with their mirror images they make up the full 6, 18
+    or 26 neighbourhood"""
+    return [
+        offset
+        for offset in itertools.product((-1, 0, 1), repeat=3)
+        if offset[::-1] < (0, 0, 0)
+        and sum(map(abs, offset)) <= CONNECTIVITY[conn]
+    ]
+
+
+def _shifted(shape, offset):
+    """Slices of a voxel and of its neighbour at ``offset``"""
+    here, there = [], []
+    for d, n in zip(offset, shape):
+        here.append(slice(max(-d, 0), n - max(d, 0)))
+        there.append(slice(max(d, 0), n - max(-d, 0)))
+    return tuple(here), tuple(there)
+
+
+def _find(parent):
+    """Point every entry straight at its root"""
+    while True:
+        grand = parent[parent]
+        if np.array_equal(grand, parent):
+            return parent
+        parent = grand
+
+
+def _union(parent, a, b):
+    """Merge the sets of every ``a[i]``, ``b[i]`` pair.
+
+    Vectorized hooking: each round links the larger root of every
+    unmerged pair to the smaller one and compresses all paths, so a set's
+    root is always its smallest index.
+    """
+    while len(a):
+        ra, rb = parent[a], parent[b]
+        split = ra != rb
+        a, b, ra, rb = a[split], b[split], ra[split], rb[split]
+        if not len(a):
+            break
+        np.minimum.at(parent, np.maximum(ra, rb), np.minimum(ra, rb))
+        parent[:] = _find(parent)
+    return parent
+
+
+def components(bw, conn=26):
+    """Connected components of equal non-zero values.
+
+    Runs of equal voxels along the scan's fastest axis are connected by
+    construction, so they become the union-find nodes; every other
+    neighbour offset only contributes one edge per pair of touching
+    runs.
+
+    Args:
+        bw (np.ndarray): 3D integer volume, zero is background.
+        conn (int): 6, 18 or 26 neighbour connectivity.
+
+    Returns:
+        tuple: The flat (first axis fastest) index of the first voxel of
+        every component, in scan order, and the component number
+        (1-based, 0 for background) of every voxel.
+    """
+    if conn not in CONNECTIVITY:
+        raise ValueError("bwlabel: conn must be 6, 18 or 26")
+    # reversed axes: the scan order of BWLabeler is now C order
+    vol = np.ascontiguousarray(bw.T)
+    # equality tests only, so the narrowest dtype saves bandwidth
+    for dtype in (np.uint8, np.uint16):
+        if vol.max(initial=0) <= np.iinfo(dtype).max:
+            vol = vol.astype(dtype)
+            break
+    foreground = vol != 0
+    starts = foreground.copy()
+    starts[..., 1:] &= vol[..., 1:] != vol[..., :-1]
+    dtype = np.int32 if vol.size < 2**31 else np.int64
+    run = np.cumsum(starts, dtype=dtype).reshape(vol.shape) - 1
+    first_voxel = np.flatnonzero(starts)
+
+    parent = np.arange(len(first_voxel), dtype=dtype)
+    for offset in half_neighbourhood(conn):
+        offset = offset[::-1]
+        if offset == (0, 0, -1):
+            continue
+        here, there = _shifted(vol.shape, offset)
+        # two equal runs touch along a stretch that begins where one of
+        # them starts or at the edge of the window; one edge is enough
+        edge = starts[here] | starts[there]
+        edge[..., 0] = True
+        edge &= foreground[here]
+        edge &= vol[here] == vol[there]
+        _union(parent, run[here][edge], run[there][edge])
+
+    roots, numbers = np.unique(parent, return_inverse=True)
+    labels = np.zeros(vol.shape, dtype=np.uint32)
+    labels[foreground] = (numbers.astype(np.uint32) + 1)[run[foreground]]
+    return first_voxel[roots], labels.T
+
+
+def bwlabel(img, conn=26, binarize=False, only_largest=False):
+    """Python counterpart of BWLabeler.bwlabel in bwlabels.js.
+
+    ``img`` is indexed like the ``dim`` of the JavaScript version (first
+    axis fastest in memory, as NIfTI volumes loaded by nibabel are) and
+    the output is identical: components are numbered by their first
+    voxel in that scan order. With ``only_largest`` every value keeps
+    only its largest component (ties go to the later one) and the result
+    holds the original values instead of component numbers.
+
+    Returns:
+        tuple: The number of components (or, with ``only_largest``, the
+        largest value) and a uint32 volume.
+    """
+    img = np.asarray(img)
+    if img.ndim == 2:
+        img = img[..., None]
+    if img.ndim != 3 or img.shape[0] < 2 or img.shape[1] < 2:
+        raise ValueError("bwlabel: img must be 2 or 3-dimensional")
+    if binarize:
+        bw = (img != 0).astype(np.uint32)
+    else:
+        bw = img.astype(np.uint32)
+
+    roots, labels = components(bw, conn)
+    if not only_largest:
+        return len(roots), labels
+
+    # per value, the largest component wins; ties go to the later one
+    sizes = np.bincount(labels.ravel(order="F"), minlength=len(roots) + 1)
+    values = bw.ravel(order="F")[roots]
+    number = np.arange(1, len(roots) + 1)
+    order = np.lexsort((number, sizes[1:], values))
+    last = np.ones(len(order), dtype=bool)
+    last[:-1] = values[order][1:] != values[order][:-1]
+    keep = np.zeros(len(roots) + 1, dtype=np.uint32)
+    keep[number[order][last]] = values[order][last]
+    return int(bw.max(initial=0)), keep[labels]
+
+
+def keep_largest_component(segmentation, conn=26):
+    """Remove all but the largest connected component of every label"""
+    return bwlabel(segmentation, conn, only_largest=True)[1].astype(
+        segmentation.dtype, copy=False
+    )
+
+
+def brain_mask(segmentation, conn=26):
+    """Largest connected non-zero region, as brainchop's post-processing"""
+    return bwlabel(segmentation, conn, binarize=True, only_largest=True)[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Keep the largest component of every label of a "
+        "segmentation"
+    )
+    parser.add_argument("input", help="NIfTI or .npy label volume")
+    parser.add_argument("output", help="NIfTI or .npy output")
+    parser.add_argument("--conn", type=int, default=26, choices=[6, 18, 26])
+    parser.add_argument(
+        "--binarize",
+        action="store_true",
+        help="mask everything outside the largest non-zero region instead",
+    )
+    args = parser.parse_args()
+
+    if args.input.endswith(".npy"):
+        segmentation, affine = np.load(args.input), None
+    else:
+        import nibabel as nib
+
+        image = nib.load(args.input)
+        segmentation, affine = np.asanyarray(image.dataobj), image.affine
+
+    start = time.perf_counter()
+    if args.binarize:
+        result = segmentation * brain_mask(segmentation, args.conn)
+    else:
+        result = keep_largest_component(segmentation, args.conn)
+    print(f"{time.perf_counter() - start:.3f} s")
+
+    if affine is None:
+        np.save(args.output, result)
+    else:
+        import nibabel as nib
+
+        nib.save(nib.Nifti1Image(result, affine), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+import argparse
+import copy
+import time
+
+import torch
+from torch.utils.checkpoint import checkpoint
+
+# edge of the cube each layer is probed on; saved activations scale
+# linearly with the voxel count of same-padded convs
+PROBE_CUBE = 8
+
+
+def layer_costs(layers, shape):
+    """What every layer keeps for backward when run on an input of
+    ``shape`` (N, C, D, H, W).
+
+    Each layer runs once on a small probe volume (a copy, so BatchNorm
+    statistics are left alone) while saved_tensors_hooks collect what
+    autograd keeps; sizes are scaled to ``shape``.
+
+    Returns:
+        dict: Per layer, ``saved`` bytes besides its input, the
+        ``output`` bytes and whether it keeps its ``input`` and its
+        ``output`` (an in-place activation), which then is the next
+        layer's input and must not be counted twice.
+    """
+    param = next(layers.parameters())
+    probe = torch.rand(
+        (1, shape[1]) + (PROBE_CUBE,) * 3,
+        dtype=param.dtype,
+        device=param.device,
+    )
+    scale = shape[0]
+    for size in shape[2:]:
+        scale *= size / PROBE_CUBE
+
+    costs = {"saved": [], "output": [], "input": [], "keeps_output": []}
+    x = probe.requires_grad_()
+    for layer in layers:
+        layer = copy.deepcopy(layer).train()
+        weights = {p.untyped_storage().data_ptr() for p in layer.parameters()}
+        storages = {}
+
+        def pack(tensor, weights=weights, storages=storages):
+            ptr = tensor.untyped_storage().data_ptr()
+            if ptr not in weights:
+                storages[ptr] = tensor.untyped_storage().nbytes()
+            return tensor
+
+        with torch.autograd.graph.saved_tensors_hooks(pack, lambda t: t):
+            y = layer(x)
+        input_ptr = x.untyped_storage().data_ptr()
+        output_ptr = y.untyped_storage().data_ptr()
+        costs["input"].append(input_ptr in storages)
+        costs["keeps_output"].append(output_ptr in storages)
+        storages.pop(input_ptr, None)
+        costs["saved"].append(int(sum(storages.values()) * scale))
+        costs["output"].append(int(y.numel() * y.element_size() * scale))
+        x = y.detach().requires_grad_()
+    return costs
+
+
+class CheckpointPlan:
+    """Segments of a layer stack for train_forward.
+
+    ``segments`` are ``(start, stop, checkpointed)`` triples; a
+    checkpointed segment keeps only its input and recomputes its layers
+    in backward. ``peak`` is the estimated activation memory of a
+    training step and ``recomputed`` the layers run twice.
+    """
+
+    def __init__(self, segments, costs, input_nbytes):
+        self.segments = segments
+        outputs = costs["output"]
+
+        def input_nbytes_of(i):
+            return outputs[i - 1] if i else input_nbytes
+
+        def inside(start, stop):
+            total = sum(costs["saved"][start:stop])
+            for i in range(start, stop):
+                shared = i > start and costs["keeps_output"][i - 1]
+                if costs["input"][i] and not shared:
+                    total += input_nbytes_of(i)
+            return total
+
+        stored, transient = 0, 0
+        for start, stop, checkpointed in segments:
+            if checkpointed:
+                stored += input_nbytes_of(start)
+                transient = max(transient, inside(start, stop))
+            else:
+                stored += inside(start, stop)
+        # gradients of the widest activation and of its input in backward
+        gradients = 2 * max(outputs + [input_nbytes])
+        self.peak = stored + transient + gradients
+        self.recomputed = sum(
+            stop - start
+            for start, stop, checkpointed in segments
+            if checkpointed
+        )
+
+    def to_dict(self):
+        return {
+            "segments": [list(segment) for segment in self.segments],
+            "peak": self.peak,
+            "recomputed": self.recomputed,
+        }
+
+    def __repr__(self):
+        return (
+            f"CheckpointPlan({self.segments}, peak={self.peak / 2**20:.1f}"
+            f" MiB, recomputed={self.recomputed})"
+        )
+
+
+def _balanced_segments(saved, stop, k):
+    """Split layers [0, stop) into ``k`` consecutive segments with the
+    smallest largest segment (the recomputation transient)"""
+    prefix = [0]
+    for s in saved[:stop]:
+        prefix.append(prefix[-1] + s)
+    inf = float("inf")
+    # best[j][i]: smallest largest segment of layers [0, i) in j segments
+    best = [[inf] * (stop + 1) for _ in range(k + 1)]
+    cut = [[0] * (stop + 1) for _ in range(k + 1)]
+    best[0][0] = 0
+    for j in range(1, k + 1):
+        for i in range(j, stop + 1):
+            for h in range(j - 1, i):
+                cost = max(best[j - 1][h], prefix[i] - prefix[h])
+                if cost < best[j][i]:
+                    best[j][i], cut[j][i] = cost, h
+    bounds, i = [], stop
+    for j in range(k, 0, -1):
+        bounds.append((cut[j][i], i))
+        i = cut[j][i]
+    return bounds[::-1]
+
+
+def plan_checkpoints(layers, shape, memory_budget):
+    """The plan with the least recomputation that fits ``memory_budget``.
+
+    The last ``m`` layers run normally, as in checkpoint_sequential, and
+    the rest are split into balanced checkpointed segments; ``m`` is as
+    large and the number of segments as good as the budget allows. If
+    nothing fits, the plan with the smallest estimated peak is returned.
+    """
+    costs = layer_costs(layers, shape)
+    saved = costs["saved"]
+    n = len(saved)
+    itemsize = next(layers.parameters()).element_size()
+    input_nbytes = int(torch.Size(shape).numel()) * itemsize
+    smallest = None
+    for normal in range(n, -1, -1):
+        stop = n - normal
+        tail = [(stop, n, False)] if normal else []
+        segmentations = [tail]
+        if stop:
+            segmentations = [
+                [(a, b, True) for a, b in _balanced_segments(saved, stop, k)]
+                + tail
+                for k in range(1, stop + 1)
+            ]
+        plan = min(
+            (CheckpointPlan(s, costs, input_nbytes) for s in segmentations),
+            key=lambda p: p.peak,
+        )
+        if plan.peak <= memory_budget:
+            return plan
+        if smallest is None or plan.peak < smallest.peak:
+            smallest = plan
+    return smallest
+
+
+def checkpointed_forward(layers, plan, x):
+    """Run an nn.Sequential following a CheckpointPlan"""
+    for start, stop, checkpointed in plan.segments:
+        segment = layers[start:stop]
+        if checkpointed:
+            x = checkpoint(
+                segment, x, use_reentrant=False, preserve_rng_state=False
+            )
+        else:
+            x = segment(x)
+    return x
+
+
+def _measure_step(config_file, channels, n_classes, shape, budget):
+    """Seconds of a training step and the plan it used. A warm-up step
+    runs first, so planning (once per shape) is not timed."""
+    from meshnet import enMesh_checkpoint
+
+    torch.manual_seed(0)
+    model = enMesh_checkpoint(1, n_classes, channels, config_file).train()
+    model.set_checkpoint_budget(budget)
+    model(torch.rand(shape)).mean().backward()
+    model.zero_grad(set_to_none=True)
+    x = torch.rand(shape)
+    start = time.perf_counter()
+    model(x).mean().backward()
+    seconds = time.perf_counter() - start
+    plan = model.checkpoint_plan
+    return seconds, None if plan is None else plan.to_dict()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure training step time and memory of checkpoint "
+        "plans for a range of memory budgets"
+    )
+    parser.add_argument("--config", default="modelAE.json")
+    parser.add_argument("--channels", type=int, default=15)
+    parser.add_argument("--classes", type=int, default=3)
+    parser.add_argument("--cube", type=int, default=64)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument(
+        "--budgets-mb",
+        type=int,
+        nargs="+",
+        default=[0, 256, 1024, 4096],
+        help="0 checkpoints every layer, as train_forward does by default",
+    )
+    args = parser.parse_args()
+
+    from profiling import run_isolated
+
+    shape = (args.batch_size, 1) + (args.cube,) * 3
+    print(
+        f"{'budget MiB':>10} {'seconds':>9} {'est MiB':>9} "
+        f"{'peak MiB':>9} {'recomputed':>10}  segments"
+    )
+    for budget in args.budgets_mb:
+        (seconds, plan), peak = run_isolated(
+            _measure_step,
+            args.config,
+            args.channels,
+            args.classes,
+            shape,
+            budget * 2**20 if budget else None,
+        )
+        if plan is None:
+            estimate, recomputed, segments = "-", "all", "every layer"
+        else:
+            estimate = f"{plan['peak'] / 2**20:.1f}"
+            recomputed = plan["recomputed"]
+            segments = plan["segments"]
+        print(
+            f"{budget or 'off':>10} {seconds:>9.2f} {estimate:>9} "
+            f"{peak / 2**20:>9.1f} {recomputed:>10}  {segments}"
+        )
+
+
+if __name__ == "__main__":
+    main()
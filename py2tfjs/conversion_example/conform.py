@@ -0,0 +1,319 @@
+import argparse
+import itertools
+import json
+import time
+
+import numpy as np
+
+# world direction (RAS) a voxel axis runs towards, per orientation letter
+AXIS_DIRECTIONS = {
+    "R": (1, 0, 0),
+    "L": (-1, 0, 0),
+    "A": (0, 1, 0),
+    "P": (0, -1, 0),
+    "S": (0, 0, 1),
+    "I": (0, 0, -1),
+}
+
+
+def conformed_affine(
+    center, shape=(256, 256, 256), voxel_size=1.0, orientation="LIA"
+):
+    """Voxel to world affine of a conformed grid centred on ``center``.
+
+    The default is FreeSurfer's conformed space that brainchop models
+    expect: 256^3 voxels of 1 mm, axes running left, inferior, anterior.
+    """
+    directions = np.array(
+        [AXIS_DIRECTIONS[axis] for axis in orientation.upper()], dtype=float
+    ).T
+    affine = np.eye(4)
+    affine[:3, :3] = directions * voxel_size
+    affine[:3, 3] = center - affine[:3, :3] @ (np.array(shape) / 2)
+    return affine
+
+
+def volume_center(affine, shape):
+    """World position of a volume's centre voxel, as FreeSurfer's c_ras"""
+    return affine[:3, :3] @ (np.array(shape[:3]) / 2) + affine[:3, 3]
+
+
+def _axis_map(vox2vox, tol=1e-6):
+    """Input axis, scale and offset per output axis, or None if an output
+    axis reads more than one input axis (oblique)"""
+    matrix = vox2vox[:3, :3]
+    axes = []
+    for out_axis in range(3):
+        nonzero = np.flatnonzero(np.abs(matrix[:, out_axis]) > tol)
+        if len(nonzero) != 1:
+            return None
+        axes.append(int(nonzero[0]))
+    if sorted(axes) != [0, 1, 2]:
+        return None
+    return [
+        (axis, matrix[axis, out_axis], vox2vox[axis, 3])
+        for out_axis, axis in enumerate(axes)
+    ]
+
+
+def _interp_axis(data, axis, positions, order):
+    """Sample ``data`` at fractional ``positions`` along one axis, zero
+    outside the volume"""
+    n = data.shape[axis]
+    shape = [1] * data.ndim
+    shape[axis] = -1
+    if order == 0:
+        index = np.floor(positions + 0.5).astype(np.intp)
+        out = np.take(data, np.clip(index, 0, n - 1), axis=axis)
+        outside = (index < 0) | (index >= n)
+        if outside.any():
+            out *= ~outside.reshape(shape)
+        return out
+
+    low = np.floor(positions).astype(np.intp)
+    w_high = (positions - low).astype(np.float32)
+    w_low = 1 - w_high
+    w_low[(low < 0) | (low >= n)] = 0
+    w_high[(low + 1 < 0) | (low + 1 >= n)] = 0
+    out = np.take(data, np.clip(low, 0, n - 1), axis=axis)
+    out = out.astype(np.float32, copy=False)
+    out *= w_low.reshape(shape)
+    # integer positions (pure reorientation/shift) need one read only
+    if w_high.any():
+        high = np.take(data, np.clip(low + 1, 0, n - 1), axis=axis)
+        out += high.astype(np.float32, copy=False) * w_high.reshape(shape)
+    return out
+
+
+def _sample(data, coords, order):
+    """Trilinear or nearest samples of ``data`` at (3, ...) voxel coords"""
+    flat = coords.reshape(3, -1)
+    if order == 0:
+        index = np.floor(flat + 0.5).astype(np.intp)
+        inside = np.ones(flat.shape[1], dtype=bool)
+        for axis, n in enumerate(data.shape):
+            inside &= (index[axis] >= 0) & (index[axis] < n)
+            np.clip(index[axis], 0, n - 1, out=index[axis])
+        out = data[index[0], index[1], index[2]] * inside
+        return out.reshape(coords.shape[1:])
+
+    # per-axis indices and weights of both neighbours, zero outside
+    low = np.floor(flat).astype(np.intp)
+    neighbours = []
+    for axis, n in enumerate(data.shape):
+        high = low[axis] + 1
+        w_high = (flat[axis] - low[axis]).astype(np.float32)
+        w_low = 1 - w_high
+        w_low *= (low[axis] >= 0) & (low[axis] < n)
+        w_high *= (high >= 0) & (high < n)
+        neighbours.append(
+            (
+                (np.clip(low[axis], 0, n - 1), w_low),
+                (np.clip(high, 0, n - 1), w_high),
+            )
+        )
+    out = np.zeros(flat.shape[1], dtype=np.float32)
+    for (i, wi), (j, wj), (k, wk) in itertools.product(*neighbours):
+        out += data[i, j, k] * (wi * wj * wk)
+    return out.reshape(coords.shape[1:])
+
+
+def resample(data, vox2vox, shape, order=1, slab=16):
+    """Resample a 3D volume onto a new voxel grid.
+
+    ``vox2vox`` maps output voxel indices to (fractional) input voxel
+    indices; samples outside the input are zero. ``order`` 1 is trilinear,
+    0 nearest neighbour (for label volumes, which keep their dtype).
+
+    Grids whose axes map onto input axes (reorientation, flips, voxel
+    size changes; the usual case) are resampled as three separable 1D
+    passes over transposed views, so a memory-mapped input is read
+    slice by slice. Oblique grids fall back to a full trilinear gather
+    in ``slab``-deep output slabs.
+    """
+    axis_map = _axis_map(vox2vox)
+    if axis_map is not None:
+        out = data.transpose([axis for axis, _, _ in axis_map])
+        for out_axis, (_, scale, offset) in enumerate(axis_map):
+            positions = scale * np.arange(shape[out_axis]) + offset
+            out = _interp_axis(out, out_axis, positions, order)
+        return out
+
+    dtype = data.dtype if order == 0 else np.float32
+    out = np.empty(shape, dtype=dtype)
+    j, k = np.meshgrid(
+        np.arange(shape[1]), np.arange(shape[2]), indexing="ij"
+    )
+    plane = (
+        vox2vox[:3, 1, None, None] * j
+        + vox2vox[:3, 2, None, None] * k
+        + vox2vox[:3, 3, None, None]
+    )
+    for start in range(0, shape[0], slab):
+        i = np.arange(start, min(start + slab, shape[0]))
+        coords = (
+            vox2vox[:3, 0, None, None, None] * i[None, :, None, None]
+            + plane[:, None]
+        )
+        out[start : start + len(i)] = _sample(data, coords, order)
+    return out
+
+
+class ConformTransform:
+    """The mapping between a native NIfTI grid and the conformed grid.
+
+    Holds both affines, so a segmentation of the conformed volume can be
+    mapped back to native space in one pass; save/load keep it next to
+    the outputs as JSON.
+    """
+
+    def __init__(
+        self,
+        native_shape,
+        native_affine,
+        shape=(256, 256, 256),
+        voxel_size=1.0,
+        orientation="LIA",
+    ):
+        self.native_shape = tuple(int(n) for n in native_shape[:3])
+        self.native_affine = np.asarray(native_affine, dtype=float)
+        self.shape = tuple(shape)
+        self.voxel_size = voxel_size
+        self.orientation = orientation
+        self.affine = conformed_affine(
+            volume_center(self.native_affine, self.native_shape),
+            self.shape,
+            voxel_size,
+            orientation,
+        )
+
+    def to_conformed(self, data, order=1):
+        """Resample a native-space volume onto the conformed grid"""
+        vox2vox = np.linalg.inv(self.native_affine) @ self.affine
+        return resample(data, vox2vox, self.shape, order)
+
+    def to_native(self, data, order=0):
+        """Map a conformed-space volume (by default labels) back"""
+        vox2vox = np.linalg.inv(self.affine) @ self.native_affine
+        return resample(data, vox2vox, self.native_shape, order)
+
+    def to_dict(self):
+        return {
+            "native_shape": list(self.native_shape),
+            "native_affine": self.native_affine.tolist(),
+            "shape": list(self.shape),
+            "voxel_size": self.voxel_size,
+            "orientation": self.orientation,
+        }
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=4)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r") as f:
+            return cls(**json.load(f))
+
+
+def load_nifti(path):
+    """Memory-mapped data (scaled only when the header asks for it) and
+    the affine of a NIfTI file; .nii.gz files are decompressed"""
+    import nibabel as nib
+
+    image = nib.load(path, mmap=True)
+    data = np.asanyarray(image.dataobj)
+    # a single-volume 4D file is still one 3D volume
+    while data.ndim > 3 and data.shape[-1] == 1:
+        data = data[..., 0]
+    if data.ndim != 3:
+        raise ValueError(f"Expected a 3D volume, got shape {data.shape}")
+    return data, image.affine
+
+
+def save_nifti(data, affine, path):
+    import nibabel as nib
+
+    nib.save(nib.Nifti1Image(data, affine), path)
+
+
+def intensity_window(data, qmax=0.999):
+    """[min, qmax quantile] of a volume, the range conformed uint8
+    volumes are scaled from"""
+    from normalization import quantiles
+
+    return quantiles(data, (0.0, qmax))
+
+
+def scale_uint8(volume, low, high):
+    """Map [low, high] to 0..255"""
+    scale = 255.0 / (high - low) if high > low else 1.0
+    out = (volume - low) * scale
+    np.clip(out, 0, 255, out=out)
+    return np.rint(out, out=out).astype(np.uint8)
+
+
+def conform(
+    path,
+    shape=(256, 256, 256),
+    voxel_size=1.0,
+    orientation="LIA",
+    order=1,
+    uint8=False,
+):
+    """Load a NIfTI file and resample it into the conformed space.
+
+    Returns:
+        tuple: The conformed float32 (or, with ``uint8``, 0..255 uint8)
+        volume and its ConformTransform.
+    """
+    data, affine = load_nifti(path)
+    transform = ConformTransform(
+        data.shape, affine, shape, voxel_size, orientation
+    )
+    # the window comes from the native voxels, not the zero padding
+    window = intensity_window(data) if uint8 else None
+    volume = transform.to_conformed(data, order)
+    if uint8:
+        volume = scale_uint8(volume, *window)
+    return volume, transform
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Conform a NIfTI volume to 256^3 1 mm LIA space"
+    )
+    parser.add_argument("input", help="NIfTI volume")
+    parser.add_argument("output", help="conformed NIfTI volume")
+    parser.add_argument("--transform", help="write the mapping as JSON")
+    parser.add_argument("--uint8", action="store_true")
+    parser.add_argument("--nearest", action="store_true", help="label input")
+    parser.add_argument(
+        "--inverse",
+        action="store_true",
+        help="also map the result back and report the round-trip error",
+    )
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    volume, transform = conform(
+        args.input, order=0 if args.nearest else 1, uint8=args.uint8
+    )
+    conformed = time.perf_counter()
+    print(f"conform: {conformed - start:.3f} s")
+    save_nifti(volume, transform.affine, args.output)
+    if args.transform:
+        transform.save(args.transform)
+
+    if args.inverse:
+        start = time.perf_counter()
+        native = transform.to_native(volume, order=0 if args.nearest else 1)
+        print(f"inverse: {time.perf_counter() - start:.3f} s")
+        if not args.uint8:
+            original, _ = load_nifti(args.input)
+            error = np.abs(native.astype(np.float32) - original).max()
+            print(f"max abs round-trip error: {error:.4g}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import functools
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+# bump when the cache layout changes
+CACHE_VERSION = 2
+
+# modules whose code shapes the converter output; their contents are part
+# of every key, so editing the converter invalidates older entries
+CONVERTER_SOURCES = (
+    "convert.py",
+    "meshnet.py",
+    "meshnet2tfjs.py",
+    "optimize.py",
+)
+
+
+@functools.lru_cache(maxsize=None)
+def converter_fingerprint(sources=CONVERTER_SOURCES):
+    """Hash of the converter modules next to this file"""
+    digest = hashlib.sha256()
+    root = os.path.dirname(os.path.abspath(__file__))
+    for name in sources:
+        digest.update(name.encode())
+        with open(os.path.join(root, name), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def _files(dirname):
+    return sorted(
+        name
+        for name in os.listdir(dirname)
+        if os.path.isfile(os.path.join(dirname, name))
+    )
+
+
+def _artifacts(dirname):
+    """model.json and the weight files its manifest references"""
+    with open(os.path.join(dirname, "model.json"), "r") as f:
+        spec = json.load(f)
+    return ["model.json"] + [
+        path for group in spec["weightsManifest"] for path in group["paths"]
+    ]
+
+
+def _size(dirname):
+    return sum(
+        os.path.getsize(os.path.join(dirname, name))
+        for name in _files(dirname)
+    )
+
+
+class ConversionCache:
+    """Content-addressed store of converted tfjs models.
+
+    Entries are keyed by a hash of the checkpoint bytes, the config json,
+    the converter options and the converter code (CONVERTER_SOURCES), and
+    hold every file the converter wrote (model.json and its weight
+    shards). The least recently used entries are evicted once the cache
+    grows beyond ``max_bytes``.
+    """
+
+    def __init__(self, root, max_bytes=2 * 2**30):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def key(self, checkpoint, config, options=None):
+        """Hash of a conversion's inputs"""
+        digest = hashlib.sha256()
+        digest.update(f"v{CACHE_VERSION}".encode())
+        digest.update(converter_fingerprint().encode())
+        with open(checkpoint, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        # parse the config so that formatting changes do not matter
+        with open(config, "r") as f:
+            config = json.load(f)
+        digest.update(json.dumps(config, sort_keys=True).encode())
+        digest.update(json.dumps(options or {}, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.root, key)
+
+    def fetch(self, key, dirname):
+        """Copy a cached conversion into ``dirname``; False on a miss.
+
+        Weight files of an earlier export in ``dirname`` that the cached
+        model.json does not list are removed, as a fresh export would.
+        """
+        from meshnet2tfjs import remove_stale_shards
+
+        entry = self._entry(key)
+        if not os.path.isdir(entry):
+            return False
+        os.makedirs(dirname, exist_ok=True)
+        try:
+            names = _files(entry)
+            for name in names:
+                shutil.copy2(
+                    os.path.join(entry, name), os.path.join(dirname, name)
+                )
+            remove_stale_shards(dirname, names)
+            # the entry's mtime is its last use
+            os.utime(entry)
+        except FileNotFoundError:
+            # evicted by another process while copying
+            return False
+        return True
+
+    def store(self, key, dirname):
+        """Add the files of a finished conversion to the cache"""
+        staging = tempfile.mkdtemp(dir=self.root, prefix=".staging-")
+        for name in _artifacts(dirname):
+            shutil.copy2(os.path.join(dirname, name), staging)
+        try:
+            os.rename(staging, self._entry(key))
+        except OSError:
+            # another process stored the same conversion first
+            shutil.rmtree(staging, ignore_errors=True)
+        self.evict()
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits"""
+        entries = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.startswith(".") or not os.path.isdir(path):
+                continue
+            try:
+                entries.append((os.path.getmtime(path), _size(path), path))
+            except FileNotFoundError:
+                continue
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def get_or_convert(self, checkpoint, config, options, dirname, convert):
+        """Fill ``dirname`` from the cache, or run ``convert()`` and cache
+        what it writes there.
+
+        Returns:
+            bool: True on a cache hit.
+        """
+        key = self.key(checkpoint, config, options)
+        if self.fetch(key, dirname):
+            return True
+        convert()
+        self.store(key, dirname)
+        return False
@@ -1,7 +1,8 @@
 import torch
 
-from blendbatchnorm import fuse_bn_recursively
 from meshnet2tfjs import meshnet2tfjs
+from normalization import quantile_normalize
+from optimize import optimize_for_inference
 
 from meshnet import (
     MeshNet,
@@ -13,9 +14,8 @@ device = torch.device(device_name)
 
 
 def preprocess_image(img, qmin=0.01, qmax=0.99):
-    """Unit interval preprocessing"""
-    img = (img - img.quantile(qmin)) / (img.quantile(qmax) - img.quantile(qmin))
-    return img
+    """Unit interval preprocessing, in place"""
+    return quantile_normalize(img, qmin, qmax)
 
 
 # def preprocess_image(img):
@@ -24,33 +24,46 @@ def preprocess_image(img, qmin=0.01, qmax=0.99):
 #     return img
 
 
-# specify how many classes does the model predict
-n_classes = 3
-# specify the architecture
-config_file = "modelAE.json"
-# how many channels does the saved model have
-model_channels = 15
-# path to the saved model
-model_path = "model.pth"
-# tfjs model output directory
-tfjs_model_dir = "model_tfjs"
-
-meshnet_model = enMesh_checkpoint(
-    in_channels=1,
-    n_classes=n_classes,
-    channels=model_channels,
-    config_file=config_file,
-)
+def load_meshnet(
+    model_path, config_file, model_channels, n_classes, in_channels=1, fat=None
+):
+    """Build an enMesh_checkpoint and load a saved state dict into it"""
+    meshnet_model = enMesh_checkpoint(
+        in_channels=in_channels,
+        n_classes=n_classes,
+        channels=model_channels,
+        config_file=config_file,
+        fat=fat,
+    )
+
+    checkpoint = torch.load(model_path, map_location=device)
+    # training checkpoints keep the weights next to the optimizer state
+    if "model_state_dict" in checkpoint:
+        checkpoint = checkpoint["model_state_dict"]
+    meshnet_model.load_state_dict(checkpoint)
+
+    meshnet_model.eval()
 
-checkpoint = torch.load(model_path)
-meshnet_model.load_state_dict(checkpoint)
+    meshnet_model.to(device)
+    return meshnet_model
 
-meshnet_model.eval()
 
-meshnet_model.to(device)
-mnm = fuse_bn_recursively(meshnet_model)
-del meshnet_model
-mnm.model.eval()
+if __name__ == "__main__":
+    # specify how many classes does the model predict
+    n_classes = 3
+    # specify the architecture
+    config_file = "modelAE.json"
+    # how many channels does the saved model have
+    model_channels = 15
+    # path to the saved model
+    model_path = "model.pth"
+    # tfjs model output directory
+    tfjs_model_dir = "model_tfjs"
 
+    meshnet_model = load_meshnet(
+        model_path, config_file, model_channels, n_classes
+    )
+    mnm = optimize_for_inference(meshnet_model)
+    del meshnet_model
 
-meshnet2tfjs(mnm, tfjs_model_dir)
+    meshnet2tfjs(mnm, tfjs_model_dir)
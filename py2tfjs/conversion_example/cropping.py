@@ -0,0 +1,85 @@
+import torch
+
+from tiling import conv3d_layers
+
+
+def bounding_box(volume, threshold=0):
+    """Bounding box of the voxels of a 3D volume above ``threshold``.
+
+    Mirrors firstLastNonZero3D in tensor-utils.js with one ``any``
+    reduction per axis instead of a per-voxel scan.
+
+    Returns:
+        list: ``[start, stop)`` pairs per axis, or None for an empty volume.
+    """
+    mask = volume > threshold
+    plane = mask.any(dim=2)
+    profiles = [plane.any(dim=1), plane.any(dim=0), mask.any(dim=0).any(0)]
+    box = []
+    for profile in profiles:
+        index = torch.nonzero(profile).flatten()
+        if index.numel() == 0:
+            return None
+        box.append((int(index[0]), int(index[-1]) + 1))
+    return box
+
+
+def pad_box(box, shape, padding):
+    """Grow a bounding box by ``padding`` voxels, clipped to the volume"""
+    return [
+        slice(max(start - padding, 0), min(stop + padding, dim))
+        for (start, stop), dim in zip(box, shape)
+    ]
+
+
+def _forward(model, x):
+    with torch.inference_mode():
+        return model(x)
+
+
+def cropped_inference(
+    model,
+    x,
+    padding=18,
+    threshold=0,
+    mask=None,
+    infer=None,
+    out=None,
+):
+    """Run a model only on the brain's bounding box plus ``padding``.
+
+    The Python counterpart of cropAndGetCorner/restoreTo256Cube in
+    inference-logic.js: the box comes from ``mask`` (for example a brain
+    mask) or from ``x > threshold``, and the crop's output is written
+    straight into the full-size ``out``. Everything outside the box is
+    left at zero, which argmax reads as the background class.
+
+    Args:
+        model (nn.Module): MeshNet-like model.
+        x (torch.Tensor): Input of shape (1, 1, D, H, W).
+        padding (int): Voxels added around the box, as cropPadding.
+        threshold (float): Intensity above which a voxel is brain.
+        mask (torch.Tensor): Optional (D, H, W) mask used for the box.
+        infer (callable): ``infer(model, crop)`` runs the model, e.g.
+            tiling.tiled_inference; defaults to a plain forward pass.
+        out (torch.Tensor): Preallocated (1, n_classes, D, H, W) output.
+
+    Returns:
+        torch.Tensor: The full-size model output.
+    """
+    if infer is None:
+        infer = _forward
+    shape = tuple(x.shape[2:])
+    if out is None:
+        n_classes = conv3d_layers(model)[-1].out_channels
+        out = x.new_zeros((1, n_classes) + shape)
+    else:
+        out.zero_()
+
+    box = bounding_box(x[0, 0] if mask is None else mask, threshold)
+    if box is None:
+        return out
+
+    region = (slice(None), slice(None)) + tuple(pad_box(box, shape, padding))
+    out[region] = infer(model, x[region].contiguous())
+    return out
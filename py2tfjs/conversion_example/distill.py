@@ -0,0 +1,406 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+device_name = "cuda:0" if torch.cuda.is_available() else "cpu"
+device = torch.device(device_name)
+
+
+def distillation_loss(
+    student, teacher, temperature=2.0, labels=None, alpha=0.5
+):
+    """Soft-label loss of (N, C, D, H, W) student logits.
+
+    The per-voxel KL divergence to the teacher's softened distribution,
+    scaled by ``temperature**2`` to keep gradient magnitudes independent
+    of it; with ``labels`` mixed with their cross entropy by ``alpha``.
+    """
+    soft = F.kl_div(
+        F.log_softmax(student / temperature, 1),
+        F.log_softmax(teacher / temperature, 1),
+        reduction="none",
+        log_target=True,
+    )
+    loss = soft.sum(1).mean() * temperature**2
+    if labels is not None:
+        hard = F.cross_entropy(student, labels)
+        loss = alpha * loss + (1 - alpha) * hard
+    return loss
+
+
+def _update_file(digest, path):
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+
+
+def teacher_digest(spec):
+    """Hash of the files behind a serve.load_served_model spec: model.json
+    and its weight files, or the checkpoint and its config"""
+    digest = hashlib.sha256(spec.encode())
+    if spec.endswith(".json"):
+        with open(spec, "r") as f:
+            manifest = json.load(f)["weightsManifest"]
+        dirname = os.path.dirname(spec)
+        paths = [spec] + [
+            os.path.join(dirname, path)
+            for group in manifest
+            for path in group["paths"]
+        ]
+    else:
+        paths = spec.split(":")[:2]
+    for path in paths:
+        _update_file(digest, path)
+    return digest.hexdigest()
+
+
+def volume_digest(x):
+    """Hash of a volume's shape, dtype and values"""
+    array = np.ascontiguousarray(x.detach().cpu().numpy())
+    digest = hashlib.sha256(f"{array.shape}{array.dtype}".encode())
+    digest.update(array)
+    return digest.hexdigest()
+
+
+class TeacherCache:
+    """Teacher logits of whole training volumes, one compressed float16
+    .npz per volume.
+
+    Logits rather than probabilities are kept, so the temperature can
+    change without rebuilding. Whole-volume (tiled) teacher passes also
+    give every subvolume the teacher's full-context prediction, which
+    predicting the crops on the fly cannot. An entry is only valid for
+    the teacher files (see teacher_digest) and the volume it was built
+    from, so retraining the teacher in place or changing a volume under
+    the same name rebuilds it.
+    """
+
+    def __init__(self, dirname, teacher_spec):
+        self.dirname = dirname
+        self.teacher_spec = teacher_spec
+        self.teacher_digest = teacher_digest(teacher_spec)
+        os.makedirs(dirname, exist_ok=True)
+
+    def path(self, name):
+        return os.path.join(self.dirname, f"{name}.npz")
+
+    def valid(self, name, x):
+        """Whether the entry of ``name`` was built from volume ``x`` by
+        the current teacher"""
+        path = self.path(name)
+        if not os.path.exists(path):
+            return False
+        with np.load(path) as f:
+            if "teacher_digest" not in f or "volume_digest" not in f:
+                return False
+            return (
+                str(f["teacher_digest"]) == self.teacher_digest
+                and str(f["volume_digest"]) == volume_digest(x)
+            )
+
+    def build(self, teacher, name, x, memory_budget=None):
+        """Run the teacher over one (1, C, D, H, W) volume and store it"""
+        from tiling import tiled_inference
+
+        with torch.inference_mode():
+            logits = tiled_inference(teacher, x, memory_budget=memory_budget)
+        np.savez_compressed(
+            self.path(name),
+            logits=logits[0].cpu().numpy().astype(np.float16),
+            teacher=self.teacher_spec,
+            teacher_digest=self.teacher_digest,
+            volume_digest=volume_digest(x),
+        )
+
+    def load(self, name):
+        """(C, D, H, W) float16 logits"""
+        with np.load(self.path(name)) as f:
+            return torch.from_numpy(f["logits"])
+
+
+def random_corners(shape, cube, n, generator):
+    """``n`` random corners of ``cube``-sized subvolumes inside ``shape``"""
+    return torch.stack(
+        [
+            torch.randint(0, size - cube + 1, (n,), generator=generator)
+            for size in shape
+        ],
+        1,
+    )
+
+
+def crop(volume, corners, cube):
+    """(N, C, cube, cube, cube) crops of a (C, D, H, W) volume"""
+    return torch.stack(
+        [
+            volume[:, i : i + cube, j : j + cube, k : k + cube]
+            for i, j, k in corners.tolist()
+        ]
+    )
+
+
+def load_labels(path):
+    """A .npy or NIfTI label volume as a (D, H, W) long tensor"""
+    if path.endswith(".npy"):
+        data = np.load(path)
+    else:
+        import nibabel as nib
+
+        data = np.asanyarray(nib.load(path).dataobj)
+    return torch.from_numpy(np.asarray(data, dtype=np.int64))
+
+
+def train_epoch(
+    student,
+    optimizer,
+    volumes,
+    teacher=None,
+    cache=None,
+    labels=None,
+    cube=64,
+    subvolumes=16,
+    batch_size=1,
+    temperature=2.0,
+    alpha=0.5,
+    generator=None,
+):
+    """One pass over ``volumes`` with ``subvolumes`` random crops each.
+
+    Teacher logits come from ``cache`` (loaded once per volume) or from
+    running ``teacher`` on every batch of crops.
+
+    Returns:
+        dict: Mean loss and seconds spent getting teacher logits, cropping
+        and in the student's forward/backward/step.
+    """
+    student.train()
+    times = {"teacher_s": 0.0, "data_s": 0.0, "student_s": 0.0}
+    total, steps = 0.0, 0
+    names = list(volumes)
+    for v in torch.randperm(len(names), generator=generator).tolist():
+        name = names[v]
+        volume = volumes[name][0]
+        if cache is not None:
+            start = time.perf_counter()
+            cached = cache.load(name)
+            times["teacher_s"] += time.perf_counter() - start
+        for first in range(0, subvolumes, batch_size):
+            n = min(batch_size, subvolumes - first)
+            start = time.perf_counter()
+            corners = random_corners(volume.shape[1:], cube, n, generator)
+            x = crop(volume, corners, cube).to(device)
+            y = None
+            if labels is not None:
+                y = crop(labels[name][None], corners, cube)[:, 0].to(device)
+            times["data_s"] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            if cache is not None:
+                target = crop(cached, corners, cube).to(device).float()
+            else:
+                with torch.inference_mode():
+                    target = teacher(x)
+                target = target.clone()
+            times["teacher_s"] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            optimizer.zero_grad()
+            # training mode runs enMesh_checkpoint.train_forward
+            output = student(x)
+            loss = distillation_loss(output, target, temperature, y, alpha)
+            loss.backward()
+            optimizer.step()
+            times["student_s"] += time.perf_counter() - start
+            total += loss.item()
+            steps += 1
+    return dict(loss=total / max(steps, 1), **times)
+
+
+def agreement_report(student, teacher, volumes, memory_budget=None):
+    """Argmax agreement and per-class Dice of student vs teacher"""
+    from metrics import argmax_agreement, confusion_matrix, dice_per_class
+    from tiling import tiled_inference
+
+    student.eval()
+    report = {}
+    for name, x in volumes.items():
+        with torch.inference_mode():
+            expected = tiled_inference(teacher, x, memory_budget)
+            actual = tiled_inference(student.model, x, memory_budget)
+        confusion = confusion_matrix(
+            expected.argmax(1), actual.argmax(1), expected.shape[1]
+        )
+        report[name] = {
+            "argmax_agreement": argmax_agreement(expected, actual),
+            "dice": dice_per_class(confusion),
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Distill a large MeshNet into a small enMesh_checkpoint"
+    )
+    parser.add_argument(
+        "teacher",
+        help="tfjs model.json or checkpoint.pth:config.json:channels:"
+        "classes[:fat]",
+    )
+    parser.add_argument("config", help="student MeshNet config json")
+    parser.add_argument(
+        "--channels",
+        type=int,
+        default=None,
+        help="student hidden width (default: the widths in the config)",
+    )
+    parser.add_argument("--classes", type=int, required=True)
+    parser.add_argument("--in-channels", type=int, default=1)
+    parser.add_argument("--init", help="student state dict to start from")
+    parser.add_argument(
+        "--volume",
+        action="append",
+        required=True,
+        help=".npy or NIfTI training volume",
+    )
+    parser.add_argument(
+        "--labels",
+        action="append",
+        default=[],
+        help="label volume per --volume, mixed in with --alpha",
+    )
+    parser.add_argument(
+        "--validate",
+        action="append",
+        default=[],
+        help=".npy or NIfTI volume for the student/teacher agreement",
+    )
+    parser.add_argument(
+        "--cache",
+        help="directory of cached teacher logits; without it the teacher "
+        "runs on every batch",
+    )
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--subvolumes", type=int, default=16)
+    parser.add_argument("--cube", type=int, default=64)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--lr", type=float, default=0.0007)
+    parser.add_argument("--temperature", type=float, default=2.0)
+    parser.add_argument("--alpha", type=float, default=0.5)
+    parser.add_argument(
+        "--memory-budget-mb",
+        type=int,
+        default=1024,
+        help="activation memory of whole-volume teacher/student passes",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", required=True, help="student state dict")
+    parser.add_argument("--tfjs", help="also export the student here")
+    parser.add_argument("--report", help="write epoch stats as JSON")
+    args = parser.parse_args()
+    if args.labels and len(args.labels) != len(args.volume):
+        raise SystemExit("give one --labels per --volume")
+
+    from meshnet import enMesh_checkpoint
+    from roundtrip import load_volume
+    from serve import load_served_model
+
+    torch.manual_seed(args.seed)
+    generator = torch.Generator().manual_seed(args.seed)
+    budget = args.memory_budget_mb * 2**20
+    teacher = load_served_model(args.teacher).to(device)
+    for parameter in teacher.parameters():
+        parameter.requires_grad_(False)
+    student = enMesh_checkpoint(
+        args.in_channels, args.classes, args.channels, args.config
+    )
+    if args.init:
+        student.load_state_dict(torch.load(args.init, map_location="cpu"))
+    student.to(device)
+    optimizer = torch.optim.RMSprop(student.parameters(), lr=args.lr)
+
+    volumes = {
+        f"{i}_{os.path.basename(path)}": load_volume(path)
+        for i, path in enumerate(args.volume)
+    }
+    labels = None
+    if args.labels:
+        labels = {
+            name: load_labels(path)
+            for name, path in zip(volumes, args.labels)
+        }
+
+    cache = None
+    stats = {"epochs": []}
+    if args.cache:
+        cache = TeacherCache(args.cache, args.teacher)
+        start = time.perf_counter()
+        for name, x in volumes.items():
+            if not cache.valid(name, x):
+                cache.build(teacher, name, x.to(device), budget)
+        stats["cache_build_s"] = time.perf_counter() - start
+        print(f"teacher cache: {stats['cache_build_s']:.3f} s")
+
+    for epoch in range(args.epochs):
+        start = time.perf_counter()
+        result = train_epoch(
+            student,
+            optimizer,
+            volumes,
+            teacher,
+            cache,
+            labels,
+            args.cube,
+            args.subvolumes,
+            args.batch_size,
+            args.temperature,
+            args.alpha,
+            generator,
+        )
+        result["epoch_s"] = time.perf_counter() - start
+        # teacher_s is what distillation adds to a plain training epoch
+        result["overhead"] = result["teacher_s"] / (
+            result["epoch_s"] - result["teacher_s"]
+        )
+        stats["epochs"].append(result)
+        print(
+            f"epoch {epoch + 1}: loss {result['loss']:.4f}, "
+            f"{result['epoch_s']:.2f} s (teacher {result['teacher_s']:.2f}"
+            f" s, +{result['overhead']:.1%}, data {result['data_s']:.2f} s,"
+            f" student {result['student_s']:.2f} s)"
+        )
+
+    torch.save(student.state_dict(), args.output)
+    if args.validate:
+        validation = {
+            os.path.basename(path): load_volume(path).to(device)
+            for path in args.validate
+        }
+        stats["validation"] = agreement_report(
+            student, teacher, validation, budget
+        )
+        for name, r in stats["validation"].items():
+            dice = " ".join(
+                "-" if d is None else f"{d:.4f}" for d in r["dice"]
+            )
+            print(
+                f"{name}: agreement {r['argmax_agreement']:.6f}, "
+                f"dice {dice}"
+            )
+    if args.tfjs:
+        from meshnet2tfjs import meshnet2tfjs
+        from optimize import optimize_for_inference
+
+        meshnet2tfjs(optimize_for_inference(student.cpu()), args.tfjs)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(stats, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+import argparse
+import json
+
+from tiling import iter_tiles, plan_core_size, tile_nbytes
+
+ITEMSIZE = 4  # float32
+
+
+def _triple(value):
+    return tuple(value) if isinstance(value, (list, tuple)) else (value,) * 3
+
+
+def layers_from_tfjs(model_spec):
+    """Conv3D layers of a tfjs model.json as plain dicts"""
+    config = model_spec["modelTopology"]["model_config"]["config"]
+    in_channels = config["layers"][0]["config"]["batch_input_shape"][-1]
+    layers = []
+    for layer in config["layers"]:
+        if layer["class_name"] != "Conv3D":
+            continue
+        conv = layer["config"]
+        layers.append(
+            {
+                "name": conv["name"],
+                "in_channels": in_channels,
+                "out_channels": conv["filters"],
+                "kernel_size": _triple(conv["kernel_size"]),
+                "dilation": _triple(conv["dilation_rate"]),
+                "bias": conv.get("use_bias", True),
+            }
+        )
+        in_channels = conv["filters"]
+    return layers
+
+
+def layers_from_config(config, in_channels, n_classes, channels):
+    """Conv layers of a MeshNet config json, see meshnet.set_channel_num"""
+    from meshnet import set_channel_num
+
+    config = set_channel_num(config, in_channels, n_classes, channels)
+    return [
+        {
+            "name": f"conv3d_{i}",
+            "in_channels": layer["in_channels"],
+            "out_channels": layer["out_channels"],
+            "kernel_size": _triple(layer["kernel_size"]),
+            "dilation": _triple(layer["dilation"]),
+            "bias": layer.get("bias", True),
+        }
+        for i, layer in enumerate(config["layers"])
+    ]
+
+
+def layer_costs(layers, shape):
+    """Per-layer FLOPs, parameter bytes and output activation bytes"""
+    voxels = shape[0] * shape[1] * shape[2]
+    costs = []
+    for layer in layers:
+        k = 1
+        for size in layer["kernel_size"]:
+            k *= size
+        bias = 1 if layer.get("bias", True) else 0
+        macs = k * layer["in_channels"] * layer["out_channels"] * voxels
+        params = (k * layer["in_channels"] + bias) * layer["out_channels"]
+        costs.append(
+            {
+                "name": layer["name"],
+                "flops": 2 * macs + bias * layer["out_channels"] * voxels,
+                "param_bytes": params * ITEMSIZE,
+                "activation_bytes": layer["out_channels"] * voxels * ITEMSIZE,
+            }
+        )
+    return costs
+
+
+def _halo(layers):
+    return tuple(
+        sum(
+            (layer["kernel_size"][a] - 1) // 2 * layer["dilation"][a]
+            for layer in layers
+        )
+        for a in range(3)
+    )
+
+
+def _conv_nbytes(in_channels, out_channels, voxels):
+    """Input, output and workspace of one conv.
+
+    The CPU conv backends compute in a blocked layout and, with more
+    than one thread, keep a blocked copy of both the input and the
+    output next to them.
+    """
+    return 2 * (in_channels + out_channels) * voxels * ITEMSIZE
+
+
+def _eager_peak(layers, voxels):
+    """Largest conv working set of an eager pass; the last layer's
+    includes the output"""
+    return max(
+        (
+            _conv_nbytes(layer["in_channels"], layer["out_channels"], voxels)
+            for layer in layers
+        ),
+        default=0,
+    )
+
+
+def sliced_head_nbytes(layer, voxels, out_slice=1, in_slice=None):
+    """Working set of lowmem.sliced_conv3d: the input and the whole
+    output, plus one group's partial result and the blocked copies of
+    its input slice and of that partial result"""
+    group = min(out_slice, layer["out_channels"])
+    workspace = min(in_slice or layer["in_channels"], layer["in_channels"])
+    channels = layer["in_channels"] + layer["out_channels"]
+    return (channels + 2 * group + workspace) * voxels * ITEMSIZE
+
+
+def plan_buffer_nbytes(layers, shape):
+    """The two ping-pong buffers of plan.ExecutionPlan: as wide as the
+    widest hidden activation (or the input) and padded by the largest
+    padding of any layer"""
+    channels = max(
+        [layer["out_channels"] for layer in layers[:-1]]
+        + [layers[0]["in_channels"]]
+    )
+    padded = 1
+    for a, dim in enumerate(shape):
+        pad = max(
+            (layer["kernel_size"][a] - 1) // 2 * layer["dilation"][a]
+            for layer in layers
+        )
+        padded *= dim + 2 * pad
+    return 2 * channels * padded * ITEMSIZE
+
+
+def strategies(
+    layers,
+    shape,
+    out_slice=1,
+    in_slice=None,
+    tile_batch=1,
+    budget=None,
+    crop_fraction=None,
+    slab_depth=16,
+):
+    """Estimated peak memory and FLOPs of every execution strategy.
+
+    Every peak counts the weights, the input volume and what the
+    strategy itself allocates, including the output volume exactly
+    once; they are estimates for ranking strategies, not exact
+    allocator high-water marks.
+    """
+    voxels = shape[0] * shape[1] * shape[2]
+    costs = layer_costs(layers, shape)
+    flops = sum(c["flops"] for c in costs)
+    params = sum(c["param_bytes"] for c in costs)
+    last = layers[-1]
+    fixed = params + layers[0]["in_channels"] * voxels * ITEMSIZE
+    output = last["out_channels"] * voxels * ITEMSIZE
+    widest = max(
+        max(layer["in_channels"], layer["out_channels"]) for layer in layers
+    )
+
+    # full: eager forward of the whole volume, the output is the head's
+    body = _eager_peak(layers[:-1], voxels)
+    head = _eager_peak([last], voxels)
+    result = {"full": {"peak_bytes": fixed + max(body, head), "flops": flops}}
+
+    # sliced: the output layer runs one group of output channels at a time
+    # on in_slice input channels, so only that much gets reordered
+    head = sliced_head_nbytes(last, voxels, out_slice, in_slice)
+    result["sliced"] = {
+        "peak_bytes": fixed + max(body, head),
+        "flops": flops,
+    }
+
+    # plan: two padded ping-pong buffers, the output, and one depth slab
+    # of a layer with its conv workspace at a time
+    slab = min(slab_depth, shape[0]) * shape[1] * shape[2]
+    slab_peak = _eager_peak(layers, slab)
+    result["plan"] = {
+        "peak_bytes": fixed
+        + output
+        + plan_buffer_nbytes(layers, shape)
+        + slab_peak,
+        "flops": flops,
+    }
+
+    # tiled: largest tile batch that fits what the budget leaves over
+    halo = _halo(layers)
+    core = shape
+    if budget is not None:
+        try:
+            core = plan_core_size(
+                shape, halo, widest, budget, tile_batch, fixed=fixed + output
+            )
+        except ValueError:
+            core = None
+    if core is not None:
+        tiled_voxels = 0
+        for _, tile in iter_tiles(shape, core, halo):
+            n = 1
+            for s in tile:
+                n *= s.stop - s.start
+            tiled_voxels += n
+        result["tiled"] = {
+            "peak_bytes": fixed
+            + output
+            + tile_nbytes(core, halo, widest, tile_batch, shape=shape),
+            "flops": flops * tiled_voxels / voxels,
+            "core_size": core,
+        }
+
+    # cropped: the full model on the brain's bounding box only, written
+    # into a zeroed full-size output
+    if crop_fraction is not None:
+        crop = int(voxels * crop_fraction)
+        body = _eager_peak(layers[:-1], crop)
+        result["cropped"] = {
+            "peak_bytes": fixed
+            + output
+            + max(body, _eager_peak([last], crop)),
+            "flops": flops * crop_fraction,
+        }
+    return result
+
+
+# preferred order among strategies with equal cost
+PREFERENCE = ["full", "plan", "cropped", "sliced", "tiled"]
+
+
+def recommend(estimates, budget):
+    """Fastest (fewest FLOPs) strategy whose peak fits ``budget``"""
+    fitting = [
+        (estimate["flops"], PREFERENCE.index(name), name)
+        for name, estimate in estimates.items()
+        if estimate["peak_bytes"] <= budget
+    ]
+    return min(fitting)[2] if fitting else None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Estimate FLOPs and memory of a MeshNet and pick an "
+        "execution strategy for a RAM budget"
+    )
+    parser.add_argument("model", help="tfjs model.json or MeshNet config")
+    parser.add_argument("--in-channels", type=int, default=1)
+    parser.add_argument("--classes", type=int, help="config json only")
+    parser.add_argument("--channels", type=int, help="config json only")
+    parser.add_argument("--shape", type=int, nargs=3, default=[256] * 3)
+    parser.add_argument("--budget-gb", type=float, default=None)
+    parser.add_argument("--out-slice", type=int, default=1)
+    parser.add_argument("--in-slice", type=int, default=None)
+    parser.add_argument(
+        "--tile-batch",
+        type=int,
+        default=1,
+        help="tiles per batch; above 1 tiled output is approximate",
+    )
+    parser.add_argument(
+        "--crop-fraction",
+        type=float,
+        default=None,
+        help="bounding box volume / full volume, enables 'cropped'",
+    )
+    parser.add_argument("--json", help="write the estimates as JSON")
+    args = parser.parse_args()
+
+    with open(args.model, "r") as f:
+        spec = json.load(f)
+    if "modelTopology" in spec:
+        layers = layers_from_tfjs(spec)
+    else:
+        layers = layers_from_config(
+            spec, args.in_channels, args.classes, args.channels
+        )
+
+    shape = tuple(args.shape)
+    budget = None
+    if args.budget_gb is not None:
+        budget = int(args.budget_gb * 2**30)
+    costs = layer_costs(layers, shape)
+    estimates = strategies(
+        layers,
+        shape,
+        args.out_slice,
+        args.in_slice,
+        args.tile_batch,
+        budget,
+        args.crop_fraction,
+    )
+
+    print(f"{'layer':<16} {'GFLOPs':>9} {'params KiB':>11} {'act MiB':>9}")
+    for c in costs:
+        print(
+            f"{c['name']:<16} {c['flops'] / 1e9:>9.2f} "
+            f"{c['param_bytes'] / 2**10:>11.1f} "
+            f"{c['activation_bytes'] / 2**20:>9.1f}"
+        )
+    print()
+    print(f"{'strategy':<10} {'GFLOPs':>9} {'peak MiB':>10}")
+    for name, e in estimates.items():
+        print(
+            f"{name:<10} {e['flops'] / 1e9:>9.2f} "
+            f"{e['peak_bytes'] / 2**20:>10.1f}"
+        )
+    if args.tile_batch > 1 and "tiled" in estimates:
+        print(
+            f"tiled with {args.tile_batch}-tile batches is approximate "
+            "(about 1e-5), not bit-identical to a full pass"
+        )
+    if budget is not None:
+        choice = recommend(estimates, budget) or "nothing fits"
+        print()
+        print(f"recommended for {args.budget_gb} GB: {choice}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"layers": costs, "strategies": estimates}, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
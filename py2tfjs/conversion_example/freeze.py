@@ -0,0 +1,152 @@
+import argparse
+import copy
+import os
+import time
+
+import torch
+import torch.nn as nn
+
+from metrics import argmax_agreement
+
+
+class ChannelsLast(nn.Module):
+    """Runs a copy of a conv stack in channels-last-3d layout behind an
+    NCDHW interface; the caller's module keeps its layout"""
+
+    def __init__(self, layers):
+        super().__init__()
+        layers = copy.deepcopy(layers)
+        self.layers = layers.to(memory_format=torch.channels_last_3d)
+
+    def forward(self, x):
+        x = x.contiguous(memory_format=torch.channels_last_3d)
+        return self.layers(x).contiguous()
+
+
+def _layers(model):
+    # MeshNet/enMesh_checkpoint keep their stack in .model; enMesh's
+    # forward switches on self.training, which does not trace. A copy,
+    # so that the caller's model keeps its mode
+    return copy.deepcopy(getattr(model, "model", model)).eval()
+
+
+def freeze(
+    model,
+    example_shape=(1, 1, 64, 64, 64),
+    channels_last=True,
+    optimize=True,
+):
+    """Frozen TorchScript inference module of a (fused) MeshNet.
+
+    The model is traced, frozen (parameters become constants and are
+    folded) and, with ``optimize``, passed through
+    torch.jit.optimize_for_inference, which fuses conv+ReLU and prepacks
+    the conv weights for the CPU backend. Convolutions are spatially
+    generic, so the example only fixes the channel count.
+    """
+    layers = _layers(model)
+    if channels_last:
+        layers = ChannelsLast(layers)
+    example = torch.rand(example_shape)
+    with torch.no_grad():
+        traced = torch.jit.trace(layers, example)
+        frozen = torch.jit.freeze(traced.eval())
+        if optimize:
+            frozen = torch.jit.optimize_for_inference(frozen)
+    return frozen
+
+
+def export_frozen(
+    model, path, example_shape=(1, 1, 64, 64, 64), channels_last=True
+):
+    """Write a frozen inference artifact, see freeze.
+
+    Prepacked conv weights cannot be serialized, so the artifact is
+    saved before optimize_for_inference and load_frozen applies it.
+    """
+    frozen = freeze(model, example_shape, channels_last, optimize=False)
+    torch.jit.save(frozen, path)
+
+
+def load_frozen(path):
+    """Load an artifact written by export_frozen, optimized for
+    inference on this machine"""
+    frozen = torch.jit.load(path, map_location="cpu")
+    return torch.jit.optimize_for_inference(frozen)
+
+
+def compile_model(model, cache_dir=None):
+    """torch.compile a (fused) MeshNet with a persistent kernel cache.
+
+    Inductor keeps generated kernels and FX graphs in ``cache_dir``, so
+    later processes compiling the same model skip code generation.
+    """
+    if cache_dir is not None:
+        os.environ["TORCHINDUCTOR_CACHE_DIR"] = os.path.abspath(cache_dir)
+    import torch._inductor.config
+
+    torch._inductor.config.fx_graph_cache = True
+    layers = ChannelsLast(_layers(model))
+    return torch.compile(layers, dynamic=False)
+
+
+def _time(fn, x, repeats):
+    with torch.inference_mode():
+        fn(x)  # warm up: profiling executors and compilation
+        start = time.perf_counter()
+        for _ in range(repeats):
+            y = fn(x)
+    return y, (time.perf_counter() - start) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export a frozen CPU inference artifact and compare it "
+        "with eager PyTorch"
+    )
+    parser.add_argument("--checkpoint", help="MeshNet state dict")
+    parser.add_argument("--config", help="MeshNet config json")
+    parser.add_argument("--channels", type=int)
+    parser.add_argument("--classes", type=int)
+    parser.add_argument("--tfjs", help="tfjs model.json instead")
+    parser.add_argument("--output", default="model_frozen.pt")
+    parser.add_argument("--cube", type=int, default=64)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.tfjs:
+        from js2pytorch import tfjs_to_pytorch
+
+        model = tfjs_to_pytorch(args.tfjs)
+    else:
+        from convert import load_meshnet
+        from optimize import optimize_for_inference
+
+        model = load_meshnet(
+            args.checkpoint, args.config, args.channels, args.classes
+        )
+        model = optimize_for_inference(model.cpu())
+    model.eval()
+    in_channels = next(
+        m for m in model.modules() if isinstance(m, nn.Conv3d)
+    ).in_channels
+    shape = (1, in_channels, args.cube, args.cube, args.cube)
+
+    start = time.perf_counter()
+    export_frozen(model, args.output, shape)
+    print(f"export: {time.perf_counter() - start:.3f} s")
+    start = time.perf_counter()
+    frozen = load_frozen(args.output)
+    print(f"load:   {(time.perf_counter() - start) * 1e3:.1f} ms")
+
+    x = torch.rand(shape)
+    expected, eager_s = _time(_layers(model), x, args.repeats)
+    actual, frozen_s = _time(frozen, x, args.repeats)
+    print(f"eager:  {eager_s:.3f} s")
+    print(f"frozen: {frozen_s:.3f} s ({eager_s / frozen_s:.2f}x)")
+    print(f"max abs error: {(expected - actual).abs().max().item():.3e}")
+    print(f"argmax agreement: {argmax_agreement(expected, actual):.6f}")
+
+
+if __name__ == "__main__":
+    main()
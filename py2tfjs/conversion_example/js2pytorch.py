@@ -1,28 +1,144 @@
+import bisect
 import json
+import os
 import torch
 import torch.nn as nn
 import numpy as np
 
+from normalization import quantile_normalize
+
 device_name = "cuda:0" if torch.cuda.is_available() else "cpu"
 device = torch.device(device_name)
 
 
 def normalize(img):
-    """Unit interval preprocessing"""
-    img = (img - img.min()) / (img.max() - img.min())
-    return img
-
-
-def load_tfjs_model(json_path, bin_path):
+    """Unit interval preprocessing of a copy of ``img``, as floats"""
+    if isinstance(img, np.ndarray):
+        floating = np.issubdtype(img.dtype, np.floating)
+        img = img.astype(img.dtype if floating else np.float32)
+    elif img.is_floating_point():
+        img = img.clone()
+    else:
+        img = img.float()
+    return quantile_normalize(img, 0.0, 1.0)
+
+
+# numpy dtypes of the stored (possibly quantized) manifest weights
+MANIFEST_DTYPES = {
+    "float32": np.float32,
+    "float16": np.float16,
+    "uint8": np.uint8,
+    "uint16": np.uint16,
+    "int32": np.int32,
+}
+
+
+def dequantize(values, entry):
+    """Decode one weightsManifest entry to float32 (tfjs order, flat)"""
+    quantization = entry.get("quantization")
+    if quantization is None or quantization["dtype"] == "float16":
+        return values.astype(np.float32)
+    scale = np.asarray(quantization["scale"], dtype=np.float32)
+    vmin = np.asarray(quantization["min"], dtype=np.float32)
+    # per-channel scale/min run along the last (output channel) axis
+    values = values.reshape(entry["shape"]).astype(np.float32)
+    return (values * scale + vmin).reshape(-1)
+
+
+class TfjsWeights:
+    """Memory-mapped index of tfjs weights by manifest name.
+
+    Shards are mapped copy-on-write the first time a weight in them is
+    read, so nothing is loaded until it is touched. float32 weights come
+    back as views into the mapping (unless they straddle two shards) and
+    quantized ones are dequantized on demand.
+    """
+
+    def __init__(self, model_spec, dirname, bin_path=None):
+        self._index = {}
+        self._shards = {}
+        for group in model_spec["weightsManifest"]:
+            if bin_path is None:
+                paths = [os.path.join(dirname, p) for p in group["paths"]]
+            else:
+                paths = [bin_path]
+            # byte offset of every shard within the group
+            starts = [0]
+            for path in paths:
+                starts.append(starts[-1] + os.path.getsize(path))
+
+            offset = 0
+            for entry in group["weights"]:
+                stored = entry.get("quantization", entry)["dtype"]
+                dtype = np.dtype(MANIFEST_DTYPES[stored])
+                count = int(np.prod(entry["shape"]))
+                self._index[entry["name"]] = (
+                    entry,
+                    paths,
+                    starts,
+                    offset,
+                    dtype,
+                    count,
+                )
+                offset += count * dtype.itemsize
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def entry(self, name):
+        """The weightsManifest entry of a weight"""
+        return self._index[name][0]
+
+    def _shard(self, path):
+        if path not in self._shards:
+            self._shards[path] = np.memmap(path, dtype=np.uint8, mode="c")
+        return self._shards[path]
+
+    def stored(self, name):
+        """The weight as stored on disk, flat and possibly quantized"""
+        entry, paths, starts, offset, dtype, count = self._index[name]
+        remaining = count * dtype.itemsize
+        if remaining == 0:
+            return np.empty(0, dtype=dtype)
+
+        pieces = []
+        shard = bisect.bisect_right(starts, offset) - 1
+        while remaining > 0:
+            data = self._shard(paths[shard])
+            local = offset - starts[shard]
+            n = min(remaining, len(data) - local)
+            pieces.append(data[local : local + n])
+            offset += n
+            remaining -= n
+            shard += 1
+        if len(pieces) == 1:
+            return np.asarray(pieces[0]).view(dtype)
+        return np.concatenate(pieces).view(dtype)
+
+    def __getitem__(self, name):
+        """The weight as flat float32 values in tfjs order"""
+        entry = self.entry(name)
+        values = self.stored(name)
+        if "quantization" in entry:
+            return dequantize(values, entry)
+        return values
+
+
+def load_tfjs_model(json_path, bin_path=None):
     # Load JSON specification
     with open(json_path, "r") as f:
         model_spec = json.load(f)
 
-    # Load binary weights
-    with open(bin_path, "rb") as f:
-        weights_data = np.frombuffer(f.read(), dtype=np.float32)
+    # Index the weights; without an explicit .bin use the manifest shards
+    weights = TfjsWeights(model_spec, os.path.dirname(json_path), bin_path)
 
-    return model_spec, weights_data
+    return model_spec, weights
 
 
 def create_activation(activation_name):
@@ -48,16 +164,46 @@ def calculate_same_padding(kernel_size, dilation):
     return tuple(padding)
 
 
-def create_pytorch_model(model_spec, weights_data):
-    layers = []
-    weight_index = 0
-    in_channels = 1  # Start with 1 input channel
+def load_conv_weights(conv, weights, name, device="cpu"):
+    """Materialize the kernel and bias of a Conv3D layer into ``conv``"""
+    # tfjs order is (depth, height, width, in_channels, out_channels)
+    shape = list(conv.kernel_size) + [conv.in_channels, conv.out_channels]
+    kernel = torch.from_numpy(weights[f"{name}/kernel"].reshape(shape))
+    # restoring pytorch order; this is the only copy of the weight
+    weight = kernel.permute(4, 3, 0, 1, 2).to(device).contiguous()
+    conv.weight = nn.Parameter(weight)
+    if conv.bias is not None:
+        bias = torch.from_numpy(weights[f"{name}/bias"]).to(device)
+        conv.bias = nn.Parameter(bias)
+
+
+def _lazy_weights_hook(weights, name):
+    handles = []
+
+    def hook(module, args):
+        load_conv_weights(module, weights, name, args[0].device)
+        handles.pop().remove()
+
+    return handles, hook
 
-    for layer in model_spec["modelTopology"]["model_config"]["config"][
+
+def create_pytorch_model(model_spec, weights, lazy=False):
+    """Build an nn.Sequential from a tfjs spec and a TfjsWeights index.
+
+    Convolutions are created on the meta device, so no random init runs
+    and no memory is allocated for them. Their weights are copied out of
+    the mapped shards right away, or with ``lazy`` on the first forward
+    call through the layer (on the device of its input); until then a
+    lazy model must not be moved with ``.to()``.
+    """
+    layers = []
+    spec_layers = model_spec["modelTopology"]["model_config"]["config"][
         "layers"
-    ][
-        1:
-    ]:  # Skip input layer
+    ]
+    # channels_last: the input channels are the last input dimension
+    in_channels = spec_layers[0]["config"]["batch_input_shape"][-1]
+
+    for layer in spec_layers[1:]:  # Skip input layer
         if layer["class_name"] == "Conv3D":
             config = layer["config"]
             padding = calculate_same_padding(
@@ -70,31 +216,15 @@ def create_pytorch_model(model_spec, weights_data):
                 stride=config["strides"],
                 padding=padding,
                 dilation=config["dilation_rate"],
+                bias=config.get("use_bias", True),
+                device="meta",
             )
 
-            # Load weights and biases
-            weight_shape = conv.weight.shape
-            # putting the shape into tfjs order
-            weight_shape = [weight_shape[i] for i in (2, 3, 4, 1, 0)]
-            bias_shape = conv.bias.shape
-
-            weight_size = np.prod(weight_shape)
-            bias_size = np.prod(bias_shape)
-
-            weight = weights_data[
-                weight_index : weight_index + weight_size
-            ].reshape(weight_shape)
-            # restoring pytorch order
-            weight = np.transpose(weight, (4, 3, 0, 1, 2))
-            weight_index += weight_size
-
-            bias = weights_data[
-                weight_index : weight_index + bias_size
-            ].reshape(bias_shape)
-            weight_index += bias_size
-
-            conv.weight.data = torch.from_numpy(weight.copy())
-            conv.bias.data = torch.from_numpy(bias.copy())
+            if lazy:
+                handles, hook = _lazy_weights_hook(weights, config["name"])
+                handles.append(conv.register_forward_pre_hook(hook))
+            else:
+                load_conv_weights(conv, weights, config["name"])
 
             layers.append(conv)
 
@@ -108,9 +238,9 @@ def create_pytorch_model(model_spec, weights_data):
     return nn.Sequential(*layers)
 
 
-def tfjs_to_pytorch(json_path, bin_path):
-    model_spec, weights_data = load_tfjs_model(json_path, bin_path)
-    pytorch_model = create_pytorch_model(model_spec, weights_data)
+def tfjs_to_pytorch(json_path, bin_path=None, lazy=False):
+    model_spec, weights = load_tfjs_model(json_path, bin_path)
+    pytorch_model = create_pytorch_model(model_spec, weights, lazy)
     return pytorch_model
 
 
@@ -0,0 +1,116 @@
+import argparse
+import time
+
+import torch
+import torch.nn.functional as F
+
+
+def sliced_conv3d(conv, x, out_slice=1, in_slice=None, out=None):
+    """Conv3d computed one output-channel group at a time.
+
+    The Python counterpart of convByOutputChannelAndInputSlicing in
+    tensor-utils.js: each group of ``out_slice`` output channels is
+    accumulated over ``in_slice`` input channels at a time directly in
+    ``out``, so besides the output only one group's partial result is
+    ever live.
+
+    Args:
+        conv (nn.Conv3d): The layer to evaluate.
+        x (torch.Tensor): Input of shape (N, C_in, D, H, W).
+        out_slice (int): Output channels computed per group.
+        in_slice (int): Input channels per partial sum, None for all.
+        out (torch.Tensor): Preallocated (N, C_out, D', H', W') output.
+
+    Returns:
+        torch.Tensor: The convolution output.
+    """
+    in_channels, out_channels = conv.in_channels, conv.out_channels
+    in_slice = in_slice or in_channels
+    weight, bias = conv.weight, conv.bias
+    for start in range(0, out_channels, out_slice):
+        stop = min(start + out_slice, out_channels)
+        for i in range(0, in_channels, in_slice):
+            j = min(i + in_slice, in_channels)
+            part = F.conv3d(
+                x[:, i:j],
+                weight[start:stop, i:j],
+                None,
+                conv.stride,
+                conv.padding,
+                conv.dilation,
+            )
+            if out is None:
+                out = part.new_empty(
+                    (part.shape[0], out_channels) + part.shape[2:]
+                )
+            if i == 0:
+                out[:, start:stop] = part
+            else:
+                out[:, start:stop] += part
+            del part
+
+    if bias is not None:
+        out += bias.view(1, -1, 1, 1, 1)
+    return out
+
+
+def sliced_forward(layers, x, out_slice=1, in_slice=None, out=None):
+    """Run an nn.Sequential whose last layer is a Conv3d, slicing that
+    last layer with sliced_conv3d."""
+    for layer in layers[:-1]:
+        x = layer(x)
+    return sliced_conv3d(layers[-1], x, out_slice, in_slice, out)
+
+
+def _measure_forward(config_file, channels, n_classes, cube, slicing):
+    from meshnet import enMesh_checkpoint
+
+    torch.manual_seed(0)
+    model = enMesh_checkpoint(1, n_classes, channels, config_file).eval()
+    if slicing is not None:
+        model.set_channel_slicing(*slicing)
+    x = torch.rand(1, 1, cube, cube, cube)
+    start = time.perf_counter()
+    model(x)
+    return time.perf_counter() - start
+
+
+def main():
+    from profiling import run_isolated
+
+    parser = argparse.ArgumentParser(
+        description="Measure time and memory of channel-sliced inference"
+    )
+    parser.add_argument("--config", default="modelAE.json")
+    parser.add_argument("--channels", type=int, default=15)
+    parser.add_argument("--classes", type=int, default=104)
+    parser.add_argument("--cube", type=int, default=128)
+    parser.add_argument(
+        "--out-slices",
+        type=int,
+        nargs="+",
+        default=[0, 1, 8, 32],
+        help="output channels per group, 0 runs the plain forward pass",
+    )
+    parser.add_argument("--in-slice", type=int, default=None)
+    args = parser.parse_args()
+
+    print(f"{'out_slice':>9} {'in_slice':>8} {'seconds':>9} {'peak MiB':>9}")
+    for out_slice in args.out_slices:
+        slicing = (out_slice, args.in_slice) if out_slice > 0 else None
+        seconds, peak = run_isolated(
+            _measure_forward,
+            args.config,
+            args.channels,
+            args.classes,
+            args.cube,
+            slicing,
+        )
+        print(
+            f"{out_slice or 'off':>9} {str(args.in_slice):>8} "
+            f"{seconds:>9.2f} {peak / 2**20:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
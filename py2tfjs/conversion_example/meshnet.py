@@ -12,18 +12,21 @@ def set_channel_num(config, in_channels, n_classes, channels):
         config (dict): The configuration json for the network.
         in_channels (int): The number of input channels.
         n_classes (int): The number of output classes.
-        channels (int): The number of channels that each layer except the input and output layers will have.
+        channels (int): The number of channels that each layer except the input and output layers will have, None to keep the widths of the config (e.g. a pruned one).
 
     Returns:
         dict: The updated configuration json.
     """
-    # input layer
     config["layers"][0]["in_channels"] = in_channels
+    config["layers"][-1]["out_channels"] = n_classes
+    if channels is None:
+        return config
+
+    # input layer
     config["layers"][0]["out_channels"] = channels
 
     # output layer
     config["layers"][-1]["in_channels"] = channels
-    config["layers"][-1]["out_channels"] = n_classes
 
     # hidden layers
     for layer in config["layers"][1:-1]:
@@ -72,27 +75,37 @@ def init_weights(model):
                 nn.init.constant_(m.bias, 0.0)
 
 
+def meshnet_config(config_file, in_channels, n_classes, channels, fat=None):
+    """The layer configuration MeshNet builds from a config json"""
+    with open(config_file, "r") as f:
+        config = set_channel_num(
+            json.load(f), in_channels, n_classes, channels
+        )
+
+    if fat is not None:
+        if channels is None:
+            raise ValueError("fat layers are relative to channels")
+        chn = int(channels * 1.5)
+        if fat in {"i", "io"}:
+            config["layers"][0]["out_channels"] = chn
+            config["layers"][1]["in_channels"] = chn
+        if fat == "io":
+            config["layers"][-1]["in_channels"] = chn
+            config["layers"][-2]["out_channels"] = chn
+        if fat == "b":
+            config["layers"][3]["out_channels"] = chn
+            config["layers"][4]["in_channels"] = chn
+    return config
+
+
 class MeshNet(nn.Module):
     """Configurable MeshNet from https://arxiv.org/pdf/1612.00940.pdf"""
 
     def __init__(self, in_channels, n_classes, channels, config_file, fat=None):
         """Init"""
-        with open(config_file, "r") as f:
-            config = set_channel_num(
-                json.load(f), in_channels, n_classes, channels
-            )
-
-        if fat is not None:
-            chn = int(channels * 1.5)
-            if fat in {"i", "io"}:
-                config["layers"][0]["out_channels"] = chn
-                config["layers"][1]["in_channels"] = chn
-            if fat == "io":
-                config["layers"][-1]["in_channels"] = chn
-                config["layers"][-2]["out_channels"] = chn
-            if fat == "b":
-                config["layers"][3]["out_channels"] = chn
-                config["layers"][4]["in_channels"] = chn
+        config = meshnet_config(
+            config_file, in_channels, n_classes, channels, fat
+        )
 
         super(MeshNet, self).__init__()
 
@@ -108,17 +121,67 @@ class MeshNet(nn.Module):
         layers[-1] = layers[-1][0]
         self.model = nn.Sequential(*layers)
         init_weights(self.model)
+        self.channel_slicing = None
+
+    def set_channel_slicing(self, out_slice=1, in_slice=None):
+        """Compute the output layer in channel slices during inference.
+
+        Low-memory mode for the wide output layers of many-class models,
+        see lowmem.sliced_conv3d. ``out_slice=None`` turns it off.
+        """
+        if out_slice is None:
+            self.channel_slicing = None
+        else:
+            self.channel_slicing = (out_slice, in_slice)
+
+    def sliced_forward(self, x, out=None):
+        """Forward pass with the output layer computed in channel slices"""
+        from lowmem import sliced_forward
+
+        out_slice, in_slice = self.channel_slicing or (1, None)
+        with torch.inference_mode():
+            return sliced_forward(self.model, x, out_slice, in_slice, out)
 
     def forward(self, x):
         """Forward pass"""
+        if self.channel_slicing is not None and not self.training:
+            return self.sliced_forward(x)
         x = self.model(x)
         return x
 
 
 class enMesh_checkpoint(MeshNet):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkpoint_budget = None
+        self.checkpoint_plan = None
+        self._checkpoint_plans = {}
+
+    def set_checkpoint_budget(self, memory_budget=None):
+        """Checkpoint train_forward in segments that fit ``memory_budget``
+        bytes of activations instead of checkpointing every layer.
+
+        The plan (see checkpointing.plan_checkpoints) is made once per
+        input shape from the layers' activation sizes; the one used last
+        is ``self.checkpoint_plan``. None restores the default.
+        """
+        self.checkpoint_budget = memory_budget
+        self.checkpoint_plan = None
+        self._checkpoint_plans = {}
+
     def train_forward(self, x):
         y = x
         y.requires_grad_()
+        if self.checkpoint_budget is not None:
+            from checkpointing import checkpointed_forward, plan_checkpoints
+
+            shape = tuple(y.shape)
+            if shape not in self._checkpoint_plans:
+                self._checkpoint_plans[shape] = plan_checkpoints(
+                    self.model, shape, self.checkpoint_budget
+                )
+            self.checkpoint_plan = self._checkpoint_plans[shape]
+            return checkpointed_forward(self.model, self.checkpoint_plan, y)
         y = checkpoint_sequential(
             self.model, len(self.model), y, preserve_rng_state=False
         )
@@ -128,7 +191,10 @@ class enMesh_checkpoint(MeshNet):
         """Forward pass"""
         self.model.eval()
         with torch.inference_mode():
-            x = self.model(x)
+            if self.channel_slicing is not None:
+                x = self.sliced_forward(x)
+            else:
+                x = self.model(x)
         return x
 
     def forward(self, x):
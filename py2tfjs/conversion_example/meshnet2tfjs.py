@@ -1,8 +1,14 @@
+import argparse
 import torch
 import numpy as np
 import json
 import os
 
+try:
+    from optimize import inference_layers
+except ImportError:  # imported as conversion_example.meshnet2tfjs
+    from .optimize import inference_layers
+
 
 # Assuming `tfjs_spec` is your final dictionary containing the TensorFlow.js model specification
 # Let's save it to a file named 'model.json'
@@ -65,18 +71,69 @@ def get_activation_name(pytorch_activation):
     }
 
     class_name = pytorch_activation.__class__.__name__
+    if class_name == "ELU" and pytorch_activation.alpha != 1.0:
+        # the tfjs "elu" activation has no alpha parameter
+        raise ValueError(
+            f"tfjs only supports ELU(alpha=1), got {pytorch_activation.alpha}"
+        )
     if class_name in tfjs_activations_map:
         return tfjs_activations_map[class_name]
     else:
         raise ValueError(f"Unsupported PyTorch activation type: {class_name}")
 
 
+def check_same_padding(conv):
+    """tfjs "same" padding only matches stride 1 convs padded by
+    ``dilation * (kernel_size - 1) / 2``"""
+    for axis in range(3):
+        same = (conv.kernel_size[axis] - 1) * conv.dilation[axis] // 2
+        if conv.stride[axis] != 1 or conv.padding[axis] != same:
+            raise ValueError(
+                f"Cannot export {conv} as a tfjs 'same' padded Conv3D"
+            )
+
+
+def export_layers(pytorch_model):
+    """Layers of a MeshNet (or plain Sequential) in execution order.
+
+    Every Conv3d is given as a ``(conv, bn)`` pair where ``bn`` is the
+    BatchNorm3d that directly follows it, folded into the exported
+    weights, or None for BN-fused models. Activations are given as is.
+    """
+    layers = []
+    model = getattr(pytorch_model, "model", pytorch_model)
+    for module in inference_layers(model):
+        if isinstance(module, torch.nn.Conv3d):
+            check_same_padding(module)
+            layers.append((module, None))
+        elif isinstance(module, torch.nn.BatchNorm3d):
+            if not layers or not isinstance(layers[-1], tuple):
+                raise ValueError("BatchNorm3d must directly follow a Conv3d")
+            conv, bn = layers[-1]
+            if bn is not None:
+                raise ValueError("Only one BatchNorm3d per Conv3d")
+            layers[-1] = (conv, module)
+        else:
+            layers.append(module)
+    return layers
+
+
 def convert_pytorch_to_tfjs(pytorch_model, cube_size):
+    modules = export_layers(pytorch_model)
+    if not modules or not isinstance(modules[0], tuple):
+        raise ValueError("The model has to start with a Conv3d")
+    in_channels = modules[0][0].in_channels
     layers = [
         {
             "class_name": "InputLayer",
             "config": {
-                "batch_input_shape": [None, cube_size, cube_size, cube_size, 1],
+                "batch_input_shape": [
+                    None,
+                    cube_size,
+                    cube_size,
+                    cube_size,
+                    in_channels,
+                ],
                 "dtype": "float32",
                 "sparse": False,
                 "ragged": False,
@@ -87,30 +144,13 @@ def convert_pytorch_to_tfjs(pytorch_model, cube_size):
         }
     ]
 
-    layer_count = 0  # Counter for naming layers
-
     # Process each PyTorch layer and add corresponding layers to the config
-    for i, module in enumerate(pytorch_model.model):
-        if isinstance(module, torch.nn.Sequential):
-            for layer in module:
-                if isinstance(layer, torch.nn.Conv3d):
-                    layer_name = f"conv3d_{layer_count}"
-                    add_conv3d_layer(
-                        layers,
-                        layer.out_channels,
-                        list(layer.kernel_size),
-                        list(layer.dilation),
-                        list(layer.stride),
-                        layer_name,
-                    )
-                else:
-                    activation_name = f"activation_{layer_count}"
-                    add_activation_layer(
-                        layers, get_activation_name(layer), activation_name
-                    )
-                layer_count += 1
-        elif isinstance(module, torch.nn.Conv3d):
-            layer_name = "output"
+    for layer_count, module in enumerate(modules):
+        if isinstance(module, tuple):
+            module = module[0]
+            layer_name = f"conv3d_{layer_count}"
+            if layer_count == len(modules) - 1:
+                layer_name = "output"
             add_conv3d_layer(
                 layers,
                 module.out_channels,
@@ -119,7 +159,11 @@ def convert_pytorch_to_tfjs(pytorch_model, cube_size):
                 list(module.stride),
                 layer_name,
             )
-            layer_count += 1
+        else:
+            activation_name = f"activation_{layer_count}"
+            add_activation_layer(
+                layers, get_activation_name(module), activation_name
+            )
 
     # Name the last layer "output"
     layers[-1]["name"] = "output"
@@ -147,7 +191,7 @@ def convert_pytorch_to_tfjs(pytorch_model, cube_size):
     # Initialize the weights manifest list
     weights_manifest = []
 
-    input_channels = 1
+    input_channels = in_channels
     # Iterate through each layer in the layers list
     for layer in layers:
         class_name = layer["class_name"]
@@ -194,10 +238,25 @@ def convert_pytorch_to_tfjs(pytorch_model, cube_size):
     return tfjs_spec
 
 
-def extract_weights(layer):
+def extract_weights(layer, bn=None):
     # Extract the weights and biases, move to CPU and convert to numpy arrays
-    layer_weight = layer.weight.data.cpu().numpy()
-    layer_bias = layer.bias.data.cpu().numpy()
+    with torch.no_grad():
+        weight = layer.weight.detach()
+        if layer.bias is None:
+            bias = weight.new_zeros(layer.out_channels)
+        else:
+            bias = layer.bias.detach()
+        if bn is not None:
+            # fold an eval-mode BatchNorm3d into copies of the parameters
+            scale = torch.rsqrt(bn.running_var + bn.eps)
+            if bn.weight is not None:
+                scale = scale * bn.weight
+            weight = weight * scale.view(-1, 1, 1, 1, 1)
+            bias = (bias - bn.running_mean) * scale
+            if bn.bias is not None:
+                bias = bias + bn.bias
+    layer_weight = weight.float().cpu().numpy()
+    layer_bias = bias.float().cpu().numpy()
     # Transpose the weights to match TensorFlow.js's expected order
     # From: (out_channels, in_channels, depth, height, width)
     # To:   (height, width, depth, in_channels, out_channels)
@@ -209,48 +268,358 @@ def extract_weights(layer):
     return layer_weight_tfjs, layer_bias_tfjs
 
 
-def save_pytorch_weights_to_bin(pytorch_model, bin_file_path="model.bin"):
-    # This will hold all weights and biases in the correct order
-    all_weights = []
-
-    # Loop through each model layer
-    for layer in pytorch_model.model:
-        # If the layer is a Sequential, recursively process its layers
-        if isinstance(layer, torch.nn.Sequential):
-            for sublayer in layer:
-                if isinstance(sublayer, torch.nn.Conv3d):
-                    weights, biases = extract_weights(sublayer)
-                    all_weights.extend([weights, biases])
-        elif isinstance(layer, torch.nn.Conv3d):
-            weights, biases = extract_weights(layer)
-            all_weights.extend([weights, biases])
-
-    # Concatenate all the flattened weights and biases
-    combined_weights = np.concatenate(all_weights)
-
-    # Convert the concatenated array to bytes
-    weights_bytes = combined_weights.tobytes()
-
-    # Write the bytes to a .bin file
-    with open(bin_file_path, "wb") as bin_file:
-        bin_file.write(weights_bytes)
+# tensorflowjs_converter's default --weight_shard_size_bytes
+DEFAULT_SHARD_SIZE = 4 * 1024 * 1024
+
+# bytes per element of the dtypes a shard can store
+DTYPE_ITEMSIZE = {"float32": 4, "float16": 2, "uint8": 1, "int8": 1}
+
+
+def quantize_array(array, shape, quantize=None, per_channel=False):
+    """Encode a flattened tfjs-ordered array for storage.
+
+    Returns the array to write, the manifest "quantization" block (None for
+    plain float32) and the float32 values a loader will decode from it.
+    uint8 is the tfjs affine scheme ``value = q * scale + min``; with
+    ``per_channel`` scale and min are lists over the last (output channel)
+    axis. Stock tfjs only reads scalar scale/min, so meshnet2tfjs writes
+    per-channel files only for the js2pytorch target. int8 stores
+    symmetric int8 kernels (see int8_scale) in the same uint8 scheme with
+    ``min = -128 * scale`` and leaves biases float32, as int8 CPU kernels
+    do.
+    """
+    array = array.astype(np.float32, copy=False)
+    if quantize is None or (quantize == "int8" and len(shape) == 1):
+        return array, None, array
+    if quantize == "float16":
+        stored = array.astype(np.float16)
+        return stored, {"dtype": "float16"}, stored.astype(np.float32)
+    if quantize not in ("uint8", "int8"):
+        raise ValueError(f"Unsupported weight quantization: {quantize}")
+
+    values = array.reshape(shape)
+    axes = None
+    if per_channel and len(shape) > 1:
+        axes = tuple(range(len(shape) - 1))
+    if quantize == "int8":
+        scale = int8_scale(values, axes)
+        vmin = np.float32(-128) * scale
+        stored = int8_values(values, scale) + 128
+    else:
+        vmin = values.min(axis=axes)
+        vmax = values.max(axis=axes)
+        scale = ((vmax - vmin) / 255.0).astype(np.float32)
+        # constant tensors/channels would divide by zero
+        scale = np.where(scale > 0, scale, np.float32(1.0))
+        stored = np.clip(np.rint((values - vmin) / scale), 0, 255)
+    stored = stored.astype(np.uint8)
+    restored = stored.astype(np.float32) * scale + vmin
+
+    if np.ndim(scale) == 0:
+        quantization = {
+            "dtype": "uint8",
+            "scale": float(scale),
+            "min": float(vmin),
+        }
+    else:
+        quantization = {
+            "dtype": "uint8",
+            "scale": [float(v) for v in scale],
+            "min": [float(v) for v in vmin],
+        }
+    return stored.reshape(-1), quantization, restored.reshape(-1)
+
+
+def int8_scale(values, axes=None):
+    """Symmetric int8 scale ``max |w| / 127`` of a float32 array, over
+    ``axes`` (None for one scale per tensor)"""
+    scale = (np.abs(values).max(axis=axes) / np.float32(127)).astype(
+        np.float32
+    )
+    return np.where(scale > 0, scale, np.float32(1.0))
+
+
+def int8_values(values, scale):
+    """Integer values in -127..127 of a symmetric int8 encoding"""
+    return np.clip(np.rint(values / scale), -127, 127)
+
+
+def print_quantization_report(report):
+    """Print the per-weight errors returned by meshnet2tfjs"""
+    print(f"{'weight':<24} {'max |w|':>12} {'max abs err':>12}")
+    for name, max_abs, max_err in report:
+        print(f"{name:<24} {max_abs:>12.4e} {max_err:>12.4e}")
+
+
+def iter_conv3d_layers(pytorch_model):
+    """Yield the ``(conv, bn)`` pairs of a MeshNet in weightsManifest order,
+    see export_layers"""
+    for layer in export_layers(pytorch_model):
+        if isinstance(layer, tuple):
+            yield layer
+
+
+def iter_weight_arrays(pytorch_model):
+    """Yield the tfjs-ordered weights and biases one tensor at a time"""
+    for conv, bn in iter_conv3d_layers(pytorch_model):
+        weights, biases = extract_weights(conv, bn)
+        yield weights
+        yield biases
+
+
+class ShardedWeightWriter:
+    """Streams weight arrays into fixed-size group1-shardNofM.bin files.
+
+    The number of shards has to be known up front because it is part of
+    every file name, so the writer takes the total byte count of the
+    weights it is about to receive.
+    """
+
+    def __init__(self, dirname, total_bytes, shard_size=DEFAULT_SHARD_SIZE):
+        if shard_size is None or shard_size <= 0:
+            shard_size = max(total_bytes, 1)
+        n_shards = max(1, -(-total_bytes // shard_size))
+        self.dirname = dirname
+        self.shard_size = shard_size
+        self.paths = [
+            f"group1-shard{i + 1}of{n_shards}.bin" for i in range(n_shards)
+        ]
+        self._file = None
+        self._shard = -1
+        self._room = 0
+
+    def _next_shard(self):
+        if self._file is not None:
+            self._file.close()
+        self._shard += 1
+        if self._shard >= len(self.paths):
+            raise ValueError("More weight bytes than announced to the writer")
+        path = os.path.join(self.dirname, self.paths[self._shard])
+        self._file = open(path, "wb")
+        self._room = self.shard_size
+
+    def write(self, array):
+        """Append an array, splitting it across shard boundaries"""
+        data = memoryview(np.ascontiguousarray(array)).cast("B")
+        while len(data) > 0:
+            if self._room == 0:
+                self._next_shard()
+            n = min(self._room, len(data))
+            self._file.write(data[:n])
+            data = data[n:]
+            self._room -= n
+
+    def close(self):
+        # a model without weights still gets its (empty) announced shard
+        if self._shard < 0:
+            self._next_shard()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._shard != len(self.paths) - 1:
+            raise ValueError("Fewer weight bytes than announced to the writer")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self._file is not None:
+            self._file.close()
+
+
+def weights_nbytes(weights_manifest, quantize=None):
+    """Size of the manifest weights as written to disk"""
+    total = 0
+    for entry in weights_manifest:
+        dtype = quantize or "float32"
+        if dtype == "int8" and len(entry["shape"]) == 1:
+            dtype = "float32"  # int8 leaves biases float32
+        total += int(np.prod(entry["shape"])) * DTYPE_ITEMSIZE[dtype]
+    return total
+
+
+def write_weight_shards(
+    pytorch_model,
+    dirname,
+    weights_manifest,
+    shard_size=DEFAULT_SHARD_SIZE,
+    quantize=None,
+    per_channel=False,
+):
+    """Stream the weights into shards and return their manifest paths.
+
+    Each tensor is transposed, optionally quantized (see quantize_array)
+    and written as soon as it is extracted, so peak memory stays around
+    the size of the largest layer instead of a few copies of the whole
+    model. Quantization blocks are added to the ``weights_manifest``
+    entries in place.
+
+    Returns:
+        tuple: the shard paths and a ``(name, max |w|, max abs error)``
+        report entry per weight.
+    """
+    total_bytes = weights_nbytes(weights_manifest, quantize)
+    report = []
+    with ShardedWeightWriter(dirname, total_bytes, shard_size) as writer:
+        for entry, array in zip(
+            weights_manifest, iter_weight_arrays(pytorch_model)
+        ):
+            stored, quantization, restored = quantize_array(
+                array, entry["shape"], quantize, per_channel
+            )
+            if quantization is not None:
+                entry["quantization"] = quantization
+            writer.write(stored)
+            report.append(
+                (
+                    entry["name"],
+                    float(np.abs(array).max(initial=0)),
+                    float(np.abs(restored - array).max(initial=0)),
+                )
+            )
+    return writer.paths, report
+
+
+def remove_stale_shards(dirname, paths):
+    """Delete .bin files of an earlier export that ``paths`` (the new
+    weightsManifest) does not list"""
+    for name in os.listdir(dirname):
+        if name.endswith(".bin") and name not in paths:
+            os.remove(os.path.join(dirname, name))
 
 
-def meshnet2tfjs(model, dirname):
+def save_pytorch_weights_to_bin(pytorch_model, bin_file_path="model.bin"):
+    # Write the tensors one by one into a single .bin file
+    with open(bin_file_path, "wb") as bin_file:
+        for array in iter_weight_arrays(pytorch_model):
+            bin_file.write(array.astype(np.float32, copy=False).tobytes())
+
+
+def meshnet2tfjs(
+    model,
+    dirname,
+    shard_size=DEFAULT_SHARD_SIZE,
+    quantize=None,
+    per_channel=False,
+    target="tfjs",
+    cube=256,
+):
+    """Write model.json and weight shards for a MeshNet.
+
+    Works for every MeshNet/enMesh_checkpoint variant, BN-fused or not,
+    and for plain Sequentials of same-padded Conv3d and activations;
+    BatchNorm3d is folded while writing and Dropout is left out.
+
+    Args:
+        model (MeshNet): The model to convert.
+        dirname (str): Output directory.
+        shard_size (int): Bytes per weight shard, None for a single shard.
+        quantize (str): None (float32), "float16", "uint8" or "int8".
+        per_channel (bool): Per-output-channel scale/min for uint8/int8
+            kernels, only for ``target="js2pytorch"``.
+        target (str): "tfjs" for files stock tfjs loads, "js2pytorch"
+            for files only js2pytorch loads.
+        cube (int): Edge of the input cube in batch_input_shape.
+
+    Returns:
+        list: ``(name, max |w|, max abs error)`` per weight, see
+        print_quantization_report.
+    """
+    if target not in ("tfjs", "js2pytorch"):
+        raise ValueError(f"Unknown export target: {target}")
+    if per_channel and target == "tfjs":
+        raise ValueError(
+            "tfjs only reads per-tensor scale/min, per-channel weights "
+            "need target='js2pytorch'"
+        )
     # Ensure the directory exists
     if not os.path.exists(dirname):
         os.makedirs(dirname)
 
     # Convert the PyTorch model to TensorFlow.js model specification
-    tfjs_model_spec = convert_pytorch_to_tfjs(model, 256)
+    tfjs_model_spec = convert_pytorch_to_tfjs(model, cube)
+
+    # Stream the PyTorch model weights into binary shards first so that
+    # model.json never points at shards that were not written
+    group = tfjs_model_spec["weightsManifest"][0]
+    group["paths"], report = write_weight_shards(
+        model, dirname, group["weights"], shard_size, quantize, per_channel
+    )
+    remove_stale_shards(dirname, group["paths"])
 
     # Save the TensorFlow.js model specification JSON file
     model_json_path = os.path.join(dirname, "model.json")
     save_tfjs_model_spec(tfjs_model_spec, model_json_path)
 
-    # Save the PyTorch model weights to a binary file
-    model_bin_path = os.path.join(dirname, "model.bin")
-    save_pytorch_weights_to_bin(model, model_bin_path)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert a MeshNet checkpoint to a tfjs model"
+    )
+    parser.add_argument("checkpoint", help="MeshNet state dict")
+    parser.add_argument("config", help="MeshNet config json")
+    parser.add_argument(
+        "--channels",
+        type=int,
+        default=None,
+        help="hidden width (default: the widths in the config)",
+    )
+    parser.add_argument("--classes", type=int, required=True)
+    parser.add_argument("--in-channels", type=int, default=1)
+    parser.add_argument("--fat", default=None)
+    parser.add_argument("--output", required=True, help="tfjs model dir")
+    parser.add_argument(
+        "--shard-size",
+        type=int,
+        default=DEFAULT_SHARD_SIZE,
+        help="bytes per weight shard, 0 for a single shard",
+    )
+    parser.add_argument(
+        "--quantize", choices=["float16", "uint8", "int8"], default=None
+    )
+    parser.add_argument(
+        "--per-channel",
+        action="store_true",
+        help="per-output-channel uint8/int8 scales, needs --target "
+        "js2pytorch",
+    )
+    parser.add_argument(
+        "--target", choices=["tfjs", "js2pytorch"], default="tfjs"
+    )
+    parser.add_argument(
+        "--cube", type=int, default=256, help="input cube edge in model.json"
+    )
+    args = parser.parse_args()
+    if args.per_channel and args.target == "tfjs":
+        parser.error("--per-channel needs --target js2pytorch")
+
+    from convert import load_meshnet
+    from optimize import optimize_for_inference
+
+    model = load_meshnet(
+        args.checkpoint,
+        args.config,
+        args.channels,
+        args.classes,
+        args.in_channels,
+        args.fat,
+    )
+    report = meshnet2tfjs(
+        optimize_for_inference(model.cpu()),
+        args.output,
+        args.shard_size or None,
+        args.quantize,
+        args.per_channel,
+        args.target,
+        args.cube,
+    )
+    if args.quantize is not None:
+        print_quantization_report(report)
 
 
-# meshnet2tfjs(model, "/tmp/testmodel")
+if __name__ == "__main__":
+    main()
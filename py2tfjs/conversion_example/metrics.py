@@ -0,0 +1,34 @@
+import torch
+
+
+def confusion_matrix(reference, candidate, n_classes):
+    """(n_classes, n_classes) voxel counts, rows are reference labels"""
+    index = reference.reshape(-1).long() * n_classes
+    index += candidate.reshape(-1).long()
+    counts = torch.bincount(index, minlength=n_classes * n_classes)
+    return counts.reshape(n_classes, n_classes)
+
+
+def argmax_agreement(reference, candidate):
+    """Fraction of voxels whose argmax over classes (dim 1) agrees"""
+    same = reference.argmax(1) == candidate.argmax(1)
+    return same.float().mean().item()
+
+
+def per_class_agreement(confusion):
+    """For every reference class, the fraction of its voxels the
+    candidate labels the same (None for absent classes)"""
+    total = confusion.sum(1)
+    return [
+        (confusion[c, c] / total[c]).item() if total[c] else None
+        for c in range(confusion.shape[0])
+    ]
+
+
+def dice_per_class(confusion):
+    """Dice overlap per class (None where both segmentations are empty)"""
+    size = confusion.sum(0) + confusion.sum(1)
+    return [
+        (2 * confusion[c, c] / size[c]).item() if size[c] else None
+        for c in range(confusion.shape[0])
+    ]
@@ -0,0 +1,251 @@
+import math
+
+import numpy as np
+import torch
+
+
+def _chunks(volume, chunk_size):
+    """Flat float32 chunks of a tensor, an array or a list of either"""
+    if isinstance(volume, (list, tuple)):
+        for part in volume:
+            yield from _chunks(part, chunk_size)
+        return
+    flat = torch.as_tensor(volume).reshape(-1)
+    for start in range(0, flat.numel(), chunk_size):
+        yield flat[start : start + chunk_size].float()
+
+
+def _numel(volume):
+    if isinstance(volume, (list, tuple)):
+        return sum(_numel(part) for part in volume)
+    return int(np.prod(volume.shape))
+
+
+# the first pass bins float32 values by their top 12 bits: the sign, the
+# exponent and 3 mantissa bits, so it needs no value range
+RADIX_SHIFT = 20
+RADIX_BINS = 1 << (32 - RADIX_SHIFT)
+
+
+def _radix_bounds(index):
+    """Smallest and largest float32 of a first-pass bin.
+
+    Bins are ordered like their values: the first half holds negative
+    values by decreasing magnitude, the second half the rest.
+    """
+    half = RADIX_BINS // 2
+    negative = index < half
+    pattern = half - 1 - index if negative else index - half
+    low = pattern << RADIX_SHIFT
+    high = low + (1 << RADIX_SHIFT) - 1
+    if negative:
+        # -0.0 is counted as 0.0
+        low = max(low, 1)
+    magnitudes = np.array([low, high], dtype=np.int32).view(np.float32)
+    # the outermost bins hold the infinities and NaN bit patterns
+    low, high = (math.inf if np.isnan(m) else float(m) for m in magnitudes)
+    return (-high, -low) if negative else (low, high)
+
+
+class _Selection:
+    """Search state of one order statistic.
+
+    The value of rank ``rank`` among the ``count`` voxels in the closed
+    interval ``[lo, hi]``; each pass histograms that interval and
+    narrows it to the exact value range of the bin holding the rank,
+    until few enough voxels are left to gather.
+    """
+
+    def __init__(self, rank, bins):
+        self.rank = rank
+        self.bins = bins
+        # set from the first histogram by narrow
+        self.lo, self.hi, self.count = None, None, None
+        self.value = None
+
+    @property
+    def key(self):
+        return self.lo, self.hi, self.bins
+
+    def bin_index(self, values):
+        inside = values[(values >= self.lo) & (values <= self.hi)]
+        # in float64: the span of a float32 interval may overflow float32
+        scale = self.bins / (self.hi - self.lo)
+        index = ((inside.double() - self.lo) * scale).long()
+        index.clamp_(0, self.bins - 1)
+        return inside, index
+
+    def narrow(self, counts, bounds):
+        """Move to the bin of a histogram holding the rank;
+        ``bounds(b)`` is the value range of bin ``b``"""
+        below = torch.cumsum(counts, 0)
+        b = int((below <= self.rank).sum())
+        self.count = int(counts[b])
+        self.rank -= int(below[b]) - self.count
+        self.lo, self.hi = bounds(b)
+        if self.lo == self.hi:
+            self.value = self.lo
+
+
+def _bin_stats(bins):
+    return (
+        torch.zeros(bins, dtype=torch.long),
+        torch.full((bins,), math.inf),
+        torch.full((bins,), -math.inf),
+    )
+
+
+def _accumulate(stats, inside, index):
+    counts, lows, highs = stats
+    counts += torch.bincount(index, minlength=len(counts))
+    lows.scatter_reduce_(0, index, inside, "amin")
+    highs.scatter_reduce_(0, index, inside, "amax")
+
+
+def _radix_pass(volume, chunk_size):
+    """Count the values per first-pass bin"""
+    counts = torch.zeros(RADIX_BINS, dtype=torch.long)
+    for chunk in _chunks(volume, chunk_size):
+        # adding 0.0 turns -0.0 into 0.0
+        bits = (chunk + 0.0).view(torch.int32)
+        index = (bits >> RADIX_SHIFT) & (RADIX_BINS - 1)
+        counts += torch.bincount(index, minlength=RADIX_BINS)
+    # bit patterns of negative values sort backwards
+    half = RADIX_BINS // 2
+    return torch.cat([counts[half:].flip(0), counts[:half]])
+
+
+def _selection_pass(volume, narrow, gather, chunk_size):
+    """One pass over the volume for every open selection: histogram the
+    intervals of those in ``narrow`` and collect the values of those in
+    ``gather``.
+
+    Returns:
+        list: ``(counts, lows, highs)`` per bin of each ``narrow``
+        selection.
+    """
+    stats = [_bin_stats(s.bins) for s in narrow]
+    gathered = [[] for _ in gather]
+    for chunk in _chunks(volume, chunk_size):
+        # selections searching the same interval share the binning
+        binned = {}
+        for s, stat in zip(narrow, stats):
+            if s.key not in binned:
+                binned[s.key] = s.bin_index(chunk)
+            _accumulate(stat, *binned[s.key])
+        found = {}
+        for s, parts in zip(gather, gathered):
+            if s.key not in found:
+                found[s.key] = chunk[(chunk >= s.lo) & (chunk <= s.hi)]
+            parts.append(found[s.key])
+    for s, parts in zip(gather, gathered):
+        values = torch.cat(parts)
+        s.value = float(torch.kthvalue(values, s.rank + 1).values)
+    return stats
+
+
+def _partition(volume, ranks):
+    """Order statistics of an in-memory volume by partitioning a copy"""
+    if isinstance(volume, torch.Tensor):
+        volume = volume.detach().cpu().numpy()
+    flat = np.array(volume, dtype=np.float32).reshape(-1)
+    if flat.size == 0:
+        raise ValueError("Cannot take order statistics of an empty volume")
+    flat.partition(sorted(set(ranks)))
+    return flat.size, [float(flat[rank]) for rank in ranks]
+
+
+def order_statistics(
+    volume,
+    ranks,
+    bins=4096,
+    chunk_size=1 << 22,
+    gather_limit=1 << 20,
+    partition_limit=1 << 25,
+):
+    """Exact order statistics of a volume without sorting it.
+
+    A single tensor or array of at most ``partition_limit`` voxels is
+    copied once and partitioned (np.partition), the fastest way when
+    the copy fits in memory. Anything else is streamed: a first pass
+    histograms the float32 bit patterns, which needs no value range,
+    then every pass histograms the current interval of each rank into
+    ``bins`` bins and narrows it to the bin holding the rank, until at
+    most ``gather_limit`` values are left (which are then gathered and
+    selected) or a single distinct value. Each pass streams
+    ``chunk_size`` voxels at a time, so memory does not grow with the
+    volume.
+
+    Returns:
+        tuple: The number of voxels and the values at ``ranks`` (0-based).
+    """
+    if (
+        not isinstance(volume, (list, tuple))
+        and _numel(volume) <= partition_limit
+    ):
+        return _partition(volume, ranks)
+
+    counts = _radix_pass(volume, chunk_size)
+    n = int(counts.sum())
+    if n == 0:
+        raise ValueError("Cannot take order statistics of an empty volume")
+    selections = []
+    for rank in ranks:
+        s = _Selection(rank, bins)
+        s.narrow(counts, _radix_bounds)
+        selections.append(s)
+
+    while True:
+        pending = [s for s in selections if s.value is None]
+        if not pending:
+            break
+        gather = [s for s in pending if s.count <= gather_limit]
+        narrow = [s for s in pending if s.count > gather_limit]
+        for s, (counts, lows, highs) in zip(
+            narrow, _selection_pass(volume, narrow, gather, chunk_size)
+        ):
+            s.narrow(counts, lambda b: (float(lows[b]), float(highs[b])))
+    return n, [s.value for s in selections]
+
+
+def quantiles(volume, qs, **kwargs):
+    """Quantiles of a volume with linear interpolation.
+
+    Matches ``torch.quantile``/``np.quantile`` up to the rounding of the
+    final interpolation (the order statistics themselves are exact), but
+    works on volumes of any size or on a list of chunks. Keyword arguments
+    go to order_statistics.
+    """
+    n = _numel(volume)
+    positions = [q * (n - 1) for q in qs]
+    ranks = sorted(
+        {math.floor(p) for p in positions}
+        | {min(math.floor(p) + 1, n - 1) for p in positions}
+    )
+    _, values = order_statistics(volume, ranks, **kwargs)
+    value = dict(zip(ranks, values))
+    results = []
+    for p in positions:
+        k = math.floor(p)
+        low, high = value[k], value[min(k + 1, n - 1)]
+        results.append(low + (p - k) * (high - low))
+    return results
+
+
+def quantile_normalize(img, qmin=0.01, qmax=0.99, **kwargs):
+    """Rescale a volume in place so that its qmin/qmax quantiles map to 0/1.
+
+    ``img`` may be a floating point tensor or array, or a list of them
+    holding the chunks of one volume. Keyword arguments go to
+    order_statistics.
+    """
+    low, high = quantiles(img, (qmin, qmax), **kwargs)
+    scale = high - low if high > low else 1.0
+    parts = img if isinstance(img, (list, tuple)) else [img]
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            part -= low
+            part /= scale
+        else:
+            part.sub_(low).div_(scale)
+    return img
@@ -0,0 +1,198 @@
+import argparse
+import copy
+import json
+
+import torch
+import torch.nn as nn
+
+# modules that are the identity in eval mode
+NO_OPS = (nn.Identity, nn.modules.dropout._DropoutNd)
+# side of the random cube the optimized model is checked on by default
+PROBE_CUBE = 16
+
+
+def inference_layers(module):
+    """Leaf modules of a (nested) Sequential in execution order.
+
+    Eval-mode no-ops (Dropout, Identity) are skipped. Containers other
+    than nn.Sequential are kept whole since their forward may do more
+    than chain their children.
+    """
+    if isinstance(module, nn.Sequential):
+        for child in module:
+            yield from inference_layers(child)
+    elif not isinstance(module, NO_OPS):
+        yield module
+
+
+def fold_bn_(conv, bn):
+    """Fold an eval-mode BatchNorm3d into the preceding Conv3d in place"""
+    with torch.no_grad():
+        scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+        conv.weight.mul_(scale.view(-1, 1, 1, 1, 1))
+        if conv.bias is None:
+            conv.bias = nn.Parameter(torch.zeros_like(bn.running_mean))
+        conv.bias.sub_(bn.running_mean).mul_(scale).add_(bn.bias)
+    return conv
+
+
+def optimize_layers(module):
+    """Flat nn.Sequential of convs and activations with BN folded in.
+
+    The convs of ``module`` are modified in place; BatchNorm3d layers that
+    do not follow a Conv3d are kept as they are.
+    """
+    layers = []
+    for layer in inference_layers(module):
+        if (
+            isinstance(layer, nn.BatchNorm3d)
+            and layer.affine
+            and layer.running_mean is not None
+            and layers
+            and isinstance(layers[-1], nn.Conv3d)
+        ):
+            fold_bn_(layers[-1], layer)
+        else:
+            layers.append(layer)
+    return nn.Sequential(*layers)
+
+
+def optimize_for_inference(model, example=None, rtol=1e-4):
+    """Fold, prune and flatten a copy of a MeshNet-like model for
+    inference.
+
+    Returns a copy of a MeshNet/enMesh_checkpoint whose ``model`` is the
+    flat layer list of optimize_layers (or that list for a plain
+    nn.Sequential), so exporters and PyTorch itself see one conv and one
+    activation per block.
+
+    Folding rewrites conv weights, so it works on a deep copy: the caller
+    keeps an intact model, also when the check fails, and exporters that
+    still need the BatchNorm layers (the folded checkpoint of main, the
+    round trip) can compare against it. The copy costs one set of
+    weights, a few MB, next to the volumes it runs on.
+
+    The optimized model is always checked against the original, on
+    ``example`` or else on a random ``PROBE_CUBE`` cube.
+
+    Raises:
+        ValueError: If the outputs differ by more than ``rtol`` relative
+            to the largest output magnitude (at least 1), since folding
+            reorders float32 sums.
+    """
+    model = copy.deepcopy(model).eval()
+    if example is None:
+        in_channels = next(
+            m for m in model.modules() if isinstance(m, nn.Conv3d)
+        ).in_channels
+        example = torch.rand(
+            (1, in_channels) + (PROBE_CUBE,) * 3,
+            generator=torch.Generator().manual_seed(0),
+        )
+        example = example.to(next(model.parameters()).device)
+    with torch.inference_mode():
+        expected = model(example)
+
+    if isinstance(model, nn.Sequential):
+        model = optimize_layers(model).eval()
+    else:
+        model.model = optimize_layers(model.model).eval()
+
+    with torch.inference_mode():
+        error = (model(example) - expected).abs().max().item()
+    relative = error / max(1.0, expected.abs().max().item())
+    if relative > rtol:
+        raise ValueError(
+            f"Optimized model deviates by {relative:.3e} relative to "
+            f"its largest output (rtol {rtol:.1e})"
+        )
+    return model
+
+
+def load_folded(meshnet, optimized):
+    """Copy the convs of an optimized model into ``meshnet``, a MeshNet
+    built from the same config with ``"bnorm": false``"""
+    if any(isinstance(m, nn.BatchNorm3d) for m in optimized.modules()):
+        raise ValueError("The optimized model still has BatchNorm3d layers")
+    source = [m for m in optimized.modules() if isinstance(m, nn.Conv3d)]
+    target = [m for m in meshnet.modules() if isinstance(m, nn.Conv3d)]
+    if len(source) != len(target):
+        raise ValueError(
+            f"{len(source)} optimized convs for {len(target)} MeshNet convs"
+        )
+    with torch.no_grad():
+        for src, dst in zip(source, target):
+            dst.weight.copy_(src.weight)
+            if src.bias is None:
+                dst.bias.zero_()
+            else:
+                dst.bias.copy_(src.bias)
+    return meshnet
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Optimize a MeshNet checkpoint for inference"
+    )
+    parser.add_argument("checkpoint", help="MeshNet state dict")
+    parser.add_argument("config", help="MeshNet config json")
+    parser.add_argument(
+        "--channels",
+        type=int,
+        default=None,
+        help="hidden width (default: the widths in the config)",
+    )
+    parser.add_argument("--classes", type=int, required=True)
+    parser.add_argument("--in-channels", type=int, default=1)
+    parser.add_argument("--fat", default=None)
+    parser.add_argument("--cube", type=int, default=32)
+    parser.add_argument(
+        "--output-config",
+        help="write the folded config (no BatchNorm) here",
+    )
+    parser.add_argument(
+        "--output-checkpoint",
+        help="write the folded MeshNet state dict here, loadable with "
+        "--output-config",
+    )
+    args = parser.parse_args()
+    if bool(args.output_config) != bool(args.output_checkpoint):
+        parser.error("--output-config and --output-checkpoint go together")
+
+    from convert import load_meshnet
+    from meshnet import enMesh_checkpoint, meshnet_config
+
+    model = load_meshnet(
+        args.checkpoint,
+        args.config,
+        args.channels,
+        args.classes,
+        args.in_channels,
+        args.fat,
+    ).cpu()
+    before = sum(1 for _ in model.model.modules())
+    example = torch.rand((1, args.in_channels) + (args.cube,) * 3)
+    optimized = optimize_for_inference(model, example)
+    after = sum(1 for _ in optimized.model.modules())
+    print(f"modules: {before} -> {after}")
+
+    if args.output_config:
+        config = meshnet_config(
+            args.config,
+            args.in_channels,
+            args.classes,
+            args.channels,
+            args.fat,
+        )
+        config["bnorm"] = False
+        with open(args.output_config, "w") as f:
+            json.dump(config, f, indent=2)
+        folded = enMesh_checkpoint(
+            args.in_channels, args.classes, None, args.output_config
+        )
+        load_folded(folded, optimized.model)
+        torch.save(folded.state_dict(), args.output_checkpoint)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+import functools
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+
+def _inplace_activation(module):
+    """In-place functional form of an activation module"""
+    if isinstance(module, nn.ReLU):
+        return torch.relu_
+    if isinstance(module, nn.ELU):
+        return functools.partial(F.elu_, alpha=module.alpha)
+    if isinstance(module, nn.LeakyReLU):
+        return functools.partial(
+            F.leaky_relu_, negative_slope=module.negative_slope
+        )
+    if isinstance(module, nn.Sigmoid):
+        return torch.sigmoid_
+    if isinstance(module, nn.Tanh):
+        return torch.tanh_
+    raise ValueError(f"Unsupported activation: {module.__class__.__name__}")
+
+
+def _fold_bn(weight, bias, bn):
+    """Fold an eval-mode BatchNorm3d into copies of the conv parameters"""
+    scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+    weight = weight * scale.view(-1, 1, 1, 1, 1)
+    bias = (bias - bn.running_mean) * scale + bn.bias
+    return weight, bias
+
+
+class PlanStep:
+    """One Conv3d with its folded BatchNorm and in-place activation"""
+
+    def __init__(self, conv):
+        for axis in range(3):
+            same = (conv.kernel_size[axis] - 1) // 2 * conv.dilation[axis]
+            if conv.stride[axis] != 1 or conv.padding[axis] != same:
+                raise ValueError(
+                    "Execution plans need stride 1 convs with same padding"
+                )
+        self.weight = conv.weight.detach()
+        if conv.bias is None:
+            self.bias = self.weight.new_zeros(conv.out_channels)
+        else:
+            self.bias = conv.bias.detach()
+        self.dilation = conv.dilation
+        self.padding = conv.padding
+        self.in_channels = conv.in_channels
+        self.out_channels = conv.out_channels
+        self.activation = None
+
+
+class ExecutionPlan:
+    """Static inference plan for a chain of same-padded Conv3d layers.
+
+    All activations live in two preallocated ping-pong buffers that carry
+    a persistent zero halo as wide as the largest padding, so every conv
+    runs with ``padding=0`` on a view of the previous activation and no
+    full-size padded copies are made. PyTorch convs cannot write into
+    existing storage, so layers are evaluated in depth slabs whose
+    results are copied into the other buffer; this keeps the only
+    per-layer allocations at slab size and peak activation memory at
+    about two layers. Buffers are reused as long as the input shape does
+    not change.
+    """
+
+    def __init__(self, steps, slab_depth=16):
+        self.steps = steps
+        self.slab_depth = slab_depth
+        self.halo = tuple(
+            max(step.padding[axis] for step in steps) for axis in range(3)
+        )
+        self._buffers = None
+
+    @classmethod
+    def from_model(cls, model, slab_depth=16):
+        """Build a plan from a (fused or not) MeshNet-like model.
+
+        The model is only read: BatchNorm3d layers are folded into copies
+        of the conv weights, Dropout and Identity are skipped.
+        """
+        steps = []
+        with torch.no_grad():
+            for module in model.modules():
+                if isinstance(module, nn.Conv3d):
+                    steps.append(PlanStep(module))
+                elif isinstance(module, nn.BatchNorm3d):
+                    step = steps[-1]
+                    step.weight, step.bias = _fold_bn(
+                        step.weight, step.bias, module
+                    )
+                elif isinstance(
+                    module, (nn.Dropout, nn.Dropout3d, nn.Identity)
+                ):
+                    continue
+                elif len(module._modules) == 0:
+                    steps[-1].activation = _inplace_activation(module)
+        return cls(steps, slab_depth)
+
+    @classmethod
+    def from_config(
+        cls,
+        config_file,
+        checkpoint,
+        in_channels=1,
+        n_classes=3,
+        channels=15,
+        fat=None,
+        slab_depth=16,
+    ):
+        """Build a plan from a MeshNet config json and a saved state dict"""
+        from meshnet import MeshNet
+
+        model = MeshNet(in_channels, n_classes, channels, config_file, fat)
+        state = torch.load(checkpoint, map_location="cpu")
+        model.load_state_dict(state.get("model_state_dict", state))
+        model.eval()
+        return cls.from_model(model, slab_depth)
+
+    def _allocate(self, x):
+        n, _, d, h, w = x.shape
+        channels = max(step.out_channels for step in self.steps[:-1])
+        channels = max(channels, self.steps[0].in_channels)
+        shape = (
+            n,
+            channels,
+            d + 2 * self.halo[0],
+            h + 2 * self.halo[1],
+            w + 2 * self.halo[2],
+        )
+        key = (tuple(x.shape), x.dtype, x.device)
+        if self._buffers is None or self._buffers[0] != key:
+            self._buffers = (
+                key,
+                x.new_zeros(shape),
+                x.new_zeros(shape),
+            )
+        return self._buffers[1:]
+
+    def _interior(self, buffer, channels, shape, margin=(0, 0, 0)):
+        """View of the first ``channels`` of a buffer's volume, grown by
+        ``margin`` voxels into the halo"""
+        region = tuple(
+            slice(halo - pad, halo + size + pad)
+            for halo, size, pad in zip(self.halo, shape, margin)
+        )
+        return buffer[(slice(None), slice(0, channels)) + region]
+
+    def _run_step(self, step, source, target):
+        """Evaluate one layer slab by slab from ``source`` into ``target``.
+
+        ``source`` is the input grown by the layer's padding into the
+        zero halo, ``target`` the exact output region.
+        """
+        depth = target.shape[2]
+        pad = step.padding[0]
+        for start in range(0, depth, self.slab_depth):
+            stop = min(start + self.slab_depth, depth)
+            slab = F.conv3d(
+                source[:, :, start : stop + 2 * pad],
+                step.weight,
+                step.bias,
+                dilation=step.dilation,
+            )
+            if step.activation is not None:
+                step.activation(slab)
+            target[:, :, start:stop] = slab
+            del slab
+
+    def __call__(self, x, out=None):
+        """Run the plan on a (N, C, D, H, W) input.
+
+        Returns ``out`` (allocated if not given), never a view of the
+        internal buffers.
+        """
+        shape = tuple(x.shape[2:])
+        last = self.steps[-1]
+        if out is None:
+            out = x.new_empty((x.shape[0], last.out_channels) + shape)
+
+        with torch.inference_mode():
+            buffers = self._allocate(x)
+            self._interior(buffers[0], x.shape[1], shape).copy_(x)
+            current = 0
+            for i, step in enumerate(self.steps):
+                source = self._interior(
+                    buffers[current], step.in_channels, shape, step.padding
+                )
+                if i == len(self.steps) - 1:
+                    target = out
+                else:
+                    target = self._interior(
+                        buffers[1 - current], step.out_channels, shape
+                    )
+                self._run_step(step, source, target)
+                current = 1 - current
+        return out
@@ -0,0 +1,174 @@
+import argparse
+import copy
+import json
+import os
+import time
+
+import torch
+import torch.nn as nn
+
+from optimize import optimize_layers
+
+# --dtypes names
+DTYPES = {
+    "float32": torch.float32,
+    "bfloat16": torch.bfloat16,
+    "float16": torch.float16,
+}
+
+
+class ReducedPrecision(nn.Module):
+    """Runs a conv stack with weights and activations in a 16-bit dtype.
+
+    Everything up to the last conv (the classifier) is stored in
+    ``dtype``; the CPU conv kernels accumulate in float32 and round once
+    per output. The last conv and the logits it produces stay float32, so
+    argmax decisions between close classes are not made in 16 bits.
+    """
+
+    def __init__(self, layers, dtype=torch.bfloat16):
+        super().__init__()
+        layers = list(layers)
+        last = max(
+            i for i, m in enumerate(layers) if isinstance(m, nn.Conv3d)
+        )
+        self.dtype = dtype
+        self.body = nn.Sequential(*layers[:last]).to(dtype)
+        self.head = nn.Sequential(*layers[last:]).float()
+
+    def forward(self, x):
+        x = self.body(x.to(self.dtype))
+        return self.head(x.float())
+
+
+def reduced_precision(model, dtype=torch.bfloat16):
+    """Reduced-precision eval copy of a MeshNet, enMesh_checkpoint or
+    tfjs_to_pytorch model; ``model`` itself is left float32.
+
+    BatchNorm is folded before casting, so its statistics never round.
+    """
+    if dtype == torch.float32:
+        return model
+    layers = copy.deepcopy(getattr(model, "model", model))
+    return ReducedPrecision(optimize_layers(layers).eval(), dtype).eval()
+
+
+def run_precision(spec, dtype, volume=None, cube=256, threads=1, repeats=1):
+    """Segment the reference volume in one dtype; meant to run in its own
+    process so peak memory is per dtype.
+
+    Returns:
+        dict: Median seconds, voxels per second and the argmax labels.
+    """
+    from benchmark import load_model, phantom
+
+    torch.set_num_threads(threads)
+    # config-only specs are randomly initialized, the same in every process
+    torch.manual_seed(0)
+    model = reduced_precision(load_model(spec), DTYPES[dtype])
+    if volume is None:
+        x = phantom(cube)
+    else:
+        from roundtrip import load_volume
+
+        x = load_volume(volume)
+    seconds = []
+    with torch.inference_mode():
+        for _ in range(repeats):
+            start = time.perf_counter()
+            y = model(x)
+            seconds.append(time.perf_counter() - start)
+    seconds = sorted(seconds)[len(seconds) // 2]
+    return {
+        "seconds": seconds,
+        "voxels_per_s": x[0, 0].numel() / seconds,
+        "labels": y.argmax(1).to(torch.uint8).numpy(),
+    }
+
+
+def precision_report(
+    spec, dtypes, volume=None, cube=256, threads=1, repeats=1, min_dice=0.99
+):
+    """Throughput, peak memory and agreement with float32 per dtype.
+
+    A dtype is marked ``safe`` when the Dice of every class present in
+    either segmentation reaches ``min_dice``.
+    """
+    from metrics import confusion_matrix, dice_per_class
+    from profiling import run_isolated
+
+    report = {}
+    reference = None
+    for dtype in ["float32"] + [d for d in dtypes if d != "float32"]:
+        result, peak = run_isolated(
+            run_precision, spec, dtype, volume, cube, threads, repeats
+        )
+        labels = torch.from_numpy(result.pop("labels")).long()
+        if reference is None:
+            reference = labels
+        n_classes = int(max(reference.max(), labels.max())) + 1
+        confusion = confusion_matrix(reference, labels, n_classes)
+        dice = dice_per_class(confusion)
+        present = [d for d in dice if d is not None]
+        result.update(
+            peak_rss=peak,
+            argmax_agreement=(confusion.trace() / confusion.sum()).item(),
+            dice=dice,
+            min_dice=min(present, default=1.0),
+            safe=min(present, default=1.0) >= min_dice,
+        )
+        report[dtype] = result
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare reduced-precision MeshNet inference with "
+        "float32"
+    )
+    parser.add_argument(
+        "model",
+        help="benchmark MODELS name, config.json:channels:classes or "
+        "model.json",
+    )
+    parser.add_argument(
+        "--dtypes",
+        nargs="+",
+        default=["bfloat16", "float16"],
+        choices=list(DTYPES),
+    )
+    parser.add_argument("--volume", help=".npy or NIfTI reference volume")
+    parser.add_argument(
+        "--cube", type=int, default=256, help="phantom size without --volume"
+    )
+    parser.add_argument("--threads", type=int, default=os.cpu_count())
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--min-dice", type=float, default=0.99)
+    parser.add_argument("--report", help="write the report as JSON")
+    args = parser.parse_args()
+
+    report = precision_report(
+        args.model,
+        args.dtypes,
+        args.volume,
+        args.cube,
+        args.threads,
+        args.repeats,
+        args.min_dice,
+    )
+    base = report["float32"]["seconds"]
+    for dtype, r in report.items():
+        print(
+            f"{dtype:<9} {r['seconds']:>8.3f} s ({base / r['seconds']:.2f}x)"
+            f" {r['peak_rss'] / 2**20:>9.1f} MiB"
+            f"  agreement {r['argmax_agreement']:.6f}"
+            f"  min dice {r['min_dice']:.4f}"
+            f"  {'safe' if r['safe'] else 'UNSAFE'}"
+        )
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump({"model": args.model, "results": report}, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
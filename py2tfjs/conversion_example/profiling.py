@@ -0,0 +1,43 @@
+import multiprocessing
+import os
+import resource
+import sys
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def current_rss():
+    """Current resident set size in bytes (Linux), else the peak"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return peak_rss()
+
+
+def _measure(fn, args, kwargs):
+    base = current_rss()
+    result = fn(*args, **kwargs)
+    return result, max(peak_rss() - base, 0)
+
+
+def run_isolated(fn, *args, **kwargs):
+    """Run ``fn`` in a fresh process and measure its memory.
+
+    A high-water mark can only be read once per process, so every
+    measurement gets its own spawned interpreter. ``fn`` must be a
+    module-level function.
+
+    Returns:
+        tuple: ``fn``'s result and the peak RSS growth in bytes while it
+        ran, on top of what the interpreter and imports already used.
+    """
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1) as pool:
+        return pool.apply(_measure, (fn, args, kwargs))
@@ -0,0 +1,307 @@
+import argparse
+import copy
+import json
+import time
+
+import torch
+import torch.nn as nn
+
+from meshnet import meshnet_config
+
+
+def hidden_blocks(model):
+    """``(conv, bn, block)`` of every MeshNet block whose output feeds
+    the next conv, ``bn`` None for configs without BatchNorm"""
+    blocks = []
+    for block in list(model.model)[:-1]:
+        conv = next(m for m in block if isinstance(m, nn.Conv3d))
+        bn = next((m for m in block if isinstance(m, nn.BatchNorm3d)), None)
+        blocks.append((conv, bn, block))
+    return blocks
+
+
+def _next_convs(model):
+    convs = [m for m in model.model.modules() if isinstance(m, nn.Conv3d)]
+    return convs[1:]
+
+
+def bn_scores(model, volumes=None):
+    """|BatchNorm gamma| per hidden channel, the network slimming
+    criterion; filter L1 norms where a block has no BatchNorm"""
+    scores = []
+    for conv, bn, _ in hidden_blocks(model):
+        if bn is None or bn.weight is None:
+            scores.append(conv.weight.detach().abs().sum((1, 2, 3, 4)))
+        else:
+            scores.append(bn.weight.detach().abs())
+    return scores
+
+
+def l1_scores(model, volumes=None):
+    """L1 norm of the weights reading each hidden channel in the next
+    conv: a channel nothing downstream listens to can go"""
+    return [
+        conv.weight.detach().abs().sum((0, 2, 3, 4))
+        for conv in _next_convs(model)
+    ]
+
+
+def activation_scores(model, volumes):
+    """Mean |activation| per hidden channel over ``volumes``"""
+    return activation_stats(model, volumes)[0]
+
+
+def activation_stats(model, volumes):
+    """Mean |activation| and mean activation per hidden channel of the
+    eval-mode model over an iterable of (N, C, D, H, W) volumes"""
+    blocks = [block for _, _, block in hidden_blocks(model)]
+    sums = [None] * len(blocks)
+    abs_sums = [None] * len(blocks)
+    count = [0]
+
+    def hook(index):
+        def observe(module, args, output):
+            dims = (0, 2, 3, 4)
+            total, magnitude = output.sum(dims), output.abs().sum(dims)
+            if sums[index] is None:
+                sums[index], abs_sums[index] = total, magnitude
+            else:
+                sums[index] += total
+                abs_sums[index] += magnitude
+            if index == 0:
+                count[0] += output[:, 0].numel()
+
+        return observe
+
+    handles = [
+        block.register_forward_hook(hook(i)) for i, block in enumerate(blocks)
+    ]
+    model.eval()
+    try:
+        with torch.no_grad():
+            for x in volumes:
+                model.model(x)
+    finally:
+        for handle in handles:
+            handle.remove()
+    if not count[0]:
+        raise ValueError("activation statistics need at least one volume")
+    return (
+        [s / count[0] for s in abs_sums],
+        [s / count[0] for s in sums],
+    )
+
+
+# --score names
+SCORES = {
+    "bn": bn_scores,
+    "l1": l1_scores,
+    "activation": activation_scores,
+}
+
+
+def select_channels(scores, amount, scope="layer", min_channels=1):
+    """Sorted indices of the channels to keep in every hidden layer.
+
+    ``amount`` is the fraction of hidden channels to remove. With
+    ``scope="layer"`` every layer loses that fraction of its own
+    channels; with ``"global"`` the weakest channels network-wide go,
+    with scores divided by their layer's mean to make them comparable.
+    """
+    if scope == "layer":
+        drop = [int(amount * len(s)) for s in scores]
+    elif scope == "global":
+        normalized = [s / s.mean().clamp_min(1e-12) for s in scores]
+        flat = torch.cat(normalized)
+        n = int(amount * len(flat))
+        threshold = flat.sort().values[n - 1] if n else float("-inf")
+        drop = [int((s <= threshold).sum()) for s in normalized]
+    else:
+        raise ValueError(f"Unknown pruning scope: {scope}")
+    keep = []
+    for s, n in zip(scores, drop):
+        n = min(n, len(s) - min_channels)
+        order = torch.argsort(s, descending=True, stable=True)
+        keep.append(order[: len(s) - max(n, 0)].sort().values)
+    return keep
+
+
+def _take(parameter, index, dim=0):
+    return nn.Parameter(
+        parameter.detach().index_select(dim, index).clone(),
+        requires_grad=parameter.requires_grad,
+    )
+
+
+def prune_meshnet(model, keep, means=None):
+    """Pruned copy of a MeshNet with real, smaller layers.
+
+    Every hidden block keeps the output channels in ``keep[i]``; its
+    BatchNorm and the input channels of the next conv shrink with it.
+    With ``means`` (mean activation per channel, see activation_stats)
+    the next conv's bias absorbs the average contribution of the
+    removed channels, which is exact for channels that are constant.
+    """
+    model = copy.deepcopy(model)
+    blocks = hidden_blocks(model)
+    for i, ((conv, bn, _), following, index) in enumerate(
+        zip(blocks, _next_convs(model), keep)
+    ):
+        index = torch.as_tensor(index, dtype=torch.long)
+        if means is not None and following.bias is not None:
+            removed = torch.ones(conv.out_channels, dtype=torch.bool)
+            removed[index] = False
+            kernel = following.weight.detach()[:, removed].sum((2, 3, 4))
+            with torch.no_grad():
+                following.bias += kernel @ means[i][removed].to(kernel)
+        conv.weight = _take(conv.weight, index)
+        if conv.bias is not None:
+            conv.bias = _take(conv.bias, index)
+        conv.out_channels = len(index)
+        if bn is not None:
+            if bn.weight is not None:
+                bn.weight = _take(bn.weight, index)
+                bn.bias = _take(bn.bias, index)
+            if bn.running_mean is not None:
+                bn.running_mean = bn.running_mean[index].clone()
+                bn.running_var = bn.running_var[index].clone()
+            bn.num_features = len(index)
+        following.weight = _take(following.weight, index, dim=1)
+        following.in_channels = len(index)
+    return model
+
+
+def pruned_config(config, model):
+    """``config`` (as returned by meshnet.meshnet_config) with the layer
+    widths of a pruned model"""
+    config = copy.deepcopy(config)
+    convs = [m for m in model.model.modules() if isinstance(m, nn.Conv3d)]
+    for layer, conv in zip(config["layers"], convs):
+        layer["in_channels"] = conv.in_channels
+        layer["out_channels"] = conv.out_channels
+    return config
+
+
+def parameter_count(model):
+    return sum(p.numel() for p in model.parameters())
+
+
+def _timed(model, x):
+    start = time.perf_counter()
+    with torch.inference_mode():
+        y = model.model(x)
+    return y, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Remove the weakest hidden channels of a MeshNet"
+    )
+    parser.add_argument("checkpoint", help="MeshNet state dict")
+    parser.add_argument("config", help="MeshNet config json")
+    parser.add_argument(
+        "--channels",
+        type=int,
+        default=None,
+        help="hidden width (default: the widths in the config)",
+    )
+    parser.add_argument("--classes", type=int, required=True)
+    parser.add_argument("--in-channels", type=int, default=1)
+    parser.add_argument("--fat", default=None)
+    parser.add_argument("--score", default="bn", choices=list(SCORES))
+    parser.add_argument(
+        "--volume",
+        action="append",
+        default=[],
+        help=".npy or NIfTI volume for activation statistics and the "
+        "agreement check",
+    )
+    parser.add_argument(
+        "--amount",
+        type=float,
+        default=0.25,
+        help="fraction of the hidden channels to remove",
+    )
+    parser.add_argument(
+        "--scope", default="layer", choices=["layer", "global"]
+    )
+    parser.add_argument("--min-channels", type=int, default=2)
+    parser.add_argument(
+        "--no-compensate",
+        action="store_true",
+        help="do not fold the mean output of removed channels into the "
+        "next bias (needs --volume)",
+    )
+    parser.add_argument("--cube", type=int, default=64)
+    parser.add_argument("--output-config", required=True)
+    parser.add_argument("--output-checkpoint", required=True)
+    parser.add_argument("--tfjs", help="also export the pruned model here")
+    args = parser.parse_args()
+
+    from convert import load_meshnet
+    from meshnet import enMesh_checkpoint
+
+    model = load_meshnet(
+        args.checkpoint,
+        args.config,
+        args.channels,
+        args.classes,
+        args.in_channels,
+        args.fat,
+    ).cpu()
+    volumes = []
+    if args.volume:
+        from roundtrip import load_volume
+
+        volumes = [load_volume(path) for path in args.volume]
+    means = None
+    if volumes and not args.no_compensate:
+        _, means = activation_stats(model, volumes)
+    elif args.score == "activation":
+        raise SystemExit("--score activation needs --volume")
+
+    scores = SCORES[args.score](model, volumes)
+    keep = select_channels(scores, args.amount, args.scope, args.min_channels)
+    pruned = prune_meshnet(model, keep, means)
+
+    config = meshnet_config(
+        args.config, args.in_channels, args.classes, args.channels, args.fat
+    )
+    config = pruned_config(config, pruned)
+    with open(args.output_config, "w") as f:
+        json.dump(config, f, indent=2)
+    # the pruned model is an ordinary MeshNet of the new config
+    check = enMesh_checkpoint(
+        args.in_channels, args.classes, None, args.output_config
+    )
+    check.load_state_dict(pruned.state_dict())
+    torch.save(pruned.state_dict(), args.output_checkpoint)
+
+    before = [conv.out_channels for conv, _, _ in hidden_blocks(model)]
+    after = [conv.out_channels for conv, _, _ in hidden_blocks(pruned)]
+    print(f"widths:     {before} -> {after}")
+    print(
+        f"parameters: {parameter_count(model)} -> {parameter_count(pruned)}"
+    )
+    from benchmark import phantom
+
+    for name, x in [("phantom", phantom(args.cube))] + list(
+        zip(args.volume, volumes)
+    ):
+        expected, original_s = _timed(model, x)
+        actual, pruned_s = _timed(pruned, x)
+        agreement = (expected.argmax(1) == actual.argmax(1)).float().mean()
+        print(
+            f"{name}: {original_s:.3f} s -> {pruned_s:.3f} s, "
+            f"argmax agreement {agreement.item():.6f}"
+        )
+
+    if args.tfjs:
+        from meshnet2tfjs import meshnet2tfjs
+        from optimize import optimize_for_inference
+
+        meshnet2tfjs(optimize_for_inference(pruned), args.tfjs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,440 @@
+import argparse
+import copy
+import functools
+import json
+import os
+import time
+
+import numpy as np
+import torch
+import torch.ao.nn.intrinsic.quantized as nniq
+import torch.ao.nn.quantized as nnq
+import torch.nn as nn
+
+from meshnet2tfjs import int8_scale, int8_values, meshnet2tfjs
+from optimize import optimize_layers
+
+
+class MinMaxObserver:
+    """Streaming range of everything seen"""
+
+    def __init__(self):
+        self.low = float("inf")
+        self.high = float("-inf")
+
+    def update(self, x):
+        self.low = min(self.low, x.min().item())
+        self.high = max(self.high, x.max().item())
+
+    def range(self):
+        return self.low, self.high
+
+
+class PercentileObserver:
+    """Mean over calibration volumes of the low and high ``percentile``
+    of each, so a few outlier voxels do not stretch the int8 range.
+
+    Large activations are subsampled with a fixed stride to at most
+    ``max_samples`` values before the order statistics are taken.
+    """
+
+    def __init__(self, percentile=99.99, max_samples=2**24):
+        self.percentile = percentile
+        self.max_samples = max_samples
+        self.lows, self.highs = [], []
+
+    def update(self, x):
+        x = x.reshape(-1)
+        x = x[:: -(-len(x) // self.max_samples)].float()
+        k = (len(x) - 1) * (1 - self.percentile / 100)
+        self.lows.append(x.kthvalue(int(k) + 1).values.item())
+        self.highs.append(x.kthvalue(len(x) - int(k)).values.item())
+
+    def range(self):
+        return float(np.mean(self.lows)), float(np.mean(self.highs))
+
+
+# --observer names
+OBSERVERS = {"minmax": MinMaxObserver, "percentile": PercentileObserver}
+
+# elementwise activations, run on quint8 values as lookup tables
+ELEMENTWISE = (
+    nn.ReLU,
+    nn.ELU,
+    nn.LeakyReLU,
+    nn.Sigmoid,
+    nn.Tanh,
+    nn.SiLU,
+    nn.GELU,
+    nn.Hardswish,
+    nn.Softplus,
+)
+
+
+def activation_qparams(low, high):
+    """quint8 scale and zero point of a [low, high] range, widened to
+    contain zero (the padding value)"""
+    low, high = min(low, 0.0), max(high, 0.0)
+    scale = (high - low) / 255 or 1.0
+    zero_point = int(np.clip(round(-low / scale), 0, 255))
+    return scale, zero_point
+
+
+def blocks(layers):
+    """Group a flat conv stack into the units that get one quantized
+    output: a Conv3d with the ReLU following it, a lone Conv3d or a lone
+    activation"""
+    groups = []
+    for layer in layers:
+        if (
+            isinstance(layer, nn.ReLU)
+            and groups
+            and isinstance(groups[-1][-1], nn.Conv3d)
+        ):
+            groups[-1].append(layer)
+        else:
+            groups.append([layer])
+    return groups
+
+
+class Calibration:
+    """Activation ranges of a BN-fused MeshNet's quantized tensors.
+
+    ``model`` may be any MeshNet, enMesh_checkpoint or tfjs_to_pytorch
+    model; a BN-folded copy of its layers is observed. Feed volumes with
+    observe, then turn the result into an int8 model with quantize.
+    """
+
+    def __init__(self, model, observer="minmax", **observer_args):
+        layers = copy.deepcopy(getattr(model, "model", model))
+        self.layers = optimize_layers(layers).eval()
+        self.blocks = blocks(self.layers)
+        self.observer = observer
+        make = functools.partial(OBSERVERS[observer], **observer_args)
+        self.input = make()
+        self.outputs = [make() for _ in self.blocks]
+
+    def observe(self, x):
+        """Run one (N, C, D, H, W) volume through the float layers"""
+        with torch.inference_mode():
+            self.input.update(x)
+            for group, observer in zip(self.blocks, self.outputs):
+                for layer in group:
+                    x = layer(x)
+                observer.update(x)
+        return x
+
+    def ranges(self):
+        return {
+            "input": self.input.range(),
+            "blocks": [observer.range() for observer in self.outputs],
+        }
+
+    def quantize(self, per_channel=False, float_head=False):
+        """The int8 CPU model, see QuantizedMeshNet"""
+        return QuantizedMeshNet(self, per_channel, float_head).eval()
+
+
+def quantize_conv(conv, scale, zero_point, relu=False, per_channel=False):
+    """int8 version of a Conv3d with the symmetric weights meshnet2tfjs
+    writes for ``quantize="int8"``; quint8 output at scale/zero_point"""
+    weight = conv.weight.detach().float().numpy()
+    axes = (1, 2, 3, 4) if per_channel else None
+    scales = int8_scale(weight, axes)
+    values = int8_values(weight, scales.reshape(np.shape(scales) + (1,) * 4))
+    values = torch.from_numpy(values.astype(np.int8))
+    if per_channel:
+        qweight = torch._make_per_channel_quantized_tensor(
+            values,
+            torch.from_numpy(scales).double(),
+            torch.zeros(len(scales), dtype=torch.long),
+            0,
+        )
+    else:
+        qweight = torch._make_per_tensor_quantized_tensor(
+            values, float(scales), 0
+        )
+    cls = nniq.ConvReLU3d if relu else nnq.Conv3d
+    qconv = cls(
+        conv.in_channels,
+        conv.out_channels,
+        conv.kernel_size,
+        stride=conv.stride,
+        padding=conv.padding,
+        dilation=conv.dilation,
+        groups=conv.groups,
+        padding_mode=conv.padding_mode,
+    )
+    bias = conv.bias.detach().float() if conv.bias is not None else None
+    qconv.set_weight_bias(qweight, bias)
+    qconv.scale, qconv.zero_point = scale, zero_point
+    return qconv
+
+
+class FloatFallback(nn.Module):
+    """A float module between quantized neighbours"""
+
+    def __init__(self, module, scale, zero_point):
+        super().__init__()
+        self.module = module
+        self.scale, self.zero_point = scale, zero_point
+
+    def forward(self, x):
+        y = self.module(x.dequantize())
+        return torch.quantize_per_tensor(
+            y, self.scale, self.zero_point, torch.quint8
+        )
+
+
+class LookupActivation(nn.Module):
+    """An elementwise activation between quint8 tensors as a 256-entry
+    table; faster than torch's quantized ELU and exact to the output
+    rounding for any activation"""
+
+    def __init__(self, module, qparams, output_qparams):
+        super().__init__()
+        scale, zero_point = qparams
+        self.scale, self.zero_point = output_qparams
+        levels = (torch.arange(256, dtype=torch.float32) - zero_point) * scale
+        with torch.no_grad():
+            y = module(levels) / self.scale + self.zero_point
+        self.table = torch.clamp(torch.round(y), 0, 255).to(torch.uint8)
+
+    def forward(self, x):
+        values = np.take(self.table.numpy(), x.int_repr().numpy())
+        return torch._make_per_tensor_quantized_tensor(
+            torch.from_numpy(values), self.scale, self.zero_point
+        )
+
+
+class QuantizedMeshNet(nn.Module):
+    """int8 inference MeshNet built from a Calibration.
+
+    Convs run as quantized x86/fbgemm kernels (fused with a following
+    ReLU) on quint8 activations; other elementwise activations are
+    lookup tables and anything else runs in float in between. The
+    logits are dequantized to float32; with ``float_head`` the last conv
+    runs in float32 as well, so argmax is not taken over 8-bit logits.
+    """
+
+    def __init__(self, calibration, per_channel=False, float_head=False):
+        super().__init__()
+        self.input_qparams = activation_qparams(*calibration.input.range())
+        groups = list(zip(calibration.blocks, calibration.outputs))
+        head = []
+        if float_head:
+            last = max(
+                i
+                for i, (group, _) in enumerate(groups)
+                if isinstance(group[0], nn.Conv3d)
+            )
+            groups, head = groups[:last], [g for g, _ in groups[last:]]
+        layers = []
+        qparams = self.input_qparams
+        for group, observer in groups:
+            scale, zero_point = activation_qparams(*observer.range())
+            first = group[0]
+            if isinstance(first, nn.Conv3d):
+                layers.append(
+                    quantize_conv(
+                        first, scale, zero_point, len(group) > 1, per_channel
+                    )
+                )
+            elif isinstance(first, ELEMENTWISE):
+                layers.append(
+                    LookupActivation(first, qparams, (scale, zero_point))
+                )
+            else:
+                layers.append(FloatFallback(first, scale, zero_point))
+            qparams = scale, zero_point
+        self.layers = nn.Sequential(*layers)
+        self.head = nn.Sequential(*[m for g in head for m in g]).float()
+
+    def forward(self, x):
+        scale, zero_point = self.input_qparams
+        x = torch.quantize_per_tensor(x, scale, zero_point, torch.quint8)
+        return self.head(self.layers(x).dequantize())
+
+
+def weight_bytes(model):
+    """Bytes of the conv weights and biases as stored for inference"""
+    total = 0
+    for module in model.modules():
+        if isinstance(module, (nnq.Conv3d, nniq.ConvReLU3d)):
+            weight, bias = module._weight_bias()
+            total += weight.numel()
+            if bias is not None:
+                total += bias.numel() * bias.element_size()
+        elif isinstance(module, nn.Conv3d):
+            total += sum(
+                p.numel() * p.element_size() for p in module.parameters()
+            )
+    return total
+
+
+def _timed(model, x):
+    with torch.inference_mode():
+        start = time.perf_counter()
+        y = model(x)
+    return y, time.perf_counter() - start
+
+
+def drift_report(reference, candidate, volumes):
+    """Per volume argmax agreement and per-class Dice of ``candidate``
+    against ``reference``, with both inference times"""
+    from metrics import argmax_agreement, confusion_matrix, dice_per_class
+
+    report = {}
+    for name, x in volumes.items():
+        expected, reference_s = _timed(reference, x)
+        actual, candidate_s = _timed(candidate, x)
+        confusion = confusion_matrix(
+            expected.argmax(1), actual.argmax(1), expected.shape[1]
+        )
+        dice = dice_per_class(confusion)
+        present = [d for d in dice if d is not None]
+        report[name] = {
+            "argmax_agreement": argmax_agreement(expected, actual),
+            "dice": dice,
+            "min_dice": min(present, default=1.0),
+            "float32_s": reference_s,
+            "int8_s": candidate_s,
+        }
+    return report
+
+
+def export_int8(
+    calibration, dirname, per_channel=False, target="tfjs", **kwargs
+):
+    """Write the calibrated model as a tfjs model with int8 kernels.
+
+    The kernels are the ones QuantizedMeshNet runs (``quantize="int8"``
+    of meshnet2tfjs); the activation ranges go into model.json's
+    userDefinedMetadata for int8 runtimes, plain tfjs ignores them.
+    Per-channel kernels need ``target="js2pytorch"``.
+    """
+    report = meshnet2tfjs(
+        calibration.layers,
+        dirname,
+        quantize="int8",
+        per_channel=per_channel,
+        target=target,
+        **kwargs,
+    )
+    path = os.path.join(dirname, "model.json")
+    with open(path, "r") as f:
+        spec = json.load(f)
+    spec["userDefinedMetadata"] = {
+        "int8": {
+            "observer": calibration.observer,
+            "per_channel": per_channel,
+            "activation_ranges": calibration.ranges(),
+        }
+    }
+    with open(path, "w") as f:
+        json.dump(spec, f, indent=4)
+    return report
+
+
+def _volumes(paths, cube, seed):
+    """Named normalized volumes, or one phantom when ``paths`` is empty"""
+    if not paths:
+        from benchmark import phantom
+
+        return {f"phantom{seed}": phantom(cube, seed)}
+    from roundtrip import load_volume
+
+    return {os.path.basename(path): load_volume(path) for path in paths}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Post-training int8 quantization of a MeshNet"
+    )
+    parser.add_argument(
+        "model",
+        help="benchmark MODELS name, config.json:channels:classes or "
+        "model.json",
+    )
+    parser.add_argument(
+        "--calibrate",
+        nargs="+",
+        default=[],
+        help=".npy or NIfTI calibration volumes (default: a phantom)",
+    )
+    parser.add_argument(
+        "--evaluate",
+        nargs="+",
+        default=[],
+        help=".npy or NIfTI volumes for the drift report (default: a "
+        "different phantom)",
+    )
+    parser.add_argument("--cube", type=int, default=128)
+    parser.add_argument(
+        "--observer", default="minmax", choices=list(OBSERVERS)
+    )
+    parser.add_argument("--percentile", type=float, default=99.99)
+    parser.add_argument("--per-channel", action="store_true")
+    parser.add_argument(
+        "--float-head",
+        action="store_true",
+        help="keep the classifier conv in float32",
+    )
+    parser.add_argument("--threads", type=int, default=os.cpu_count())
+    parser.add_argument("--output", help="write an int8 tfjs model here")
+    parser.add_argument(
+        "--target",
+        choices=["tfjs", "js2pytorch"],
+        default="tfjs",
+        help="who loads --output; stock tfjs cannot read --per-channel",
+    )
+    parser.add_argument("--report", help="write the report as JSON")
+    args = parser.parse_args()
+    if args.output and args.per_channel and args.target == "tfjs":
+        parser.error("--per-channel --output needs --target js2pytorch")
+
+    from benchmark import load_model
+
+    torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+    model = load_model(args.model)
+    observer_args = {}
+    if args.observer == "percentile":
+        observer_args["percentile"] = args.percentile
+    calibration = Calibration(model, args.observer, **observer_args)
+
+    start = time.perf_counter()
+    for x in _volumes(args.calibrate, args.cube, seed=0).values():
+        calibration.observe(x)
+    print(f"calibration: {time.perf_counter() - start:.3f} s")
+    quantized = calibration.quantize(args.per_channel, args.float_head)
+
+    volumes = _volumes(args.evaluate, args.cube, seed=1)
+    report = {
+        "float32_weight_bytes": weight_bytes(calibration.layers),
+        "int8_weight_bytes": weight_bytes(quantized),
+        "volumes": drift_report(calibration.layers, quantized, volumes),
+    }
+    print(
+        f"weights: {report['float32_weight_bytes']} -> "
+        f"{report['int8_weight_bytes']} bytes"
+    )
+    for name, r in report["volumes"].items():
+        print(
+            f"{name}: float32 {r['float32_s']:.3f} s, int8 "
+            f"{r['int8_s']:.3f} s ({r['float32_s'] / r['int8_s']:.2f}x), "
+            f"agreement {r['argmax_agreement']:.6f}, "
+            f"min dice {r['min_dice']:.4f}"
+        )
+        drift = ["-" if d is None else f"{1 - d:.4f}" for d in r["dice"]]
+        print(f"  dice drift: {' '.join(drift)}")
+
+    if args.output:
+        export_int8(calibration, args.output, args.per_channel, args.target)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+import torch
+
+from convert import load_meshnet
+from js2pytorch import tfjs_to_pytorch
+from meshnet2tfjs import meshnet2tfjs
+from metrics import (
+    argmax_agreement,
+    confusion_matrix,
+    per_class_agreement,
+)
+from normalization import quantile_normalize
+from optimize import optimize_for_inference
+
+
+def synthetic_volumes(cube, in_channels=1, seed=0):
+    """Uniform noise and a smooth blob, both in the unit interval"""
+    generator = torch.Generator().manual_seed(seed)
+    noise = torch.rand((1, 1, cube, cube, cube), generator=generator)
+    axis = torch.linspace(-1, 1, cube)
+    z, y, x = torch.meshgrid(axis, axis, axis, indexing="ij")
+    radius = torch.sqrt(x**2 + 1.5 * y**2 + 2 * z**2)
+    blob = torch.clamp(1 - radius, min=0)[None, None] + 0.05 * noise
+    return {
+        "noise": noise.expand(1, in_channels, -1, -1, -1),
+        "blob": blob.expand(1, in_channels, -1, -1, -1),
+    }
+
+
+def load_volume(path):
+    """A .npy or NIfTI volume as a normalized (1, 1, D, H, W) tensor"""
+    if path.endswith(".npy"):
+        data = np.load(path)
+    else:
+        import nibabel as nib
+
+        data = np.asanyarray(nib.load(path).dataobj)
+    volume = torch.from_numpy(np.asarray(data, dtype=np.float32).copy())
+    return quantile_normalize(volume)[None, None]
+
+
+def _timed(model, x):
+    start = time.perf_counter()
+    with torch.inference_mode():
+        y = model(x)
+    return y, time.perf_counter() - start
+
+
+def compare(reference, candidate, x):
+    """Run both models on ``x`` and report how far apart they are"""
+    expected, reference_s = _timed(reference, x)
+    actual, candidate_s = _timed(candidate, x)
+    error = (expected - actual).abs()
+    confusion = confusion_matrix(
+        expected.argmax(1), actual.argmax(1), expected.shape[1]
+    )
+    return {
+        "max_abs_error": error.max().item(),
+        "mean_abs_error": error.mean().item(),
+        "argmax_agreement": argmax_agreement(expected, actual),
+        "per_class_agreement": per_class_agreement(confusion),
+        "pytorch_inference_s": reference_s,
+        "tfjs_inference_s": candidate_s,
+    }
+
+
+def roundtrip(
+    model_path,
+    config_file,
+    channels,
+    n_classes,
+    volumes,
+    in_channels=1,
+    fat=None,
+    quantize=None,
+    workdir=None,
+):
+    """Convert a checkpoint to tfjs and back and compare the two models.
+
+    The export goes through optimize_for_inference and meshnet2tfjs, as
+    the converter does, and is compared with the unoptimized checkpoint.
+
+    Args:
+        volumes (dict): Named (1, C, D, H, W) inputs to run both models on.
+        quantize (str): Weight quantization passed to meshnet2tfjs.
+        workdir (str): Where to write the tfjs model, a temporary directory
+            by default.
+
+    Returns:
+        dict: Stage timings and a comparison per volume.
+    """
+    report = {}
+    start = time.perf_counter()
+    model = load_meshnet(
+        model_path, config_file, channels, n_classes, in_channels, fat
+    ).cpu()
+    report["load_checkpoint_s"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    optimized = optimize_for_inference(model)
+    report["optimize_s"] = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        dirname = workdir or tmpdir
+        start = time.perf_counter()
+        meshnet2tfjs(optimized, dirname, quantize=quantize)
+        report["meshnet2tfjs_s"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        tfjs_model = tfjs_to_pytorch(os.path.join(dirname, "model.json"))
+        tfjs_model.eval()
+        report["tfjs_to_pytorch_s"] = time.perf_counter() - start
+
+        report["volumes"] = {
+            name: compare(model, tfjs_model, x) for name, x in volumes.items()
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check that meshnet2tfjs -> tfjs_to_pytorch is lossless"
+    )
+    parser.add_argument("--checkpoint", required=True)
+    parser.add_argument("--config", required=True)
+    parser.add_argument("--channels", type=int, required=True)
+    parser.add_argument("--classes", type=int, required=True)
+    parser.add_argument("--in-channels", type=int, default=1)
+    parser.add_argument("--fat", default=None)
+    parser.add_argument("--quantize", choices=["float16", "uint8", "int8"])
+    parser.add_argument("--cube", type=int, default=64)
+    parser.add_argument(
+        "--volume", action="append", default=[], help=".npy or NIfTI file"
+    )
+    parser.add_argument(
+        "--atol",
+        type=float,
+        default=1e-4,
+        help="fail when the max abs error exceeds this",
+    )
+    parser.add_argument("--report", help="write the report as JSON")
+    args = parser.parse_args()
+
+    volumes = synthetic_volumes(args.cube, args.in_channels)
+    for path in args.volume:
+        volumes[os.path.basename(path)] = load_volume(path)
+
+    report = roundtrip(
+        args.checkpoint,
+        args.config,
+        args.channels,
+        args.classes,
+        volumes,
+        args.in_channels,
+        args.fat,
+        args.quantize,
+    )
+    print(json.dumps(report, indent=4))
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=4)
+
+    worst = max(r["max_abs_error"] for r in report["volumes"].values())
+    if worst > args.atol:
+        raise SystemExit(f"max abs error {worst:.3e} exceeds {args.atol}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+import argparse
+import itertools
+import os
+import time
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, IterableDataset, get_worker_info
+
+# how MeshNet is trained, see pytorch2js.py
+SUBVOLUME_SHAPE = (38, 38, 38)
+N_SUBVOLUMES = 1024
+
+
+def prepare(image_path, label_path, out_dir, name=None):
+    """Decompress and normalize a NIfTI image/label pair once into .npy
+    files the sampler memory-maps.
+
+    Returns:
+        tuple: The image and label .npy paths.
+    """
+    import nibabel as nib
+
+    from normalization import quantile_normalize
+
+    name = name or os.path.basename(image_path).split(".")[0]
+    os.makedirs(out_dir, exist_ok=True)
+    image = nib.load(image_path).get_fdata(dtype=np.float32)
+    image = quantile_normalize(image)
+    image_out = os.path.join(out_dir, f"{name}_image.npy")
+    np.save(image_out, image)
+
+    labels = np.asanyarray(nib.load(label_path).dataobj)
+    dtype = np.uint8 if labels.max(initial=0) < 256 else np.uint16
+    label_out = os.path.join(out_dir, f"{name}_labels.npy")
+    np.save(label_out, labels.astype(dtype))
+    return image_out, label_out
+
+
+def check_fits(shape, subvolume_shape):
+    """Raise ValueError unless subvolumes fit into a volume of ``shape``"""
+    if len(shape) != len(subvolume_shape) or any(
+        sub < 1 or sub > size for size, sub in zip(shape, subvolume_shape)
+    ):
+        raise ValueError(
+            f"{tuple(subvolume_shape)} subvolumes do not fit into a "
+            f"{tuple(shape)} volume"
+        )
+
+
+def grid_corners(shape, subvolume_shape, stride=None):
+    """Corners of subvolumes covering ``shape``, the last one per axis
+    aligned with the far border"""
+    stride = stride or subvolume_shape
+    check_fits(shape, subvolume_shape)
+    starts = []
+    for size, sub, step in zip(shape, subvolume_shape, stride):
+        axis = list(range(0, size - sub + 1, step))
+        if axis[-1] != size - sub:
+            axis.append(size - sub)
+        starts.append(axis)
+    return list(itertools.product(*starts))
+
+
+class SubvolumeDataset(IterableDataset):
+    """Batches of subvolumes drawn from memory-mapped .npy volumes.
+
+    Volumes are opened with ``mmap_mode="r"`` in each worker, so only the
+    pages a subvolume touches are read and the OS page cache is shared
+    between workers. Every subvolume is copied once, straight from the
+    mapping into its slot of a batch array; batches (not single
+    subvolumes) are what crosses the worker boundary, so use the
+    dataset with ``DataLoader(batch_size=None)``, see make_loader.
+
+    ``mode="random"`` draws ``n_subvolumes`` uniform corners per epoch,
+    split across workers with per-worker seeds; ``"grid"`` covers every
+    volume with a grid (``stride`` defaults to non-overlapping) and
+    shards the grid positions across workers.
+
+    Label batches take the common dtype of all label volumes (prepare
+    picks uint8 or uint16 per volume), so no label is ever narrowed.
+    """
+
+    def __init__(
+        self,
+        images,
+        labels=None,
+        subvolume_shape=SUBVOLUME_SHAPE,
+        n_subvolumes=N_SUBVOLUMES,
+        batch_size=1,
+        mode="random",
+        stride=None,
+        seed=0,
+    ):
+        if labels is not None and len(labels) != len(images):
+            raise ValueError("One label volume per image is needed")
+        if mode not in ("random", "grid"):
+            raise ValueError(f"Unknown sampling mode: {mode}")
+        self.images = list(images)
+        self.labels = None if labels is None else list(labels)
+        self.subvolume_shape = tuple(subvolume_shape)
+        self.n_subvolumes = n_subvolumes
+        self.batch_size = batch_size
+        self.mode = mode
+        self.stride = stride
+        self.seed = seed
+        self.epoch = 0
+        # check the volumes now rather than in every worker
+        self._open()
+
+    def set_epoch(self, epoch):
+        """Draw different random subvolumes in the next epoch"""
+        self.epoch = epoch
+
+    def _open(self):
+        images = [np.load(path, mmap_mode="r") for path in self.images]
+        for image in images:
+            check_fits(image.shape, self.subvolume_shape)
+        labels = None
+        if self.labels is not None:
+            labels = [np.load(path, mmap_mode="r") for path in self.labels]
+            for image, label in zip(images, labels):
+                if image.shape != label.shape:
+                    raise ValueError(
+                        f"Image {image.shape} and labels {label.shape} differ"
+                    )
+                if not np.issubdtype(label.dtype, np.integer):
+                    raise ValueError(f"Labels must be integers: {label.dtype}")
+        return images, labels
+
+    def _positions(self, images, worker, n_workers):
+        """``(volume index, corner)`` pairs of this worker"""
+        if self.mode == "grid":
+            positions = [
+                (v, corner)
+                for v, image in enumerate(images)
+                for corner in grid_corners(
+                    image.shape, self.subvolume_shape, self.stride
+                )
+            ]
+            return positions[worker::n_workers]
+
+        rng = np.random.default_rng((self.seed, self.epoch, worker))
+        n = len(range(worker, self.n_subvolumes, n_workers))
+        volume = rng.integers(0, len(images), n)
+        corners = []
+        for v in volume:
+            shape = images[v].shape
+            corners.append(
+                tuple(
+                    int(rng.integers(0, size - sub + 1))
+                    for size, sub in zip(shape, self.subvolume_shape)
+                )
+            )
+        return list(zip(volume.tolist(), corners))
+
+    def __iter__(self):
+        info = get_worker_info()
+        worker, n_workers = 0, 1
+        if info is not None:
+            worker, n_workers = info.id, info.num_workers
+        images, labels = self._open()
+        dtype = None if labels is None else np.result_type(*labels)
+        positions = self._positions(images, worker, n_workers)
+        for first in range(0, len(positions), self.batch_size):
+            batch = positions[first : first + self.batch_size]
+            x = np.empty((len(batch), 1) + self.subvolume_shape, np.float32)
+            y = None
+            if labels is not None:
+                y = np.empty((len(batch),) + self.subvolume_shape, dtype)
+            for i, (v, corner) in enumerate(batch):
+                region = tuple(
+                    slice(c, c + s)
+                    for c, s in zip(corner, self.subvolume_shape)
+                )
+                np.copyto(x[i, 0], images[v][region])
+                if y is not None:
+                    np.copyto(y[i], labels[v][region], casting="safe")
+            if y is None:
+                yield torch.from_numpy(x)
+            else:
+                yield torch.from_numpy(x), torch.from_numpy(y)
+
+
+def make_loader(dataset, num_workers=4, prefetch_factor=4, pin_memory=None):
+    """A DataLoader running SubvolumeDataset batches in worker processes.
+
+    Each worker keeps ``prefetch_factor`` batches ready; batches are
+    copied into pinned memory for fast, asynchronous host-to-GPU copies
+    when CUDA is available (or ``pin_memory`` says so).
+    """
+    if pin_memory is None:
+        pin_memory = torch.cuda.is_available()
+    return DataLoader(
+        dataset,
+        batch_size=None,
+        num_workers=num_workers,
+        prefetch_factor=prefetch_factor if num_workers else None,
+        pin_memory=pin_memory,
+    )
+
+
+def throughput(loader, epochs=1):
+    """Subvolumes per second of iterating ``loader``"""
+    count = 0
+    start = time.perf_counter()
+    for epoch in range(epochs):
+        loader.dataset.set_epoch(epoch)
+        for batch in loader:
+            x = batch[0] if isinstance(batch, (list, tuple)) else batch
+            count += len(x)
+    seconds = time.perf_counter() - start
+    return count / seconds, count, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Prepare memory-mapped training volumes or measure "
+        "subvolume sampling throughput"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    prepare_parser = subparsers.add_parser(
+        "prepare", help="NIfTI image/label pairs to normalized .npy"
+    )
+    prepare_parser.add_argument(
+        "--pair",
+        nargs=2,
+        action="append",
+        required=True,
+        metavar=("IMAGE", "LABELS"),
+    )
+    prepare_parser.add_argument("--out-dir", required=True)
+
+    bench_parser = subparsers.add_parser(
+        "bench", help="subvolumes/s for a range of worker counts"
+    )
+    bench_parser.add_argument("--images", nargs="+", required=True)
+    bench_parser.add_argument("--labels", nargs="+")
+    bench_parser.add_argument(
+        "--subvolume", type=int, nargs=3, default=list(SUBVOLUME_SHAPE)
+    )
+    bench_parser.add_argument(
+        "--n-subvolumes", type=int, default=N_SUBVOLUMES
+    )
+    bench_parser.add_argument("--batch-size", type=int, default=16)
+    bench_parser.add_argument(
+        "--mode", default="random", choices=["random", "grid"]
+    )
+    bench_parser.add_argument(
+        "--workers", type=int, nargs="+", default=[0, 1, 2, 4]
+    )
+    bench_parser.add_argument("--prefetch", type=int, default=4)
+    bench_parser.add_argument("--epochs", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.command == "prepare":
+        for image, labels in args.pair:
+            print(*prepare(image, labels, args.out_dir))
+        return
+
+    dataset = SubvolumeDataset(
+        args.images,
+        args.labels,
+        args.subvolume,
+        args.n_subvolumes,
+        args.batch_size,
+        args.mode,
+    )
+    for workers in args.workers:
+        loader = make_loader(dataset, workers, args.prefetch)
+        rate, count, seconds = throughput(loader, args.epochs)
+        print(
+            f"{workers} workers: {count} subvolumes in {seconds:.3f} s, "
+            f"{rate:.1f} subvolumes/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
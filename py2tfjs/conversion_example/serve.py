@@ -0,0 +1,515 @@
+import argparse
+import collections
+import concurrent.futures
+import http.client
+import http.server
+import io
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+import urllib.parse
+
+import numpy as np
+import torch
+
+from tiling import conv3d_layers, iter_tiles, model_halo
+
+
+def load_served_model(spec):
+    """An eval-mode model from a tfjs model.json path or a
+    ``checkpoint.pth:config.json:channels:classes[:fat]`` spec"""
+    if spec.endswith(".json"):
+        from js2pytorch import tfjs_to_pytorch
+
+        return tfjs_to_pytorch(spec).eval()
+
+    from convert import load_meshnet
+    from optimize import optimize_for_inference
+
+    checkpoint, config, channels, classes, *fat = spec.split(":")
+    model = load_meshnet(
+        checkpoint,
+        config,
+        int(channels),
+        int(classes),
+        fat=fat[0] if fat else None,
+    )
+    return optimize_for_inference(model)
+
+
+class Metrics:
+    """Thread-safe latency and counter bookkeeping for /metrics"""
+
+    def __init__(self, window=1024):
+        self._lock = threading.Lock()
+        self._window = window
+        self._stages = {}
+        self.counters = collections.Counter()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            if stage not in self._stages:
+                self._stages[stage] = collections.deque(maxlen=self._window)
+            self._stages[stage].append(seconds)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def snapshot(self):
+        """Counters and p50/p95/max seconds of the recent window per stage"""
+        with self._lock:
+            stages = {}
+            for stage, values in self._stages.items():
+                ordered = sorted(values)
+                n = len(ordered)
+                stages[stage] = {
+                    "count": n,
+                    "p50": ordered[n // 2],
+                    "p95": ordered[min(n * 95 // 100, n - 1)],
+                    "max": ordered[-1],
+                }
+            return {"counters": dict(self.counters), "latency_s": stages}
+
+
+class _Request:
+    """A volume split into tiles whose outputs are stitched into ``out``"""
+
+    def __init__(self, x, n_tiles, out, labels):
+        self.x = x
+        self.out = out
+        self.labels = labels
+        self.remaining = n_tiles
+        self.future = concurrent.futures.Future()
+
+
+class Batcher:
+    """Keeps one model warm and runs queued tiles in batches.
+
+    Requests are cut into tiles that carry the model's receptive-field
+    halo (see tiling.iter_tiles), so tiles of different requests can
+    share a batch. A batch starts when ``max_batch`` tiles are waiting or
+    ``max_delay`` seconds after its first tile arrived, whichever comes
+    first; tiles are grouped by shape since border tiles are smaller.
+    """
+
+    def __init__(
+        self, name, model, metrics, max_batch=4, max_delay=0.01, tile=None
+    ):
+        self.name = name
+        self.model = model
+        self.metrics = metrics
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.tile = tile
+        convs = conv3d_layers(model)
+        self.in_channels = convs[0].in_channels
+        self.n_classes = convs[-1].out_channels
+        self.halo = model_halo(model)
+        self.device = convs[0].weight.device
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def warmup(self, cube=16):
+        """One small pass so the first request does not pay for lazy init"""
+        x = torch.zeros((1, self.in_channels) + (cube,) * 3)
+        return self.submit(x).result()
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def submit(self, x, labels=True):
+        """Queue a (1, C, D, H, W) volume.
+
+        Returns:
+            concurrent.futures.Future: The (D, H, W) argmax labels, or the
+            (1, n_classes, D, H, W) logits without ``labels``.
+        """
+        if x.dim() != 5 or x.shape[:2] != (1, self.in_channels):
+            raise ValueError(
+                f"Expected a (1, {self.in_channels}, D, H, W) volume, "
+                f"got {tuple(x.shape)}"
+            )
+        shape = tuple(x.shape[2:])
+        core_size = shape if self.tile is None else (self.tile,) * 3
+        tiles = list(iter_tiles(shape, core_size, self.halo))
+        if labels:
+            dtype = torch.uint8 if self.n_classes <= 256 else torch.int64
+            out = torch.empty(shape, dtype=dtype)
+        else:
+            out = torch.empty((1, self.n_classes) + shape)
+        request = _Request(x, len(tiles), out, labels)
+        now = time.perf_counter()
+        for core, tile in tiles:
+            self._queue.put((now, request, core, tile))
+        self.metrics.count(f"{self.name}.requests")
+        return request.future
+
+    def _collect(self):
+        """Block for a tile, then gather more until the batch is full or
+        its deadline passes"""
+        items = [self._queue.get()]
+        deadline = items[0][0] + self.max_delay
+        while len(items) < self.max_batch:
+            # tiles that are already waiting join without delay
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining <= 0:
+                    items.append(self._queue.get_nowait())
+                else:
+                    items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def _loop(self):
+        while True:
+            items = self._collect()
+            groups = {}
+            for item in items:
+                key = tuple(t.stop - t.start for t in item[3])
+                groups.setdefault(key, []).append(item)
+            for group in groups.values():
+                try:
+                    self._run(group)
+                except Exception as e:
+                    # fail the requests of this group, keep serving others
+                    self.metrics.count(f"{self.name}.errors")
+                    for _, request, _, _ in group:
+                        if not request.future.done():
+                            request.future.set_exception(e)
+
+    def _run(self, group):
+        start = time.perf_counter()
+        for enqueued, *_ in group:
+            self.metrics.observe(f"{self.name}.queue", start - enqueued)
+        inputs = torch.cat(
+            [r.x[(slice(None), slice(None)) + t] for _, r, _, t in group]
+        ).to(self.device)
+        with torch.inference_mode():
+            outputs = self.model(inputs).cpu()
+        self.metrics.observe(
+            f"{self.name}.compute", time.perf_counter() - start
+        )
+        self.metrics.count(f"{self.name}.batches")
+        self.metrics.count(f"{self.name}.tiles", len(group))
+
+        for i, (_, request, core, tile) in enumerate(group):
+            self._stitch(request, core, tile, outputs[i : i + 1])
+
+    def _stitch(self, request, core, tile, output):
+        """Put the core of a (1, n_classes, ...) tile output into its
+        request and resolve the request after its last tile"""
+        if request.future.done():
+            return  # failed in an earlier group
+        # position of the core inside the tile
+        inner = tuple(
+            slice(c.start - t.start, c.stop - t.start)
+            for c, t in zip(core, tile)
+        )
+        output = output[(slice(None), slice(None)) + inner]
+        if request.labels:
+            request.out[core] = output[0].argmax(0)
+        else:
+            request.out[(slice(None), slice(None)) + core] = output
+        request.remaining -= 1
+        if request.remaining == 0:
+            request.future.set_result(request.out)
+
+
+def decode_volume(body, in_channels):
+    """A (1, C, D, H, W) float32 tensor from .npy bytes of a (D, H, W) or
+    (C, D, H, W) array"""
+    array = np.load(io.BytesIO(body), allow_pickle=False)
+    if array.ndim == 3:
+        array = array[None]
+    if array.ndim != 4 or array.shape[0] != in_channels:
+        raise ValueError(f"Unexpected volume shape {array.shape}")
+    array = np.ascontiguousarray(array, dtype=np.float32)
+    return torch.from_numpy(array)[None]
+
+
+def encode_array(array):
+    buffer = io.BytesIO()
+    np.save(buffer, array, allow_pickle=False)
+    return buffer.getvalue()
+
+
+class InferenceHandler(http.server.BaseHTTPRequestHandler):
+    """POST /segment[?model=name&output=labels|logits&normalize=1] with an
+    .npy body answers with .npy; GET /metrics and /health answer JSON"""
+
+    protocol_version = "HTTP/1.1"
+
+    def address_string(self):
+        # Unix sockets have no peer address
+        if isinstance(self.client_address, tuple) and self.client_address:
+            return self.client_address[0]
+        return "unix"
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+    def _reply(self, status, body, content_type="application/json"):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urllib.parse.urlsplit(self.path).path
+        service = self.server.service
+        if path == "/metrics":
+            self._reply(200, service.metrics_snapshot())
+        elif path == "/health":
+            self._reply(200, {"models": list(service.batchers)})
+        else:
+            self._reply(404, {"error": f"Unknown path {path}"})
+
+    def do_POST(self):
+        url = urllib.parse.urlsplit(self.path)
+        service = self.server.service
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if url.path != "/segment":
+            self._reply(404, {"error": f"Unknown path {url.path}"})
+            return
+        query = dict(urllib.parse.parse_qsl(url.query))
+        try:
+            result = service.segment(
+                body,
+                query.get("model"),
+                query.get("output", "labels") == "labels",
+                query.get("normalize", "0") not in ("0", "false", ""),
+            )
+        except (KeyError, ValueError) as e:
+            self._reply(400, {"error": f"{e.__class__.__name__}: {e}"})
+        except Exception as e:
+            self._reply(500, {"error": f"{e.__class__.__name__}: {e}"})
+        else:
+            self._reply(200, result, "application/octet-stream")
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+class InferenceService:
+    """Warm models behind per-model Batchers, shared by every connection"""
+
+    def __init__(
+        self, models, max_batch=4, max_delay=0.01, tile=None, timeout=600
+    ):
+        self.metrics = Metrics()
+        self.timeout = timeout
+        self.batchers = {
+            name: Batcher(
+                name, model, self.metrics, max_batch, max_delay, tile
+            )
+            for name, model in models.items()
+        }
+
+    def warmup(self):
+        for batcher in self.batchers.values():
+            batcher.warmup()
+
+    def metrics_snapshot(self):
+        snapshot = self.metrics.snapshot()
+        snapshot["queue_depth"] = {
+            name: batcher.queue_depth
+            for name, batcher in self.batchers.items()
+        }
+        return snapshot
+
+    def segment(self, body, model=None, labels=True, normalize=False):
+        """Run one .npy encoded volume and return the .npy encoded result"""
+        if model is None:
+            model = next(iter(self.batchers))
+        batcher = self.batchers[model]
+
+        start = time.perf_counter()
+        x = decode_volume(body, batcher.in_channels)
+        if normalize:
+            from normalization import quantile_normalize
+
+            quantile_normalize(x)
+        decoded = time.perf_counter()
+        out = batcher.submit(x, labels).result(self.timeout)
+        done = time.perf_counter()
+        result = encode_array(out.numpy())
+        encoded = time.perf_counter()
+
+        self.metrics.observe("decode", decoded - start)
+        self.metrics.observe(f"{model}.inference", done - decoded)
+        self.metrics.observe("encode", encoded - done)
+        self.metrics.observe("request", encoded - start)
+        return result
+
+    def server(self, address, quiet=True):
+        """An HTTP server on ``host:port`` or, for a path, a Unix socket"""
+        if ":" in address:
+            host, port = address.rsplit(":", 1)
+            server = http.server.ThreadingHTTPServer(
+                (host, int(port)), InferenceHandler
+            )
+        else:
+            if os.path.exists(address):
+                os.unlink(address)
+            server = ThreadingUnixHTTPServer(address, InferenceHandler)
+        server.service = self
+        server.quiet = quiet
+        return server
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class SegmentationClient:
+    """Minimal client for an InferenceService on ``host:port`` or a Unix
+    socket path"""
+
+    def __init__(self, address, timeout=600):
+        self.address = address
+        self.timeout = timeout
+
+    def _connection(self):
+        if ":" in self.address:
+            host, port = self.address.rsplit(":", 1)
+            return http.client.HTTPConnection(
+                host, int(port), timeout=self.timeout
+            )
+        return _UnixHTTPConnection(self.address, self.timeout)
+
+    def _request(self, method, path, body=None):
+        connection = self._connection()
+        try:
+            connection.request(method, path, body)
+            response = connection.getresponse()
+            data = response.read()
+        finally:
+            connection.close()
+        if response.status != 200:
+            raise RuntimeError(f"{response.status}: {data.decode()}")
+        return data
+
+    def segment(self, volume, model=None, labels=True, normalize=False):
+        """Segment a (D, H, W) or (C, D, H, W) array"""
+        query = {"output": "labels" if labels else "logits"}
+        if model is not None:
+            query["model"] = model
+        if normalize:
+            query["normalize"] = "1"
+        path = "/segment?" + urllib.parse.urlencode(query)
+        data = self._request("POST", path, encode_array(volume))
+        return np.load(io.BytesIO(data), allow_pickle=False)
+
+    def metrics(self):
+        return json.loads(self._request("GET", "/metrics"))
+
+
+def _serve(args):
+    models = {}
+    for spec in args.model:
+        name, _, path = spec.rpartition("=")
+        models[name or os.path.basename(path)] = load_served_model(path)
+    service = InferenceService(
+        models, args.max_batch, args.max_delay_ms / 1000, args.tile
+    )
+    service.warmup()
+    server = service.server(args.address, quiet=not args.verbose)
+    print(f"serving {list(models)} on {args.address}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def _client(args):
+    from benchmark import phantom
+
+    client = SegmentationClient(args.address)
+    if args.volume:
+        volume = np.load(args.volume)
+    else:
+        volume = phantom(args.cube)[0].numpy()
+
+    def one(_):
+        start = time.perf_counter()
+        client.segment(volume, args.model, normalize=args.normalize)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(args.concurrency) as pool:
+        latencies = sorted(pool.map(one, range(args.requests)))
+    elapsed = time.perf_counter() - start
+    print(
+        f"{args.requests} requests in {elapsed:.2f} s "
+        f"({args.requests / elapsed:.2f}/s), latency p50 "
+        f"{latencies[len(latencies) // 2]:.3f} s max {latencies[-1]:.3f} s"
+    )
+    print(json.dumps(client.metrics(), indent=4))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Local MeshNet segmentation service with dynamic batching"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve = commands.add_parser("serve", help="run the service")
+    serve.add_argument(
+        "--model",
+        action="append",
+        required=True,
+        help="[name=]model.json or "
+        "checkpoint.pth:config.json:channels:classes[:fat]",
+    )
+    serve.add_argument(
+        "--address", default="127.0.0.1:8080", help="host:port or socket path"
+    )
+    serve.add_argument("--max-batch", type=int, default=4)
+    serve.add_argument("--max-delay-ms", type=float, default=10)
+    serve.add_argument(
+        "--tile",
+        type=int,
+        default=None,
+        help="tile core edge, whole volumes if unset",
+    )
+    serve.add_argument("--verbose", action="store_true")
+    serve.set_defaults(run=_serve)
+
+    client = commands.add_parser("client", help="send test requests")
+    client.add_argument("--address", default="127.0.0.1:8080")
+    client.add_argument("--model", default=None)
+    client.add_argument("--volume", help=".npy volume, a phantom if unset")
+    client.add_argument("--cube", type=int, default=64)
+    client.add_argument("--normalize", action="store_true")
+    client.add_argument("--requests", type=int, default=8)
+    client.add_argument("--concurrency", type=int, default=4)
+    client.set_defaults(run=_client)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
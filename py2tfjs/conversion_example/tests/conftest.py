@@ -0,0 +1,68 @@
+import json
+import os
+import sys
+
+import pytest
+import torch
+
+# the conversion scripts are flat modules importing each other by name
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+
+def write_config(path, dilations=(1, 2, 4, 2, 1), channels=4, gelu=True):
+    """A small MeshNet config json: 3x3x3 convs with ``dilations`` and a
+    1x1x1 classifier"""
+    layers = [
+        {
+            "in_channels": channels,
+            "out_channels": channels,
+            "kernel_size": 3,
+            "padding": dilation,
+            "stride": 1,
+            "dilation": dilation,
+        }
+        for dilation in dilations
+    ]
+    layers.append(
+        {
+            "in_channels": channels,
+            "out_channels": -1,
+            "kernel_size": 1,
+            "padding": 0,
+            "stride": 1,
+            "dilation": 1,
+        }
+    )
+    config = {
+        "header": "test MeshNet",
+        "bnorm": True,
+        "gelu": gelu,
+        "dropout_p": 0,
+        "layers": layers,
+    }
+    with open(path, "w") as f:
+        json.dump(config, f)
+    return str(path)
+
+
+@pytest.fixture
+def config_file(tmp_path):
+    return write_config(tmp_path / "config.json")
+
+
+@pytest.fixture
+def meshnet(config_file):
+    """An eval-mode enMesh_checkpoint with 3 classes and non-trivial
+    BatchNorm statistics"""
+    from meshnet import enMesh_checkpoint
+
+    torch.manual_seed(0)
+    model = enMesh_checkpoint(1, 3, None, config_file)
+    for module in model.modules():
+        if isinstance(module, torch.nn.BatchNorm3d):
+            module.running_mean.uniform_(-0.1, 0.1)
+            module.running_var.uniform_(0.5, 1.5)
+            module.weight.data.uniform_(0.5, 1.5)
+            module.bias.data.uniform_(-0.1, 0.1)
+    return model.eval()
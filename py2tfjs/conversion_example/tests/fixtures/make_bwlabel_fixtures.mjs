@@ -0,0 +1,54 @@
+// Regenerate bwlabel.json, the bwlabels.js reference output that
+// tests/test_bwlabel.py compares bwlabel.py with:
+//   node make_bwlabel_fixtures.mjs > bwlabel.json
+import { BWLabeler } from '../../../../bwlabels.js'
+
+// small seeded PRNG, so the volumes are the same on every run
+function mulberry32(seed) {
+  return function () {
+    seed = (seed + 0x6d2b79f5) | 0
+    let t = Math.imul(seed ^ (seed >>> 15), 1 | seed)
+    t = (t + Math.imul(t ^ (t >>> 7), 61 | t)) ^ t
+    return ((t ^ (t >>> 14)) >>> 0) / 4294967296
+  }
+}
+
+function volume(dim, density, values, seed) {
+  const random = mulberry32(seed)
+  const img = new Uint32Array(dim[0] * dim[1] * dim[2])
+  for (let i = 0; i < img.length; i++) {
+    if (random() < density) {
+      img[i] = 1 + Math.floor(random() * values)
+    }
+  }
+  return img
+}
+
+const volumes = [
+  { dim: [7, 6, 5], density: 0.35, values: 1, seed: 1 },
+  { dim: [7, 6, 5], density: 0.6, values: 3, seed: 2 },
+  { dim: [9, 4, 6], density: 0.5, values: 2, seed: 3 },
+  { dim: [8, 7, 1], density: 0.5, values: 2, seed: 4 }
+]
+
+// bwlabels.js logs a line per call
+console.log = () => {}
+const cases = []
+for (const { dim, density, values, seed } of volumes) {
+  const img = volume(dim, density, values, seed)
+  for (const conn of [6, 18, 26]) {
+    for (const [binarize, onlyLargest] of [[false, false], [true, false], [false, true], [true, true]]) {
+      const [count, labels] = new BWLabeler().bwlabel(img, dim, conn, binarize, onlyLargest)
+      cases.push({
+        dim,
+        img: Array.from(img),
+        conn,
+        binarize,
+        only_largest: onlyLargest,
+        count,
+        labels: Array.from(labels)
+      })
+    }
+  }
+}
+process.stdout.write(JSON.stringify(cases) + '\n')
@@ -0,0 +1,76 @@
+import json
+import os
+
+import pytest
+import torch
+
+from batch_convert import convert_all, print_report, read_manifest
+
+
+@pytest.fixture
+def manifest(meshnet, config_file, tmp_path):
+    """Two good jobs and one with a missing checkpoint, paths relative to
+    the manifest"""
+    torch.save(meshnet.state_dict(), tmp_path / "model.pth")
+    jobs = [
+        {
+            "checkpoint": "model.pth",
+            "config": os.path.basename(config_file),
+            "channels": 4,
+            "classes": 3,
+            "output": f"out/{name}",
+            "quantize": quantize,
+        }
+        for name, quantize in (("plain", None), ("uint8", "uint8"))
+    ]
+    jobs.append(dict(jobs[0], checkpoint="missing.pth", output="out/bad"))
+    path = tmp_path / "manifest.json"
+    path.write_text(json.dumps(jobs))
+    return str(path)
+
+
+def test_read_manifest_json(manifest, tmp_path):
+    jobs = read_manifest(manifest)
+    assert [job["output"] for job in jobs] == [
+        str(tmp_path / "out" / name) for name in ("plain", "uint8", "bad")
+    ]
+    assert jobs[0]["checkpoint"] == str(tmp_path / "model.pth")
+    assert jobs[1]["quantize"] == "uint8"
+
+
+def test_read_manifest_csv(tmp_path):
+    path = tmp_path / "manifest.csv"
+    path.write_text(
+        "checkpoint,config,channels,classes,output,fat,quantize,"
+        "shard_size\n"
+        "a.pth,a.json,15,3,out/a,,,\n"
+        "b.pth,b.json,21,104,out/b,i,float16,4096\n"
+    )
+    first, second = read_manifest(str(path))
+    assert first["config"] == str(tmp_path / "a.json")
+    assert (first["channels"], first["classes"]) == (15, 3)
+    for key in ("fat", "quantize", "shard_size"):
+        assert first[key] is None
+    assert (second["fat"], second["quantize"]) == ("i", "float16")
+    assert second["shard_size"] == 4096
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_convert_all_reports_every_job(manifest, tmp_path, workers, capsys):
+    jobs = read_manifest(manifest)
+    results = convert_all(jobs, workers=workers)
+
+    assert [r["output"] for r in results] == [job["output"] for job in jobs]
+    for result in results[:2]:
+        assert "error" not in result
+        for stage in ("load_s", "fuse_s", "export_s"):
+            assert 0 <= result[stage] <= result["total_s"]
+        assert result["worker_peak_rss"] > 0
+        assert os.path.exists(os.path.join(result["output"], "model.json"))
+    assert results[2]["error"].startswith("FileNotFoundError")
+    assert not os.path.exists(results[2]["output"])
+
+    print_report(results)
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 1 + len(jobs)
+    assert "FAILED FileNotFoundError" in lines[3]
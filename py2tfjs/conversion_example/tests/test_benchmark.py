@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+from benchmark import MODES, compare, run_point, sweep
+
+OPTIONS = {
+    "out_slice": 2,
+    "tile_budget_mb": 1,
+    "crop_padding": 2,
+    "compile_cache": None,
+}
+# modes whose layers run as Python modules
+LAYER_TIMED = {"eager", "sliced", "tiled", "cropped", "bfloat16", "float16"}
+
+
+@pytest.fixture
+def spec(config_file):
+    return f"{config_file}:4:3"
+
+
+@pytest.mark.parametrize("mode", sorted(MODES))
+def test_every_mode_runs(spec, mode, tmp_path, monkeypatch):
+    # compile_model points inductor at the cache for the whole process
+    cache = str(tmp_path / "inductor")
+    monkeypatch.setenv("TORCHINDUCTOR_CACHE_DIR", cache)
+    options = dict(OPTIONS, compile_cache=cache)
+    result = run_point(spec, 16, 1, mode, options, repeats=1, warmup=0)
+    assert result["seconds"] > 0
+    assert result["voxels_per_s"] == pytest.approx(16**3 / result["seconds"])
+    assert ("layers" in result) == (mode in LAYER_TIMED)
+    if mode in LAYER_TIMED:
+        names = [name.split(":")[1] for name in result["layers"]]
+        assert "Conv3d" in names
+        assert all(seconds >= 0 for seconds in result["layers"].values())
+
+
+def test_sweep_and_compare(spec, tmp_path, capsys):
+    results = sweep([spec], [12], [1], ["eager", "plan"], OPTIONS)
+    assert [p["mode"] for p in results] == ["eager", "plan"]
+    for point in results:
+        assert point["peak_rss"] >= 0 and "error" not in point
+    assert len(capsys.readouterr().out.splitlines()) == 2
+    json.dumps(results)
+
+    slower = [dict(p, seconds=p["seconds"] * 2) for p in results]
+    regressions = compare(slower, results, threshold=0.1)
+    assert [(key[3], metric) for key, metric, _, _ in regressions] == [
+        ("eager", "seconds"),
+        ("plan", "seconds"),
+    ]
+    assert compare(results, results) == []
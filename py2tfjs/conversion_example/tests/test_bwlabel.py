@@ -0,0 +1,50 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from bwlabel import bwlabel, brain_mask, keep_largest_component
+
+# bwlabels.js output, see fixtures/make_bwlabel_fixtures.mjs
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "bwlabel.json")
+
+with open(FIXTURES) as f:
+    CASES = json.load(f)
+
+
+def _volume(flat, dim):
+    # the JavaScript volumes run first axis fastest
+    return np.asarray(flat, dtype=np.uint32).reshape(dim, order="F")
+
+
+@pytest.mark.parametrize(
+    "case",
+    CASES,
+    ids=[
+        f"{'x'.join(map(str, c['dim']))}-conn{c['conn']}"
+        f"{'-binarize' if c['binarize'] else ''}"
+        f"{'-largest' if c['only_largest'] else ''}"
+        for c in CASES
+    ],
+)
+def test_bwlabel_matches_bwlabels_js(case):
+    img = _volume(case["img"], case["dim"])
+    count, labels = bwlabel(
+        img, case["conn"], case["binarize"], case["only_largest"]
+    )
+    assert count == case["count"]
+    np.testing.assert_array_equal(labels, _volume(case["labels"], case["dim"]))
+
+
+def test_keep_largest_component_keeps_the_dtype():
+    segmentation = np.zeros((6, 6, 6), dtype=np.uint8)
+    segmentation[:2, :2, :1] = 2
+    segmentation[4:, 4:, 4:] = 2
+    segmentation[0, 5, 0] = 1
+    result = keep_largest_component(segmentation)
+    assert result.dtype == np.uint8
+    assert (result == 2).sum() == 8
+    assert result[:2, :2, :2].max() == 0
+    assert result[0, 5, 0] == 1
+    assert brain_mask(segmentation).sum() == 8
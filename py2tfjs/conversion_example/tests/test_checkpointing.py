@@ -0,0 +1,69 @@
+import copy
+import time
+
+import pytest
+import torch
+
+import checkpointing
+from checkpointing import _measure_step, plan_checkpoints
+
+SHAPE = (2, 1, 12, 12, 12)
+
+
+def _gradients(model, x, budget):
+    model = copy.deepcopy(model).train()
+    model.set_checkpoint_budget(budget)
+    x = x.clone()
+    model(x).square().mean().backward()
+    grads = {name: p.grad for name, p in model.named_parameters()}
+    return x.grad, grads, model.checkpoint_plan
+
+
+@pytest.mark.parametrize("budget", [0, 600_000, 2**40])
+def test_planned_gradients_match_default(meshnet, budget):
+    x = torch.rand(SHAPE, generator=torch.Generator().manual_seed(2))
+    expected_input, expected, _ = _gradients(meshnet, x, None)
+    actual_input, actual, plan = _gradients(meshnet, x, budget)
+    assert plan.peak <= budget or plan.recomputed == len(meshnet.model)
+    torch.testing.assert_close(actual_input, expected_input)
+    assert actual.keys() == expected.keys()
+    for name in expected:
+        torch.testing.assert_close(actual[name], expected[name])
+
+
+def test_plan_of_large_budget_recomputes_nothing(meshnet):
+    plan = plan_checkpoints(meshnet.model, SHAPE, 2**40)
+    assert plan.segments == [(0, len(meshnet.model), False)]
+    assert plan.recomputed == 0
+
+
+def test_plan_of_mid_budget_mixes_segments(meshnet):
+    plan = plan_checkpoints(meshnet.model, SHAPE, 600_000)
+    kinds = {checkpointed for _, _, checkpointed in plan.segments}
+    assert kinds == {True, False}
+    assert 0 < plan.recomputed < len(meshnet.model)
+
+
+def test_plan_estimate_follows_parameter_dtype(meshnet):
+    # the input is counted with the parameters' element size, like the
+    # probed activations
+    single = plan_checkpoints(meshnet.model, SHAPE, 0)
+    model = copy.deepcopy(meshnet.model).double()
+    double = plan_checkpoints(model, SHAPE, 0)
+    assert double.segments == single.segments
+    assert double.peak == 2 * single.peak
+
+
+def test_measured_step_excludes_planning(config_file, monkeypatch):
+    calls = []
+
+    def slow_plan(*args):
+        calls.append(args)
+        time.sleep(1.0)
+        return plan_checkpoints(*args)
+
+    monkeypatch.setattr(checkpointing, "plan_checkpoints", slow_plan)
+    seconds, plan = _measure_step(config_file, None, 3, SHAPE, 600_000)
+    assert len(calls) == 1
+    assert seconds < 1.0
+    assert plan["peak"] > 0
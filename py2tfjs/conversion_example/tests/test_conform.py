@@ -0,0 +1,122 @@
+import numpy as np
+import pytest
+
+from conform import ConformTransform, _sample, resample
+
+
+def _volume(shape=(20, 24, 18), seed=0):
+    return np.random.default_rng(seed).random(shape, dtype=np.float32)
+
+
+def _gather(data, vox2vox, shape, order):
+    """The oblique fallback on an axis-aligned grid"""
+    grid = np.indices(shape, dtype=float).reshape(3, -1)
+    coords = vox2vox[:3, :3] @ grid + vox2vox[:3, 3, None]
+    return _sample(data, coords.reshape((3,) + tuple(shape)), order)
+
+
+# output axis 0 reads input axis 2 flipped, axis 1 reads axis 0 at
+# 0.7 voxels per step, axis 2 reads axis 1 shifted
+AXIS_ALIGNED = np.array(
+    [
+        [0.0, 0.7, 0.0, -1.3],
+        [0.0, 0.0, 1.0, 2.0],
+        [-1.0, 0.0, 0.0, 17.0],
+        [0.0, 0.0, 0.0, 1.0],
+    ]
+)
+
+# a rotation about the last axis mixes axes 0 and 1
+OBLIQUE = np.array(
+    [
+        [0.9, 0.2, 0.0, 1.0],
+        [-0.2, 0.9, 0.0, 2.0],
+        [0.0, 0.0, 1.0, -0.5],
+        [0.0, 0.0, 0.0, 1.0],
+    ]
+)
+
+
+@pytest.mark.parametrize("order", [0, 1])
+def test_separable_passes_match_the_gather(order):
+    data = _volume()
+    shape = (22, 30, 26)
+    expected = _gather(data, AXIS_ALIGNED, shape, order)
+    actual = resample(data, AXIS_ALIGNED, shape, order)
+    np.testing.assert_allclose(actual, expected, atol=1e-6)
+
+
+def test_labels_keep_their_dtype():
+    labels = np.random.default_rng(0).integers(0, 4, (20, 24, 18))
+    labels = labels.astype(np.uint8)
+    out = resample(labels, AXIS_ALIGNED, (22, 30, 26), order=0)
+    assert out.dtype == np.uint8
+    np.testing.assert_array_equal(
+        out, _gather(labels, AXIS_ALIGNED, (22, 30, 26), 0)
+    )
+
+
+@pytest.mark.parametrize(
+    "vox2vox",
+    [AXIS_ALIGNED, OBLIQUE],
+    ids=["separable", "oblique"],
+)
+def test_trilinear_matches_scipy_inside_the_volume(vox2vox):
+    ndimage = pytest.importorskip("scipy.ndimage")
+    data = _volume()
+    shape = (22, 30, 26)
+    expected = ndimage.affine_transform(
+        data, vox2vox, output_shape=shape, order=1
+    )
+    actual = resample(data, vox2vox, shape)
+    # scipy's constant mode zeroes samples that are even a rounding error
+    # outside, resample fades them out
+    grid = np.indices(shape, dtype=float).reshape(3, -1)
+    coords = vox2vox[:3, :3] @ grid + vox2vox[:3, 3, None]
+    limit = np.array(data.shape)[:, None] - 1
+    inside = (coords > 1e-6) & (coords < limit - 1e-6)
+    inside = inside.all(0).reshape(shape)
+    assert inside.mean() > 0.3
+    np.testing.assert_allclose(actual[inside], expected[inside], atol=1e-6)
+
+
+def _native_affine(voxel_size=(1.0, 1.0, 1.0)):
+    # RAS with a translation, a typical scanner NIfTI
+    affine = np.diag(tuple(voxel_size) + (1.0,))
+    affine[:3, 3] = (-9.0, -12.0, -8.0)
+    return affine
+
+
+def test_labels_round_trip_through_the_inverse():
+    labels = np.random.default_rng(0).integers(0, 5, (18, 22, 16))
+    labels = labels.astype(np.uint8)
+    transform = ConformTransform(labels.shape, _native_affine(), (32,) * 3)
+    conformed = transform.to_conformed(labels, order=0)
+    assert conformed.shape == (32, 32, 32)
+    assert conformed.sum(dtype=np.int64) == labels.sum(dtype=np.int64)
+    np.testing.assert_array_equal(transform.to_native(conformed), labels)
+
+
+def test_finer_grid_round_trips_intensities():
+    data = _volume((18, 22, 16))
+    transform = ConformTransform(
+        data.shape, _native_affine(), (48,) * 3, voxel_size=0.5
+    )
+    native = transform.to_native(transform.to_conformed(data), order=1)
+    assert native.shape == data.shape
+    np.testing.assert_allclose(native, data, atol=1e-6)
+
+
+def test_saved_transform_maps_back_the_same(tmp_path):
+    labels = np.random.default_rng(1).integers(0, 3, (20, 18, 14))
+    transform = ConformTransform(
+        labels.shape, _native_affine((1.0, 1.2, 1.5)), (40,) * 3
+    )
+    conformed = transform.to_conformed(labels, order=0)
+    path = str(tmp_path / "transform.json")
+    transform.save(path)
+    loaded = ConformTransform.load(path)
+    np.testing.assert_allclose(loaded.affine, transform.affine)
+    np.testing.assert_array_equal(
+        loaded.to_native(conformed), transform.to_native(conformed)
+    )
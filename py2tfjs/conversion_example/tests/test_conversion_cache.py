@@ -0,0 +1,133 @@
+import json
+import os
+import shutil
+
+import pytest
+
+import conversion_cache
+from conversion_cache import ConversionCache
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    checkpoint = tmp_path / "model.pth"
+    checkpoint.write_bytes(b"weights")
+    config = tmp_path / "config.json"
+    config.write_text(json.dumps({"layers": []}))
+    return str(checkpoint), str(config)
+
+
+def test_key_covers_inputs_and_options(tmp_path, inputs):
+    cache = ConversionCache(str(tmp_path / "cache"))
+    checkpoint, config = inputs
+    key = cache.key(checkpoint, config, {"quantize": None})
+    assert key == cache.key(checkpoint, config, {"quantize": None})
+    assert key != cache.key(checkpoint, config, {"quantize": "uint8"})
+    with open(checkpoint, "ab") as f:
+        f.write(b"retrained")
+    assert key != cache.key(checkpoint, config, {"quantize": None})
+
+
+def test_key_changes_with_the_converter_code(tmp_path, inputs, monkeypatch):
+    cache = ConversionCache(str(tmp_path / "cache"))
+    key = cache.key(*inputs)
+    monkeypatch.setattr(
+        conversion_cache,
+        "converter_fingerprint",
+        lambda: "edited meshnet2tfjs.py",
+    )
+    assert cache.key(*inputs) != key
+
+
+def test_fingerprint_reads_every_converter_source():
+    digest = conversion_cache.converter_fingerprint()
+    fewer = conversion_cache.converter_fingerprint(
+        conversion_cache.CONVERTER_SOURCES[1:]
+    )
+    assert digest != fewer
+
+
+def _export(dirname, n_shards, payload=b"w"):
+    """Write a fake converter output: model.json and its shards"""
+    os.makedirs(dirname, exist_ok=True)
+    paths = [f"group1-shard{i + 1}of{n_shards}.bin" for i in range(n_shards)]
+    for path in paths:
+        with open(os.path.join(dirname, path), "wb") as f:
+            f.write(payload * 100)
+    spec = {"weightsManifest": [{"paths": paths, "weights": []}]}
+    with open(os.path.join(dirname, "model.json"), "w") as f:
+        json.dump(spec, f)
+    return ["model.json"] + paths
+
+
+def _listing(dirname):
+    return sorted(os.listdir(dirname))
+
+
+def test_store_and_fetch_round_trip(tmp_path):
+    cache = ConversionCache(str(tmp_path / "cache"))
+    source = str(tmp_path / "source")
+    files = _export(source, 2)
+    # only the files model.json references are cached
+    (tmp_path / "source" / "notes.txt").write_text("not an artifact")
+    cache.store("k", source)
+
+    target = str(tmp_path / "target")
+    assert cache.fetch("k", target)
+    assert _listing(target) == sorted(files)
+    for name in files:
+        with open(os.path.join(source, name), "rb") as a:
+            with open(os.path.join(target, name), "rb") as b:
+                assert a.read() == b.read()
+    assert not cache.fetch("other", str(tmp_path / "miss"))
+    assert not os.path.exists(tmp_path / "miss")
+
+
+def test_fetch_removes_stale_shards(tmp_path):
+    cache = ConversionCache(str(tmp_path / "cache"))
+    _export(str(tmp_path / "small"), 1)
+    cache.store("small", str(tmp_path / "small"))
+
+    output = str(tmp_path / "output")
+    _export(output, 3)
+    assert cache.fetch("small", output)
+    assert _listing(output) == ["group1-shard1of1.bin", "model.json"]
+
+
+def test_get_or_convert_hits_the_cache(tmp_path, inputs):
+    cache = ConversionCache(str(tmp_path / "cache"))
+    output = str(tmp_path / "output")
+    calls = []
+
+    def convert():
+        calls.append(output)
+        _export(output, 2)
+
+    assert not cache.get_or_convert(*inputs, {}, output, convert)
+    shutil.rmtree(output)
+    assert cache.get_or_convert(*inputs, {}, output, convert)
+    assert len(calls) == 1
+    assert "model.json" in _listing(output)
+    # other options are another conversion
+    assert not cache.get_or_convert(*inputs, {"q": 1}, output, convert)
+    assert len(calls) == 2
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    root = tmp_path / "cache"
+    cache = ConversionCache(str(root), max_bytes=10**9)
+    for i, name in enumerate(("a", "b", "c")):
+        _export(str(tmp_path / name), 1)
+        cache.store(name, str(tmp_path / name))
+        os.utime(root / name, (1000 + i, 1000 + i))
+    entry_size = sum(f.stat().st_size for f in (root / "a").iterdir())
+
+    # using "a" makes "b" the least recently used
+    assert cache.fetch("a", str(tmp_path / "used"))
+    cache.max_bytes = 2 * entry_size
+    cache.evict()
+    assert _listing(root) == ["a", "c"]
+
+    cache.max_bytes = entry_size
+    cache.evict()
+    assert _listing(root) == ["a"]
@@ -0,0 +1,77 @@
+import pytest
+import torch
+
+from cropping import bounding_box, cropped_inference, pad_box
+
+
+def _head(shape, box):
+    """A volume that is zero outside ``box``"""
+    x = torch.zeros((1, 1) + shape)
+    region = tuple(slice(start, stop) for start, stop in box)
+    generator = torch.Generator().manual_seed(3)
+    inside = x[(0, 0) + region]
+    inside.copy_(torch.rand(inside.shape, generator=generator) + 0.1)
+    return x
+
+
+def _full(model, x):
+    with torch.inference_mode():
+        return model(x)
+
+
+def test_bounding_box():
+    box = [(3, 9), (0, 5), (7, 20)]
+    assert bounding_box(_head((12, 14, 20), box)[0, 0]) == box
+    assert bounding_box(torch.zeros(4, 5, 6)) is None
+
+
+def test_pad_box_is_clipped_to_the_volume():
+    shape = (12, 14, 20)
+    assert pad_box([(3, 9), (0, 5), (7, 20)], shape, 4) == [
+        slice(0, 12),
+        slice(0, 9),
+        slice(3, 20),
+    ]
+
+
+@pytest.mark.parametrize(
+    "box",
+    [
+        [(12, 20), (10, 17), (14, 22)],
+        # touching the border on every axis
+        [(0, 9), (20, 36), (3, 40)],
+    ],
+)
+def test_cropped_matches_full_inside_the_box(meshnet, box):
+    x = _head((32, 36, 40), box)
+    # padding by the receptive-field halo keeps the box exact
+    actual = cropped_inference(meshnet.model, x, padding=10)
+    expected = _full(meshnet.model, x)
+    inner = (slice(None), slice(None)) + tuple(slice(*b) for b in box)
+    torch.testing.assert_close(
+        actual[inner], expected[inner], rtol=0, atol=1e-5
+    )
+
+    region = tuple(pad_box(box, x.shape[2:], 10))
+    outside = torch.ones(x.shape[2:], dtype=torch.bool)
+    outside[region] = False
+    assert not actual[0][:, outside].any()
+
+
+def test_mask_sets_the_box(meshnet):
+    box = [(12, 20), (10, 17), (14, 22)]
+    x = _head((32, 36, 40), [(0, 32), (0, 36), (0, 40)])
+    mask = _head((32, 36, 40), box)[0, 0]
+    actual = cropped_inference(meshnet.model, x, padding=0, mask=mask)
+    crop = (slice(None), slice(None)) + tuple(slice(*b) for b in box)
+    torch.testing.assert_close(
+        actual[crop], _full(meshnet.model, x[crop].contiguous())
+    )
+
+
+def test_empty_volume_gives_zeros(meshnet):
+    out = torch.ones(1, 3, 8, 8, 8)
+    x = torch.zeros(1, 1, 8, 8, 8)
+    actual = cropped_inference(meshnet.model, x, out=out)
+    assert actual is out
+    assert not out.any()
@@ -0,0 +1,36 @@
+import torch
+
+from distill import TeacherCache, distillation_loss
+
+
+def test_distillation_loss_vanishes_for_the_teacher():
+    logits = torch.randn(2, 3, 4, 4, 4)
+    assert distillation_loss(logits, logits).abs() < 1e-6
+    assert distillation_loss(logits + torch.randn_like(logits), logits) > 0
+
+
+def test_teacher_cache_tracks_teacher_and_volume(
+    meshnet, config_file, tmp_path
+):
+    checkpoint = tmp_path / "teacher.pth"
+    torch.save(meshnet.state_dict(), checkpoint)
+    spec = f"{checkpoint}:{config_file}:4:3"
+    x = torch.rand(1, 1, 10, 10, 10)
+
+    cache = TeacherCache(str(tmp_path / "cache"), spec)
+    assert not cache.valid("a", x)
+    cache.build(meshnet.model, "a", x)
+    assert cache.valid("a", x)
+    with torch.inference_mode():
+        expected = meshnet.model(x)[0]
+    torch.testing.assert_close(
+        cache.load("a").float(), expected, rtol=1e-3, atol=1e-3
+    )
+
+    # same name, different contents
+    assert not cache.valid("a", x + 1)
+    # the teacher retrained at the same path
+    with torch.no_grad():
+        next(meshnet.parameters()).add_(1)
+    torch.save(meshnet.state_dict(), checkpoint)
+    assert not TeacherCache(str(tmp_path / "cache"), spec).valid("a", x)
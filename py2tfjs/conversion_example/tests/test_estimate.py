@@ -0,0 +1,101 @@
+import copy
+import json
+
+import torch
+from conftest import write_config
+
+from estimate import (
+    ITEMSIZE,
+    layer_costs,
+    layers_from_config,
+    plan_buffer_nbytes,
+    recommend,
+    strategies,
+)
+from meshnet import MeshNet
+from plan import ExecutionPlan
+
+SHAPE = (32, 32, 32)
+
+
+def _layers(channels=4, n_classes=3):
+    config = {
+        "layers": [
+            {
+                "in_channels": channels,
+                "out_channels": channels,
+                "kernel_size": 3,
+                "dilation": dilation,
+            }
+            for dilation in (1, 2, 4)
+        ]
+        + [
+            {
+                "in_channels": channels,
+                "out_channels": -1,
+                "kernel_size": 1,
+                "dilation": 1,
+            }
+        ]
+    }
+    return layers_from_config(config, 1, n_classes, channels)
+
+
+def test_output_volume_is_counted_once():
+    layers = _layers(channels=4, n_classes=3)
+    estimates = strategies(layers, SHAPE, crop_fraction=1.0)
+    voxels = 32**3
+    params = sum(c["param_bytes"] for c in layer_costs(layers, SHAPE))
+    fixed = params + voxels * ITEMSIZE
+    output = 3 * voxels * ITEMSIZE
+    # the widest conv: 4 -> 4 channels with blocked copies of both
+    assert estimates["full"]["peak_bytes"] == fixed + 16 * voxels * ITEMSIZE
+    # cropping to the whole volume also fills a separate full-size output
+    cropped = estimates["cropped"]["peak_bytes"]
+    assert cropped == estimates["full"]["peak_bytes"] + output
+
+
+def test_sliced_beats_full_for_many_classes():
+    layers = _layers(channels=21, n_classes=104)
+    estimates = strategies(layers, SHAPE, out_slice=1, in_slice=4)
+    assert estimates["sliced"]["peak_bytes"] < estimates["full"]["peak_bytes"]
+    eager = {name: estimates[name] for name in ("full", "sliced")}
+    assert recommend(eager, estimates["sliced"]["peak_bytes"]) == "sliced"
+
+
+def test_plan_buffers_match_execution_plan(tmp_path):
+    config = write_config(tmp_path / "config.json", channels=5)
+    with open(config) as f:
+        layers = layers_from_config(json.load(f), 1, 104, 5)
+    model = MeshNet(1, 104, 5, config).eval()
+    plan = ExecutionPlan.from_model(model)
+    x = torch.rand(1, 1, 11, 12, 13)
+    first, second = plan._allocate(x)
+    assert plan_buffer_nbytes(layers, (11, 12, 13)) == (
+        first.nbytes + second.nbytes
+    )
+    # the 104-class output is not held in the ping-pong buffers
+    assert first.shape[1] == 5
+
+
+def test_bias_is_counted_only_when_present():
+    layers = _layers()
+    without = copy.deepcopy(layers)
+    for layer in without:
+        layer["bias"] = False
+    with_bias = layer_costs(layers, SHAPE)
+    no_bias = layer_costs(without, SHAPE)
+    for a, b, layer in zip(with_bias, no_bias, layers):
+        assert a["param_bytes"] - b["param_bytes"] == (
+            layer["out_channels"] * ITEMSIZE
+        )
+        assert a["flops"] > b["flops"]
+
+
+def test_recommend_fits_the_budget():
+    estimates = strategies(_layers(), SHAPE, budget=2**30)
+    assert recommend(estimates, 2**30) == "full"
+    tight = min(e["peak_bytes"] for e in estimates.values())
+    choice = recommend(estimates, tight)
+    assert estimates[choice]["peak_bytes"] <= tight
+    assert recommend(estimates, tight - 1) is None
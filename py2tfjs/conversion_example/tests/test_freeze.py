@@ -0,0 +1,47 @@
+import pytest
+import torch
+
+from freeze import ChannelsLast, export_frozen, freeze, load_frozen
+
+
+def _weights(model):
+    return [
+        m.weight for m in model.modules() if isinstance(m, torch.nn.Conv3d)
+    ]
+
+
+def test_channels_last_leaves_the_caller_model_alone(meshnet):
+    layers = meshnet.model
+    wrapped = ChannelsLast(layers)
+    for weight in _weights(layers):
+        assert weight.is_contiguous()
+    for weight in _weights(wrapped):
+        assert weight.is_contiguous(memory_format=torch.channels_last_3d)
+
+
+def test_frozen_model_matches_eager(meshnet):
+    x = torch.rand(1, 1, 12, 12, 12)
+    frozen = freeze(meshnet, x.shape)
+    with torch.inference_mode():
+        expected, actual = meshnet.model(x), frozen(x)
+    torch.testing.assert_close(actual, expected, rtol=1e-4, atol=1e-5)
+
+
+@pytest.mark.parametrize("channels_last", [True, False])
+def test_exported_model_loads_and_matches_eager(
+    meshnet, tmp_path, channels_last
+):
+    path = str(tmp_path / "frozen.pt")
+    export_frozen(meshnet, path, (1, 1, 12, 12, 12), channels_last)
+    frozen = load_frozen(path)
+    # spatially generic: another shape than the example
+    x = torch.rand(1, 1, 10, 13, 11)
+    with torch.inference_mode():
+        expected, actual = meshnet.model(x), frozen(x)
+    torch.testing.assert_close(actual, expected, rtol=1e-4, atol=1e-5)
+
+
+def test_freeze_leaves_the_caller_mode_alone(meshnet):
+    meshnet.train()
+    freeze(meshnet, (1, 1, 8, 8, 8))
+    assert all(module.training for module in meshnet.modules())
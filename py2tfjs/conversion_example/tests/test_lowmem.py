@@ -0,0 +1,62 @@
+import os
+import subprocess
+import sys
+
+import pytest
+import torch
+import torch.nn as nn
+
+import lowmem
+from lowmem import sliced_conv3d
+
+
+@pytest.mark.parametrize("bias", [True, False])
+@pytest.mark.parametrize(
+    "out_slice, in_slice",
+    # 7 output and 5 input channels: groups of 2 and 3 leave a remainder
+    [(1, None), (2, None), (3, 2), (7, 5), (16, 3)],
+)
+def test_sliced_conv3d_matches_conv(bias, out_slice, in_slice):
+    torch.manual_seed(0)
+    conv = nn.Conv3d(5, 7, 3, padding=2, dilation=2, bias=bias)
+    x = torch.rand(2, 5, 9, 8, 7)
+    with torch.inference_mode():
+        expected = conv(x)
+        actual = sliced_conv3d(conv, x, out_slice, in_slice)
+    torch.testing.assert_close(actual, expected, rtol=0, atol=1e-6)
+
+
+def test_sliced_conv3d_fills_out():
+    conv = nn.Conv3d(4, 3, 1)
+    x = torch.rand(1, 4, 5, 5, 5)
+    out = torch.full((1, 3, 5, 5, 5), float("nan"))
+    with torch.inference_mode():
+        assert sliced_conv3d(conv, x, 2, out=out) is out
+        torch.testing.assert_close(out, conv(x))
+
+
+@pytest.mark.parametrize("slicing", [(1, None), (2, 3), (3, 1)])
+def test_channel_slicing_matches_forward(meshnet, slicing):
+    x = torch.rand(1, 1, 12, 10, 14)
+    with torch.inference_mode():
+        expected = meshnet(x)
+    meshnet.set_channel_slicing(*slicing)
+    # the sliced path enters inference mode itself
+    actual = meshnet.sliced_forward(x)
+    assert actual.is_inference()
+    torch.testing.assert_close(actual, expected, rtol=0, atol=1e-6)
+    torch.testing.assert_close(meshnet(x), expected, rtol=0, atol=1e-6)
+
+    meshnet.set_channel_slicing(None)
+    assert meshnet.channel_slicing is None
+
+
+def test_meshnet_import_is_portable():
+    # profiling needs the Unix-only resource module
+    code = (
+        "import sys, meshnet; "
+        "assert 'lowmem' not in sys.modules; "
+        "assert 'profiling' not in sys.modules"
+    )
+    here = os.path.dirname(os.path.abspath(lowmem.__file__))
+    subprocess.run([sys.executable, "-c", code], check=True, cwd=here)
@@ -0,0 +1,115 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+import torch
+
+from conftest import write_config
+from js2pytorch import tfjs_to_pytorch
+from meshnet import MeshNet
+from meshnet2tfjs import meshnet2tfjs
+from optimize import optimize_for_inference
+
+
+def _manifest(dirname):
+    with open(os.path.join(dirname, "model.json")) as f:
+        return json.load(f)["weightsManifest"]
+
+
+def _manifest_paths(dirname):
+    return [p for group in _manifest(dirname) for p in group["paths"]]
+
+
+def test_reexport_removes_stale_shards(meshnet, tmp_path):
+    dirname = str(tmp_path)
+    with open(os.path.join(dirname, "model.bin"), "wb") as f:
+        f.write(b"old weights")
+    meshnet2tfjs(meshnet, dirname, shard_size=1024)
+    assert len(_manifest_paths(dirname)) > 1
+
+    meshnet2tfjs(meshnet, dirname, shard_size=None)
+    paths = _manifest_paths(dirname)
+    bins = sorted(p for p in os.listdir(dirname) if p.endswith(".bin"))
+    assert bins == sorted(paths) == ["group1-shard1of1.bin"]
+
+
+def test_per_channel_needs_js2pytorch_target(meshnet, tmp_path):
+    with pytest.raises(ValueError, match="per-tensor"):
+        meshnet2tfjs(
+            meshnet, str(tmp_path), quantize="uint8", per_channel=True
+        )
+    assert not os.path.exists(tmp_path / "model.json")
+
+
+def test_quantized_export_returns_report_silently(meshnet, tmp_path, capsys):
+    report = meshnet2tfjs(
+        meshnet,
+        str(tmp_path),
+        quantize="uint8",
+        per_channel=True,
+        target="js2pytorch",
+    )
+    assert capsys.readouterr().out == ""
+    names = [name for name, _, _ in report]
+    manifest = _manifest(str(tmp_path))
+    assert names == [w["name"] for g in manifest for w in g["weights"]]
+    for _, max_abs, max_err in report:
+        assert max_err <= max_abs / 255 + 1e-6
+
+    x = torch.rand(1, 1, 12, 12, 12)
+    loaded = tfjs_to_pytorch(str(tmp_path / "model.json")).eval()
+    with torch.inference_mode():
+        expected, actual = meshnet(x), loaded(x)
+    assert (expected - actual).abs().max() < 0.05
+
+
+@pytest.mark.parametrize("fused", [False, True])
+@pytest.mark.parametrize(
+    "in_channels,fat,gelu",
+    [(1, None, False), (1, "io", True), (2, "b", False), (2, "i", True)],
+)
+def test_export_round_trips_every_variant(
+    tmp_path, in_channels, fat, gelu, fused
+):
+    torch.manual_seed(0)
+    config = write_config(tmp_path / "config.json", gelu=gelu)
+    model = MeshNet(in_channels, 3, 4, config, fat).eval()
+    for module in model.modules():
+        if isinstance(module, torch.nn.BatchNorm3d):
+            module.running_mean.uniform_(-0.1, 0.1)
+            module.running_var.uniform_(0.5, 1.5)
+    exported = optimize_for_inference(model) if fused else model
+    dirname = tmp_path / "tfjs"
+    meshnet2tfjs(exported, str(dirname), cube=12)
+
+    with open(dirname / "model.json") as f:
+        layers = json.load(f)["modelTopology"]["model_config"]["config"][
+            "layers"
+        ]
+    assert layers[0]["config"]["batch_input_shape"] == [
+        None,
+        12,
+        12,
+        12,
+        in_channels,
+    ]
+    loaded = tfjs_to_pytorch(str(dirname / "model.json")).eval()
+    x = torch.rand(1, in_channels, 12, 12, 12)
+    with torch.inference_mode():
+        expected, actual = model(x), loaded(x)
+    torch.testing.assert_close(actual, expected, rtol=1e-4, atol=1e-5)
+
+
+def test_legacy_script_imports_the_exporter():
+    # py2tfjs/meshnet.py is another MeshNet, it must stay the one imported
+    code = (
+        "import os, pytorch2js, meshnet; "
+        "assert os.path.dirname(meshnet.__file__) == os.getcwd(); "
+        "assert pytorch2js.MeshNet is meshnet.MeshNet; "
+        "assert callable(pytorch2js.meshnet2tfjs)"
+    )
+    tests = os.path.dirname(os.path.abspath(__file__))
+    here = os.path.dirname(os.path.dirname(tests))
+    subprocess.run([sys.executable, "-c", code], check=True, cwd=here)
@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+import torch
+
+from js2pytorch import normalize
+from normalization import order_statistics, quantile_normalize, quantiles
+
+QS = [0.0, 0.01, 0.25, 0.5, 0.731, 0.99, 1.0]
+
+
+def _volumes():
+    rng = np.random.default_rng(0)
+    yield "normal", rng.normal(size=(17, 19, 23)).astype(np.float32)
+    # a mostly empty scan: many ties at zero
+    sparse = rng.random((20, 20, 20), dtype=np.float32)
+    sparse[sparse < 0.7] = 0
+    yield "ties", sparse
+    yield "integers", rng.integers(0, 7, (9, 10, 11)).astype(np.float32)
+    yield "constant", np.full((5, 6, 7), 3.5, np.float32)
+    # signed zeros, denormals and magnitudes across the float32 range
+    scale = 10.0 ** rng.integers(-44, 38, (12, 13, 14))
+    wide = (rng.normal(size=(12, 13, 14)) * scale).astype(np.float32)
+    wide.flat[:40] = -0.0
+    wide.flat[40:80] = 0.0
+    yield "wide", wide
+
+
+@pytest.mark.parametrize("name,volume", list(_volumes()))
+@pytest.mark.parametrize(
+    "options",
+    [
+        {},
+        {"partition_limit": 0},
+        {
+            "bins": 4,
+            "chunk_size": 1000,
+            "gather_limit": 16,
+            "partition_limit": 0,
+        },
+    ],
+)
+def test_quantiles_match_numpy(name, volume, options):
+    expected = np.quantile(volume.astype(np.float64), QS)
+    actual = quantiles(torch.from_numpy(volume), QS, **options)
+    np.testing.assert_allclose(actual, expected, rtol=1e-6, atol=1e-6)
+
+
+@pytest.mark.parametrize("partition_limit", [0, 1 << 25])
+def test_order_statistics_are_exact(partition_limit):
+    rng = np.random.default_rng(1)
+    volume = rng.normal(size=50000).astype(np.float32)
+    volume[:100] = -0.0
+    volume[100:200] = 0.0
+    ranks = [0, 1, 12345, 25000, 25050, 49998, 49999]
+    n, values = order_statistics(
+        torch.from_numpy(volume),
+        ranks,
+        bins=8,
+        gather_limit=64,
+        partition_limit=partition_limit,
+    )
+    assert n == len(volume)
+    assert values == np.sort(volume)[ranks].tolist()
+
+
+def test_quantiles_of_chunks_match_the_whole_volume():
+    generator = torch.Generator().manual_seed(2)
+    volume = torch.randn(30, 20, 10, generator=generator)
+    chunks = list(volume.split(7))
+    assert quantiles(chunks, QS) == quantiles(volume, QS)
+
+
+def test_quantile_normalize_is_in_place():
+    volume = torch.randn(10, 11, 12)
+    assert quantile_normalize(volume) is volume
+    assert quantiles(volume, [0.01, 0.99]) == pytest.approx([0, 1], abs=1e-6)
+
+
+@pytest.mark.parametrize("as_numpy", [False, True])
+def test_normalize_keeps_the_input(as_numpy):
+    img = torch.arange(2 * 3 * 4, dtype=torch.int16).reshape(2, 3, 4)
+    if as_numpy:
+        img = img.numpy()
+    original = img.copy() if as_numpy else img.clone()
+    result = normalize(img)
+    assert result is not img
+    assert (img == original).all()
+    result = torch.as_tensor(result)
+    assert result.is_floating_point()
+    assert float(result.min()) == 0.0 and float(result.max()) == 1.0
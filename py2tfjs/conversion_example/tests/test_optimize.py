@@ -0,0 +1,73 @@
+import json
+
+import pytest
+import torch
+
+from conftest import write_config
+from meshnet import enMesh_checkpoint, meshnet_config
+from optimize import load_folded, optimize_for_inference
+
+
+def _snapshot(model):
+    return {k: v.clone() for k, v in model.state_dict().items()}
+
+
+def _same(a, b):
+    return a.keys() == b.keys() and all(torch.equal(a[k], b[k]) for k in a)
+
+
+def test_optimized_copy_matches_and_keeps_the_original(meshnet):
+    x = torch.rand(1, 1, 12, 12, 12)
+    before = _snapshot(meshnet)
+    optimized = optimize_for_inference(meshnet, x)
+    assert _same(before, _snapshot(meshnet))
+    assert not any(
+        isinstance(m, torch.nn.BatchNorm3d) for m in optimized.modules()
+    )
+    with torch.inference_mode():
+        expected, actual = meshnet(x), optimized(x)
+    torch.testing.assert_close(actual, expected, rtol=1e-4, atol=1e-5)
+
+
+def test_failed_check_leaves_the_original_intact(meshnet):
+    before = _snapshot(meshnet)
+    with pytest.raises(ValueError, match="rtol"):
+        optimize_for_inference(meshnet, torch.rand(1, 1, 8, 8, 8), rtol=-1)
+    assert _same(before, _snapshot(meshnet))
+
+
+def test_check_runs_without_an_example(meshnet):
+    # convert.py and batch_convert.py pass no example input
+    with pytest.raises(ValueError, match="rtol"):
+        optimize_for_inference(meshnet, rtol=-1)
+
+
+def test_probe_follows_the_input_channels(tmp_path):
+    config = write_config(tmp_path / "config.json")
+    model = enMesh_checkpoint(2, 3, None, config).eval()
+    optimized = optimize_for_inference(model)
+    x = torch.rand(1, 2, 10, 10, 10)
+    with torch.inference_mode():
+        expected, actual = model(x), optimized(x)
+    torch.testing.assert_close(actual, expected, rtol=1e-4, atol=1e-5)
+
+
+def test_folded_checkpoint_loads_into_meshnet(meshnet, config_file, tmp_path):
+    optimized = optimize_for_inference(meshnet)
+    config = meshnet_config(config_file, 1, 3, None)
+    config["bnorm"] = False
+    folded_config = str(tmp_path / "folded.json")
+    with open(folded_config, "w") as f:
+        json.dump(config, f)
+    folded = load_folded(
+        enMesh_checkpoint(1, 3, None, folded_config), optimized.model
+    )
+    checkpoint = tmp_path / "folded.pth"
+    torch.save(folded.state_dict(), checkpoint)
+
+    loaded = enMesh_checkpoint(1, 3, None, folded_config)
+    loaded.load_state_dict(torch.load(checkpoint))
+    x = torch.rand(1, 1, 10, 10, 10)
+    with torch.inference_mode():
+        expected, actual = optimized(x), loaded.eval()(x)
+    assert torch.equal(actual, expected)
@@ -0,0 +1,72 @@
+import pytest
+import torch
+from conftest import write_config
+
+from meshnet import MeshNet
+from plan import ExecutionPlan
+
+
+def _eager(model, x):
+    with torch.inference_mode():
+        return model(x)
+
+
+@pytest.mark.parametrize("slab_depth", [1, 4, 16])
+def test_plan_matches_eager(meshnet, slab_depth):
+    # an odd depth that no slab depth above 1 divides
+    x = torch.rand(2, 1, 13, 10, 11)
+    plan = ExecutionPlan.from_model(meshnet, slab_depth=slab_depth)
+    torch.testing.assert_close(
+        plan(x), _eager(meshnet, x), rtol=0, atol=1e-5
+    )
+
+
+def test_relu_plan_matches_eager(tmp_path):
+    torch.manual_seed(0)
+    config = write_config(tmp_path / "relu.json", gelu=False)
+    model = MeshNet(1, 3, None, config).eval()
+    x = torch.rand(1, 1, 9, 12, 10)
+    plan = ExecutionPlan.from_model(model, slab_depth=4)
+    torch.testing.assert_close(plan(x), _eager(model, x), rtol=0, atol=1e-5)
+
+
+def test_buffers_and_halo_are_reused(meshnet):
+    plan = ExecutionPlan.from_model(meshnet, slab_depth=5)
+    assert plan.halo == (4, 4, 4)
+    x, y = torch.rand(1, 1, 11, 9, 10), torch.rand(1, 1, 11, 9, 10)
+    first = plan(x)
+    buffers = plan._buffers
+    second = plan(y)
+    assert plan._buffers is buffers
+    assert first.data_ptr() != second.data_ptr()
+    torch.testing.assert_close(first, _eager(meshnet, x), rtol=0, atol=1e-5)
+    torch.testing.assert_close(
+        second, _eager(meshnet, y), rtol=0, atol=1e-5
+    )
+    # the zero halo survives the runs
+    for buffer in buffers[1:]:
+        halo = buffer.clone()
+        plan._interior(halo, halo.shape[1], (11, 9, 10)).zero_()
+        assert not halo.any()
+
+    z = torch.rand(1, 1, 7, 8, 9)
+    torch.testing.assert_close(plan(z), _eager(meshnet, z), rtol=0, atol=1e-5)
+    assert plan._buffers is not buffers
+
+
+def test_plan_fills_out(meshnet):
+    x = torch.rand(1, 1, 8, 8, 8)
+    out = torch.full((1, 3, 8, 8, 8), float("nan"))
+    plan = ExecutionPlan.from_model(meshnet)
+    assert plan(x, out=out) is out
+    torch.testing.assert_close(out, _eager(meshnet, x), rtol=0, atol=1e-5)
+
+
+def test_plan_from_config(meshnet, config_file, tmp_path):
+    checkpoint = tmp_path / "model.pth"
+    torch.save({"model_state_dict": meshnet.state_dict()}, checkpoint)
+    plan = ExecutionPlan.from_config(
+        config_file, checkpoint, n_classes=3, channels=None, slab_depth=3
+    )
+    x = torch.rand(1, 1, 10, 9, 8)
+    torch.testing.assert_close(plan(x), _eager(meshnet, x), rtol=0, atol=1e-5)
@@ -0,0 +1,52 @@
+import pytest
+import torch
+
+from conftest import write_config
+from precision import ReducedPrecision, precision_report, reduced_precision
+
+
+@pytest.mark.parametrize("dtype", [torch.bfloat16, torch.float16])
+def test_16_bit_logits_stay_within_a_few_ulps(meshnet, dtype):
+    x = torch.rand(1, 1, 16, 16, 16)
+    model = reduced_precision(meshnet, dtype)
+    with torch.inference_mode():
+        expected, actual = meshnet(x), model(x)
+    assert actual.dtype == torch.float32
+    # rounded once per layer output, relative to the largest logit
+    error = (actual - expected).abs().max() / expected.abs().max()
+    assert error < 4 * torch.finfo(dtype).eps
+    agreement = (actual.argmax(1) == expected.argmax(1)).float().mean()
+    assert agreement >= 0.99
+
+
+def test_head_stays_float32(meshnet):
+    model = reduced_precision(meshnet, torch.bfloat16)
+    assert isinstance(model, ReducedPrecision)
+    head_convs = [
+        m for m in model.head.modules() if isinstance(m, torch.nn.Conv3d)
+    ]
+    assert len(head_convs) == 1
+    assert head_convs[0].kernel_size == (1, 1, 1)
+    assert all(p.dtype == torch.float32 for p in model.head.parameters())
+    assert all(p.dtype == torch.bfloat16 for p in model.body.parameters())
+    # BatchNorm is folded before the cast
+    assert not any(
+        isinstance(m, torch.nn.BatchNorm3d) for m in model.modules()
+    )
+    assert all(p.dtype == torch.float32 for p in meshnet.parameters())
+
+
+def test_float32_is_the_model_itself(meshnet):
+    assert reduced_precision(meshnet, torch.float32) is meshnet
+
+
+def test_report_marks_agreeing_dtypes_safe(tmp_path):
+    config = write_config(tmp_path / "config.json")
+    report = precision_report(
+        f"{config}:4:3", ["bfloat16", "float16"], cube=16
+    )
+    assert list(report) == ["float32", "bfloat16", "float16"]
+    assert report["float32"]["argmax_agreement"] == 1.0
+    for result in report.values():
+        assert result["safe"] and result["min_dice"] >= 0.99
+        assert result["argmax_agreement"] >= 0.99
@@ -0,0 +1,86 @@
+import json
+
+import pytest
+import torch
+
+from meshnet import enMesh_checkpoint, meshnet_config
+from prune import (
+    activation_stats,
+    bn_scores,
+    hidden_blocks,
+    prune_meshnet,
+    pruned_config,
+    select_channels,
+)
+
+HALO = 10
+
+
+def _silence(model, beta):
+    """Zero the BatchNorm gamma of the last channel of every hidden
+    block, so it outputs the constant activation(``beta``)"""
+    with torch.no_grad():
+        for _, bn, _ in hidden_blocks(model):
+            bn.weight[-1] = 0
+            bn.bias[-1] = beta
+    return model
+
+
+def _prune_silent(model, compensate):
+    volumes = [torch.rand(1, 1, 16, 16, 16) for _ in range(2)]
+    keep = select_channels(bn_scores(model), 0.25)
+    assert all(len(k) == 3 and 3 not in k for k in keep)
+    means = activation_stats(model, volumes)[1] if compensate else None
+    return prune_meshnet(model, keep, means)
+
+
+def test_removing_zero_channels_is_exact(meshnet):
+    model = _silence(meshnet, 0.0)
+    pruned = _prune_silent(model, compensate=False)
+    x = torch.rand(1, 1, 20, 20, 20)
+    with torch.inference_mode():
+        expected, actual = model(x), pruned(x)
+    torch.testing.assert_close(actual, expected, rtol=1e-5, atol=1e-6)
+
+
+def test_bias_compensates_removed_constant_channels(meshnet):
+    model = _silence(meshnet, 0.3)
+    x = torch.rand(1, 1, 32, 32, 32)
+    # the next convs see zero padding around the constant, so the match
+    # holds where no padding is in the receptive field
+    inner = (slice(None),) * 2 + (slice(HALO, -HALO),) * 3
+    with torch.inference_mode():
+        expected = model(x)[inner]
+        compensated = _prune_silent(model, compensate=True)(x)[inner]
+        plain = _prune_silent(model, compensate=False)(x)[inner]
+    torch.testing.assert_close(compensated, expected, rtol=1e-5, atol=1e-5)
+    assert (plain - expected).abs().max() > 1e-2
+
+
+def test_original_is_left_alone(meshnet):
+    _silence(meshnet, 0.3)
+    before = {k: v.clone() for k, v in meshnet.state_dict().items()}
+    _prune_silent(meshnet, compensate=True)
+    after = meshnet.state_dict()
+    assert all(torch.equal(before[k], after[k]) for k in before)
+
+
+@pytest.mark.parametrize("scope", ["layer", "global"])
+def test_pruned_config_loads_the_pruned_state_dict(
+    meshnet, config_file, tmp_path, scope
+):
+    keep = select_channels(bn_scores(meshnet), 0.4, scope)
+    pruned = prune_meshnet(meshnet, keep)
+    config = pruned_config(meshnet_config(config_file, 1, 3, None), pruned)
+    widths = [layer["out_channels"] for layer in config["layers"][:-1]]
+    assert widths == [len(k) for k in keep]
+    path = str(tmp_path / "pruned.json")
+    with open(path, "w") as f:
+        json.dump(config, f)
+
+    rebuilt = enMesh_checkpoint(1, 3, None, path)
+    rebuilt.load_state_dict(pruned.state_dict())
+    x = torch.rand(1, 1, 12, 12, 12)
+    with torch.inference_mode():
+        expected, actual = pruned.eval()(x), rebuilt.eval()(x)
+    assert torch.equal(actual, expected)
@@ -0,0 +1,66 @@
+import json
+
+import pytest
+import torch
+import torch.nn as nn
+
+from js2pytorch import tfjs_to_pytorch
+from ptq import Calibration, export_int8
+
+
+@pytest.fixture
+def calibration(meshnet):
+    calibration = Calibration(meshnet)
+    calibration.observe(torch.rand(1, 1, 12, 12, 12))
+    return calibration
+
+
+def _convs(model):
+    return [m for m in model.modules() if isinstance(m, nn.Conv3d)]
+
+
+def _quantized_weights(quantized):
+    return [
+        m.weight().dequantize()
+        for m in quantized.modules()
+        if hasattr(m, "_weight_bias")
+    ]
+
+
+@pytest.mark.parametrize(
+    "per_channel,target", [(False, "tfjs"), (True, "js2pytorch")]
+)
+def test_int8_export_round_trip(calibration, tmp_path, per_channel, target):
+    export_int8(calibration, str(tmp_path), per_channel, target)
+    with open(tmp_path / "model.json") as f:
+        spec = json.load(f)
+    metadata = spec["userDefinedMetadata"]["int8"]
+    assert metadata["per_channel"] == per_channel
+    assert metadata["activation_ranges"] == json.loads(
+        json.dumps(calibration.ranges())
+    )
+    for entry in spec["weightsManifest"][0]["weights"]:
+        # kernels are int8 in the uint8 scheme, biases stay float32
+        if len(entry["shape"]) == 1:
+            assert "quantization" not in entry
+        else:
+            assert entry["quantization"]["dtype"] == "uint8"
+
+    loaded = tfjs_to_pytorch(str(tmp_path / "model.json")).eval()
+    expected = _quantized_weights(calibration.quantize(per_channel))
+    convs = _convs(loaded)
+    folded = _convs(calibration.layers)
+    assert len(convs) == len(expected) == len(folded)
+    for conv, weight, source in zip(convs, expected, folded):
+        # the file decodes to the weights QuantizedMeshNet runs
+        torch.testing.assert_close(conv.weight, weight, rtol=1e-6, atol=1e-7)
+        assert torch.equal(conv.bias, source.bias)
+
+
+def test_int8_output_stays_close_to_float(calibration, tmp_path):
+    export_int8(calibration, str(tmp_path))
+    loaded = tfjs_to_pytorch(str(tmp_path / "model.json")).eval()
+    x = torch.rand(1, 1, 12, 12, 12)
+    with torch.inference_mode():
+        expected, actual = calibration.layers(x), loaded(x)
+    assert (actual - expected).abs().max() < 0.05 * expected.abs().max()
@@ -0,0 +1,19 @@
+import torch
+
+from roundtrip import roundtrip, synthetic_volumes
+
+
+def test_roundtrip_of_the_shipped_export(meshnet, config_file, tmp_path):
+    checkpoint = str(tmp_path / "model.pth")
+    torch.save(meshnet.state_dict(), checkpoint)
+    report = roundtrip(
+        checkpoint,
+        config_file,
+        None,
+        3,
+        synthetic_volumes(12),
+        workdir=str(tmp_path / "tfjs"),
+    )
+    for result in report["volumes"].values():
+        assert result["max_abs_error"] < 1e-4
+        assert result["argmax_agreement"] == 1.0
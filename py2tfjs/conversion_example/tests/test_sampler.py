@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+from sampler import SubvolumeDataset, grid_corners, make_loader, prepare
+
+
+def _save(path, array):
+    np.save(path, array)
+    return str(path)
+
+
+@pytest.fixture
+def volumes(tmp_path):
+    rng = np.random.default_rng(0)
+    images, labels = [], []
+    for i, (shape, dtype, top) in enumerate(
+        [((12, 10, 9), np.uint8, 255), ((9, 11, 10), np.uint16, 300)]
+    ):
+        image = rng.random(shape, dtype=np.float32)
+        label = rng.integers(0, top + 1, shape).astype(dtype)
+        label[0, 0, 0] = top
+        images.append(_save(tmp_path / f"image{i}.npy", image))
+        labels.append(_save(tmp_path / f"labels{i}.npy", label))
+    return images, labels
+
+
+def test_grid_corners_cover_the_volume():
+    shape, sub = (10, 7, 9), (4, 7, 3)
+    covered = np.zeros(shape, dtype=int)
+    for corner in grid_corners(shape, sub):
+        region = tuple(slice(c, c + s) for c, s in zip(corner, sub))
+        covered[region] += 1
+    assert covered.min() == 1
+
+
+def test_grid_mode_yields_every_grid_subvolume_once(volumes):
+    images, labels = volumes
+    dataset = SubvolumeDataset(
+        images, labels, (4, 4, 4), batch_size=3, mode="grid"
+    )
+    loader = make_loader(dataset, num_workers=2, pin_memory=False)
+    seen = []
+    for x, y in loader:
+        assert x.shape[1:] == (1, 4, 4, 4) and y.shape[1:] == (4, 4, 4)
+        seen.extend(subvolume.tobytes() for subvolume in x.numpy()[:, 0])
+    expected = []
+    for path in images:
+        image = np.load(path)
+        for corner in grid_corners(image.shape, (4, 4, 4)):
+            region = tuple(slice(c, c + 4) for c in corner)
+            expected.append(image[region].tobytes())
+    assert sorted(seen) == sorted(expected)
+
+
+def test_label_batches_are_never_narrowed(volumes):
+    images, labels = volumes
+    dataset = SubvolumeDataset(
+        images, labels, (9, 9, 9), batch_size=2, mode="grid"
+    )
+    largest = set()
+    for x, y in dataset:
+        assert y.numpy().dtype == np.uint16
+        largest.add(int(y.numpy().max()))
+    # uint16 labels of 300 used to wrap around to 44 in uint8 batches
+    assert {255, 300} <= largest
+
+
+def test_subvolumes_larger_than_a_volume_are_rejected(volumes):
+    images, labels = volumes
+    for mode in ("random", "grid"):
+        with pytest.raises(ValueError, match="do not fit"):
+            SubvolumeDataset(images, labels, (10, 10, 10), mode=mode)
+    with pytest.raises(ValueError, match="do not fit"):
+        grid_corners((8, 8, 8), (9, 4, 4))
+
+
+def test_prepare_keeps_large_labels(tmp_path):
+    nib = pytest.importorskip("nibabel")
+    image = np.random.default_rng(1).random((6, 6, 6)).astype(np.float32)
+    labels = np.zeros((6, 6, 6), dtype=np.int32)
+    labels[1, 2, 3] = 300
+    affine = np.eye(4)
+    nib.save(nib.Nifti1Image(image, affine), str(tmp_path / "t1.nii.gz"))
+    nib.save(nib.Nifti1Image(labels, affine), str(tmp_path / "seg.nii.gz"))
+    image_path, label_path = prepare(
+        str(tmp_path / "t1.nii.gz"), str(tmp_path / "seg.nii.gz"), tmp_path
+    )
+    stored = np.load(label_path)
+    assert stored.dtype == np.uint16 and stored[1, 2, 3] == 300
+    assert np.load(image_path).dtype == np.float32
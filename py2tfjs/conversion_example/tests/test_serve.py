@@ -0,0 +1,61 @@
+import pytest
+import torch
+
+from serve import Batcher, Metrics
+
+TIMEOUT = 30
+
+
+@pytest.fixture
+def batcher(meshnet):
+    return Batcher("test", meshnet.model, Metrics(), max_batch=2, tile=8)
+
+
+def _expected(meshnet, x):
+    with torch.inference_mode():
+        return meshnet.model(x)[0].argmax(0)
+
+
+def test_batcher_segments_tiled_volumes(batcher, meshnet):
+    x = torch.rand(1, 1, 12, 10, 9)
+    labels = batcher.submit(x).result(TIMEOUT)
+    logits = batcher.submit(x, labels=False).result(TIMEOUT)
+    assert torch.equal(labels, _expected(meshnet, x).to(labels.dtype))
+    with torch.inference_mode():
+        expected = meshnet.model(x)
+    torch.testing.assert_close(logits, expected, rtol=0, atol=1e-4)
+
+
+def test_batcher_survives_a_failing_stitch(batcher, meshnet, monkeypatch):
+    stitch = batcher._stitch
+    failures = []
+
+    def fail_once(*args):
+        if not failures:
+            failures.append(args)
+            raise RuntimeError("stitching failed")
+        return stitch(*args)
+
+    monkeypatch.setattr(batcher, "_stitch", fail_once)
+    x = torch.rand(1, 1, 12, 12, 12)
+    with pytest.raises(RuntimeError, match="stitching failed"):
+        batcher.submit(x).result(TIMEOUT)
+
+    # the batcher thread is still alive and serves later requests
+    y = torch.rand(1, 1, 9, 9, 9)
+    labels = batcher.submit(y).result(TIMEOUT)
+    assert torch.equal(labels, _expected(meshnet, y).to(labels.dtype))
+    assert batcher._thread.is_alive()
+    assert batcher.metrics.counters["test.errors"] == 1
+
+
+def test_batcher_survives_a_failing_forward(batcher, meshnet):
+    # get a 2-channel volume past submit's check to make the conv fail
+    wrong = torch.rand(1, 2, 8, 8, 8)
+    batcher.in_channels = 2
+    with pytest.raises(RuntimeError):
+        batcher.submit(wrong).result(TIMEOUT)
+    batcher.in_channels = 1
+    x = torch.rand(1, 1, 8, 8, 8)
+    labels = batcher.submit(x).result(TIMEOUT)
+    assert torch.equal(labels, _expected(meshnet, x).to(labels.dtype))
@@ -0,0 +1,87 @@
+import pytest
+import torch
+from conftest import write_config
+
+from meshnet import enMesh_checkpoint
+from tiling import model_halo, plan_core_size, tile_nbytes, tiled_inference
+
+
+@pytest.fixture
+def volume():
+    generator = torch.Generator().manual_seed(1)
+    return torch.rand(1, 1, 20, 18, 22, generator=generator)
+
+
+def _full(model, x):
+    with torch.inference_mode():
+        return model.model(x)
+
+
+def test_halo_of_config(meshnet):
+    # dilations 1, 2, 4, 2, 1 of 3x3x3 convs and a 1x1x1 head
+    assert model_halo(meshnet) == (10, 10, 10)
+
+
+@pytest.mark.parametrize("core_size", [4, 7, (5, 9, 11)])
+def test_tiled_relu_model_is_bit_identical(tmp_path, volume, core_size):
+    torch.manual_seed(0)
+    config = write_config(tmp_path / "relu.json", gelu=False)
+    model = enMesh_checkpoint(1, 3, None, config).eval()
+    actual = tiled_inference(model.model, volume, core_size=core_size)
+    assert torch.equal(actual, _full(model, volume))
+
+
+@pytest.mark.parametrize("core_size", [4, 7, (5, 9, 11)])
+def test_tiled_elu_model_matches_to_rounding(meshnet, volume, core_size):
+    actual = tiled_inference(meshnet.model, volume, core_size=core_size)
+    torch.testing.assert_close(
+        actual, _full(meshnet, volume), rtol=0, atol=1e-6
+    )
+
+
+@pytest.mark.parametrize("gelu", [False, True])
+def test_batched_tiles_match_to_tolerance(tmp_path, volume, gelu):
+    # batched convs sum in another order: close, not bit-identical
+    torch.manual_seed(0)
+    config = write_config(tmp_path / "model.json", gelu=gelu)
+    model = enMesh_checkpoint(1, 3, None, config).eval()
+    actual = tiled_inference(model.model, volume, core_size=6, batch_size=3)
+    torch.testing.assert_close(
+        actual, _full(model, volume), rtol=0, atol=1e-4
+    )
+
+
+def test_tile_estimate_is_clipped_to_the_volume():
+    shape, halo = (48, 48, 48), (112, 112, 112)
+    whole = 2 * 48**3 * 5 * 4
+    assert tile_nbytes(shape, halo, 5, batch_size=2, shape=shape) == whole
+    assert tile_nbytes(shape, halo, 5) > whole
+    assert plan_core_size(shape, halo, 5, 50 * 2**20, batch_size=2) == shape
+
+
+def test_budget_covers_input_and_output(meshnet):
+    volume = torch.rand(1, 1, 40, 36, 44)
+    halo, shape = (10, 10, 10), tuple(volume.shape[2:])
+    fixed = volume.nbytes + 3 * volume[0, 0].nbytes
+    full = tile_nbytes(shape, halo, 4, shape=shape)
+    assert plan_core_size(shape, halo, 4, full) == shape
+    core = plan_core_size(shape, halo, 4, full, fixed=fixed)
+    assert all(c < s for c, s in zip(core, shape))
+    with pytest.raises(ValueError, match="does not fit"):
+        plan_core_size(shape, halo, 4, fixed, fixed=fixed)
+
+    actual = tiled_inference(meshnet.model, volume, memory_budget=full)
+    expected = tiled_inference(meshnet.model, volume, core_size=core)
+    assert torch.equal(actual, expected)
+
+
+def test_large_halo_falls_back_to_a_full_pass(meshnet, volume):
+    actual = tiled_inference(
+        meshnet.model, volume, memory_budget=2**20, halo=112, batch_size=2
+    )
+    assert torch.equal(actual, _full(meshnet, volume))
+
+
+def test_budget_too_small_raises(meshnet, volume):
+    with pytest.raises(ValueError, match="does not fit"):
+        tiled_inference(meshnet.model, volume, memory_budget=1000)
@@ -0,0 +1,209 @@
+import itertools
+
+import torch
+import torch.nn as nn
+
+
+def config_halo(config):
+    """Receptive-field radius in voxels of a MeshNet config json.
+
+    Every MeshNet conv is stride 1 with "same" padding, so each layer
+    widens the receptive field by ``(kernel_size - 1) // 2 * dilation``
+    voxels on each side.
+    """
+    return sum(
+        (layer["kernel_size"] - 1) // 2 * layer["dilation"]
+        for layer in config["layers"]
+    )
+
+
+def conv3d_layers(model):
+    """The Conv3d modules of a model in execution order"""
+    return [m for m in model.modules() if isinstance(m, nn.Conv3d)]
+
+
+def model_halo(model):
+    """Per-axis receptive-field radius of a MeshNet-like model.
+
+    Works for MeshNet/enMesh_checkpoint as well as the nn.Sequential built
+    by js2pytorch.tfjs_to_pytorch.
+    """
+    halo = [0, 0, 0]
+    for conv in conv3d_layers(model):
+        for axis in range(3):
+            radius = (conv.kernel_size[axis] - 1) // 2 * conv.dilation[axis]
+            if conv.stride[axis] != 1 or conv.padding[axis] != radius:
+                raise ValueError(
+                    "Tiled inference needs stride 1 convs with same padding"
+                )
+            halo[axis] += radius
+    return tuple(halo)
+
+
+def max_channels(model):
+    """Widest activation of the model, in channels"""
+    return max(
+        max(conv.in_channels, conv.out_channels)
+        for conv in conv3d_layers(model)
+    )
+
+
+def tile_nbytes(
+    core_size, halo, channels, batch_size=1, itemsize=4, shape=None
+):
+    """Working memory of one tile batch: the input and output activation
+    of the widest layer over the core plus its halo.
+
+    With the volume ``shape`` tiles are clipped to it, as iter_tiles
+    clips them, and a batch holds no more tiles than the volume has.
+    """
+    voxels = 1
+    n_tiles = 1
+    for axis in range(3):
+        extent = core_size[axis] + 2 * halo[axis]
+        if shape is not None:
+            extent = min(extent, shape[axis])
+            n_tiles *= -(-shape[axis] // core_size[axis])
+        voxels *= extent
+    if shape is not None:
+        batch_size = min(batch_size, n_tiles)
+    return 2 * batch_size * voxels * channels * itemsize
+
+
+def plan_core_size(
+    shape, halo, channels, memory_budget, batch_size=1, fixed=0
+):
+    """Largest cubic tile core whose tile batch fits ``memory_budget``,
+    the whole volume when a full pass fits.
+
+    ``fixed`` bytes are resident whatever the tiling, such as the whole
+    input and output volumes, and are taken off the budget first.
+    """
+    for size in range(max(shape), 0, -1):
+        core = tuple(min(size, dim) for dim in shape)
+        need = tile_nbytes(core, halo, channels, batch_size, shape=shape)
+        if fixed + need <= memory_budget:
+            return core
+    raise ValueError(
+        f"A {batch_size}-tile batch with a {halo} halo does not fit in "
+        f"{memory_budget} bytes next to {fixed} bytes of input and output"
+    )
+
+
+def iter_tiles(shape, core_size, halo):
+    """Yield ``(core, tile)`` slice triples covering a volume.
+
+    ``core`` is the region of the output a tile is responsible for and
+    ``tile`` the input region it needs: the core grown by the halo,
+    clipped at the volume border where the model's own zero padding
+    already matches full-volume inference.
+    """
+    starts = [range(0, dim, core) for dim, core in zip(shape, core_size)]
+    for corner in itertools.product(*starts):
+        core, tile = [], []
+        for axis, start in enumerate(corner):
+            stop = min(start + core_size[axis], shape[axis])
+            core.append(slice(start, stop))
+            tile.append(
+                slice(
+                    max(start - halo[axis], 0),
+                    min(stop + halo[axis], shape[axis]),
+                )
+            )
+        yield tuple(core), tuple(tile)
+
+
+def _run_batch(model, x, batch, out):
+    """Run same-shaped tiles together and stitch their cores into ``out``"""
+    inputs = torch.cat([x[(slice(None), slice(None)) + t] for _, t in batch])
+    outputs = model(inputs)
+    for i, (core, tile) in enumerate(batch):
+        # position of the core inside the tile
+        inner = tuple(
+            slice(c.start - t.start, c.stop - t.start)
+            for c, t in zip(core, tile)
+        )
+        out[(slice(None), slice(None)) + core] = outputs[
+            (slice(i, i + 1), slice(None)) + inner
+        ]
+
+
+def tiled_inference(
+    model,
+    x,
+    memory_budget=None,
+    core_size=None,
+    batch_size=1,
+    halo=None,
+    out=None,
+):
+    """Run a MeshNet over a volume tile by tile.
+
+    Each tile carries exactly the model's receptive-field halo, so every
+    output voxel sees the same inputs and zero padding as in a
+    full-volume pass. The arithmetic is not always the same, though:
+
+    - ``batch_size=1``: every conv matches the full pass bit for bit on
+      CPU, so ReLU models are bit-identical. ELU's vectorized kernel may
+      still round the last bit differently (about 6e-8).
+    - ``batch_size > 1``: batched convs sum in a different order, and
+      outputs differ from the full pass by up to about 1e-5.
+
+    Where bit-identical output is required, keep ``batch_size=1``.
+
+    Args:
+        model (nn.Module): MeshNet, enMesh_checkpoint or tfjs_to_pytorch
+            model.
+        x (torch.Tensor): Input of shape (1, C, D, H, W).
+        memory_budget (int): Bytes for the whole input and output
+            volumes plus the activations of a tile batch, used to pick
+            ``core_size`` when it is not given.
+        core_size (int or tuple): Edge of the output region of a tile.
+        batch_size (int): Tiles run through the model per call; above 1
+            the output matches a full pass to about 1e-5, see above.
+        halo (tuple): Override the receptive-field radius of the model.
+        out (torch.Tensor): Preallocated (1, n_classes, D, H, W) output.
+
+    Returns:
+        torch.Tensor: The stitched model output.
+    """
+    if x.shape[0] != 1:
+        raise ValueError("tiled_inference takes a single volume")
+    shape = tuple(x.shape[2:])
+    if halo is None:
+        halo = model_halo(model)
+    elif isinstance(halo, int):
+        halo = (halo,) * 3
+    n_classes = conv3d_layers(model)[-1].out_channels
+    if core_size is None:
+        if memory_budget is None:
+            core_size = shape
+        else:
+            fixed = x.nbytes + n_classes * x[0, 0].nbytes
+            core_size = plan_core_size(
+                shape,
+                halo,
+                max_channels(model),
+                memory_budget,
+                batch_size,
+                fixed=fixed,
+            )
+    elif isinstance(core_size, int):
+        core_size = (core_size,) * 3
+
+    if out is None:
+        out = x.new_empty((1, n_classes) + shape)
+
+    # border tiles are smaller, so tiles are batched by input shape
+    pending = {}
+    with torch.inference_mode():
+        for core, tile in iter_tiles(shape, core_size, halo):
+            key = tuple(t.stop - t.start for t in tile)
+            batch = pending.setdefault(key, [])
+            batch.append((core, tile))
+            if len(batch) == batch_size:
+                _run_batch(model, x, batch, out)
+                del pending[key]
+        for batch in pending.values():
+            _run_batch(model, x, batch, out)
+    return out
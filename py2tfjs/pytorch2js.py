@@ -1,11 +1,7 @@
-from blendbatchnorm import fuse_bn_recursively
-import onnx
-from onnx2keras import onnx_to_keras
 import torch
-import numpy as np
+from conversion_example.meshnet2tfjs import meshnet2tfjs
 from meshnet import MeshNet
-import tensorflowjs as tfjs
-from fixmodeljson import fixjson_file
+
 
 def preprocess_image(img):
     """Unit interval preprocessing"""
@@ -22,20 +18,14 @@ scube = 64
 model_path = '../meshnet_gmwm_dropout_train.30_full.pth'
 #'meshnet_gmwm_dropout_train.30_full.pth'#'meshnet_gmwm_train.30_full.pth'
 
-device_name = "cuda:0" if torch.cuda.is_available() else "cpu"
-device = torch.device(device_name)
-meshnet_model = MeshNet(n_channels=1, n_classes=n_classes, large=False)
-
-meshnet_model.load_state_dict(torch.load(model_path, map_location=device)['model_state_dict'])
-
-meshnet_model.to(device)
-mnm = fuse_bn_recursively(meshnet_model)
-mnm.model.eval();
-
-x = torch.randn(1, 1, scube, scube, scube, requires_grad=True)
-torch.onnx.export(mnm, x.to(device), '/tmp/mnm_model_large.onnx', export_params=True, opset_version=13, do_constant_folding=True, input_names = ['input'], output_names = ['output'],dynamic_axes={'input' : {0 : 'batch_size'},'output' : {0 : 'batch_size'}})
-onnx_model = onnx.load('/tmp/mnm_model_large.onnx')
-k_model = onnx_to_keras(onnx_model, ['input'])
-
-tfjs.converters.save_keras_model(k_model, '/tmp/mnm_gmwm_dropout256')
-fixjson_file('/tmp/mnm_gmwm_dropout256/model.json', scube=scube)
+if __name__ == "__main__":
+    meshnet_model = MeshNet(n_channels=1, n_classes=n_classes, large=False)
+    meshnet_model.load_state_dict(
+        torch.load(model_path, map_location="cpu")['model_state_dict']
+    )
+    meshnet_model.eval()
+
+    # BatchNorm is folded and Dropout left out while writing, so neither
+    # fuse_bn_recursively nor the ONNX/onnx2keras round trip and
+    # fixjson_file's ZeroPadding3D clean-up are needed any more
+    meshnet2tfjs(meshnet_model, '/tmp/mnm_gmwm_dropout256', cube=scube)